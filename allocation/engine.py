@@ -10,6 +10,8 @@ TODO: Refactor #1 - have one AllocationResult PER INSTANCE so that each can be
     #TODO: Do we have rules that 'use time' that are NOT
     # directed at instances? (Global?)
 """
+from bisect import bisect_left, bisect_right
+
 import pytz
 
 from django.utils.timezone import timedelta, datetime
@@ -17,7 +19,17 @@ from django.utils.timezone import timedelta, datetime
 from threepio import logger
 
 from allocation.models import AllocationResult, GlobalRule, InstanceResult,\
-    InstanceRule, InstanceHistoryResult
+    InstanceRule, InstanceHistoryResult, IgnoreStatusRule, IgnoreMachineRule,\
+    IgnoreProviderRule, MultiplyBurnTime, MultiplySizeCPU, MultiplySizeDisk,\
+    MultiplySizeRAM
+
+
+# These rules only look at the instance's provider/machine and the
+# history's status/size, so the 'time per second' they produce can be
+# shared by every history with the same values.
+MEMOIZABLE_RULES = (IgnoreStatusRule, IgnoreMachineRule, IgnoreProviderRule,
+                    MultiplyBurnTime, MultiplySizeCPU, MultiplySizeDisk,
+                    MultiplySizeRAM)
 
 
 def _get_zero_date_utc():
@@ -48,8 +60,91 @@ def get_allocation_window(allocation,
     return window_start_date, window_end_date
 
 
+def _get_epoch_microseconds(date):
+    delta = date - _EPOCH_DATE
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+_EPOCH_DATE = _get_zero_date_utc()
+# Stands in for the 'end_date' of a history that has not ended.
+_NO_END_DATE = float('inf')
+
+
+class InstanceHistoryTable(object):
+
+    """
+    The history of a single instance, laid out ONCE per allocation as
+    columns of start/end times (in microseconds since epoch).
+    Each time period can then find the histories that were running
+    with two bisects, instead of comparing dates for every history.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.histories = list(instance.history)
+        self.starts = [_get_epoch_microseconds(history.start_date)
+                       for history in self.histories]
+        self.ends = [_get_epoch_microseconds(history.end_date)
+                     if history.end_date else _NO_END_DATE
+                     for history in self.histories]
+        # The result for a history with no time used in a period.
+        # These are never modified, so they are shared between periods.
+        self.zero_results = [
+            InstanceHistoryResult(status_name=history.status)
+            for history in self.histories]
+        self.is_sorted = all(
+            self.starts[idx] <= self.starts[idx + 1]
+            for idx in xrange(len(self.starts) - 1))
+        # Running maximum of end dates, always sorted.
+        self.max_ends = []
+        max_end = None
+        for end in self.ends:
+            max_end = end if max_end is None else max(max_end, end)
+            self.max_ends.append(max_end)
+
+    def running_between(self, start_date, end_date):
+        """
+        Return the index of every history that did NOT end before
+        'start_date' and did NOT start after 'end_date'
+        """
+        start = _get_epoch_microseconds(start_date)
+        end = _get_epoch_microseconds(end_date)
+        if self.is_sorted:
+            first = bisect_left(self.max_ends, start)
+            last = bisect_right(self.starts, end)
+        else:
+            first, last = 0, len(self.histories)
+        return [idx for idx in xrange(first, last)
+                if self.ends[idx] >= start and self.starts[idx] <= end]
+
+
 # Main ###
-def calculate_allocation(allocation, print_logs=False):
+def calculate_allocations(allocations, print_logs=False):
+    """
+    Batch version of 'calculate_allocation'.
+    Given a list of allocations (Ex: Every identity on a provider), return
+    the list of AllocationResults in the same order.
+    Rule evaluation is shared between all allocations, so running a whole
+    provider at once is much cheaper than one allocation at a time.
+    """
+    rate_cache = {}
+    return [calculate_allocation(allocation, print_logs=print_logs,
+                                 rate_cache=rate_cache)
+            for allocation in allocations]
+
+
+def calculate_allocation(allocation, print_logs=False, rate_cache=None,
+                         counted_results=None):
+    """
+    counted_results - Usage that was counted previously and is NOT part of
+                      allocation.instances. A dict of:
+                      {period start_date: {instance identifier: [
+                          InstanceHistoryResult, ...]}}
+    """
+    if counted_results is None:
+        counted_results = {}
+    if rate_cache is None:
+        rate_cache = {}
     (window_start_date, window_end_date) = get_allocation_window(allocation)
 
     # FYI: Calculates time periods based on allocation.credits
@@ -73,6 +168,9 @@ def calculate_allocation(allocation, print_logs=False):
             instance_rules.append(rule)
         else:
             raise Exception("Unknown Type of Rule: %s" % rule)
+    rules_key = _get_rules_key(instance_rules)
+    history_tables = [InstanceHistoryTable(instance)
+                      for instance in allocation.instances]
     time_forward = timedelta(0)
     for current_period in current_result.time_periods:
         if current_result.carry_forward and time_forward:
@@ -86,21 +184,34 @@ def calculate_allocation(allocation, print_logs=False):
         # Second loop - Go through all the instances and apply
         #              the specific rules (This loop relates to time USED)
         instance_results = []
+        period_counted = counted_results.get(
+            current_period.start_counting_date, {})
 
-        for instance in allocation.instances:
+        for history_table in history_tables:
+            instance = history_table.instance
             # "Chatty" Warning - Uncomment at your own risk
             # logger.debug("> > Calculating Instance history:%s"
             #             % instance.identifier)
             history_list = _calculate_instance_history_list(
-                instance, instance_rules,
+                history_table, instance_rules,
                 current_period.start_counting_date,
                 current_period.stop_counting_date,
-                print_logs=print_logs)
+                print_logs=print_logs,
+                rate_cache=rate_cache, rules_key=rules_key)
+            history_list = period_counted.get(instance.identifier, []) \
+                + history_list
             if not history_list:
                 continue
             instance_result = InstanceResult(
                 identifier=instance.identifier, history_list=history_list)
             instance_results.append(instance_result)
+        # Instances whose history has ALL been counted previously
+        calculated = set(result.identifier for result in instance_results)
+        for identifier, history_list in period_counted.items():
+            if identifier in calculated or not history_list:
+                continue
+            instance_results.append(InstanceResult(
+                identifier=identifier, history_list=list(history_list)))
 
         if print_logs:
             logger.debug("> > Instance history Results:")
@@ -127,42 +238,49 @@ def _multiply_time_delta(timedelta1, timedelta2):
     return timedelta(seconds=time_seconds)
 
 
-def _calculate_instance_history_list(instance, rules, start_date, end_date,
-                                     print_logs=False):
-    """
-    Given an instance and a set of 'InstanceRules'
-    Calculate the time used for every history
+def _calculate_instance_history_list(history_table, rules,
+                                     start_date, end_date,
+                                     print_logs=False,
+                                     rate_cache=None, rules_key=None):
     """
-    # Calculate time used by applying rules to each history and keeping a
-    # running total for each status
-    history_list = []
-    for history in instance.history:
-        history_result = InstanceHistoryResult(status_name=history.status)
-        if history.end_date and history.end_date < start_date:
-            history_result.clock_time = timedelta(0)
-            history_list.append(history_result)
-            continue
+    Given an instance (as an InstanceHistoryTable) and a set of
+    'InstanceRules' Calculate the time used for every history
 
+    rate_cache - dict of 'time per second' results, shared between time
+                 periods (and allocations) to avoid re-applying rules.
+    """
+    if rate_cache is None:
+        rate_cache = {}
+    instance = history_table.instance
+    # Every history that was NOT running between start_date and end_date
+    # keeps its 'zero' result, the rest are calculated below.
+    history_list = list(history_table.zero_results)
+    for index in history_table.running_between(start_date, end_date):
+        history = history_table.histories[index]
         clock_time = _get_clock_time(history, start_date, end_date,
                                      print_logs=print_logs)
 
         if clock_time == timedelta(0):
             # do we need this? seems like it could cause unforseen problems
-            history_result.clock_time = clock_time
-            history_list.append(history_result)
             continue
 
         # NOTE: There are some limitations to an implementation like this
         #       Ex: A rule that starts 'halfway' between start and end date
         #          (Is that a thing?)
-        time_per_second = _running_time_per_second(history, instance, rules)
+        rate_key = _get_rate_key(instance, history, rules_key)
+        time_per_second = rate_cache.get(rate_key)
+        if time_per_second is None:
+            time_per_second = _running_time_per_second(
+                history, instance, rules)
+            rate_cache[rate_key] = time_per_second
         running_time = _multiply_time_delta(clock_time, time_per_second)
+        history_result = InstanceHistoryResult(status_name=history.status)
         history_result.clock_time += clock_time
         history_result.total_time += running_time
 
         if _get_burn_rate_test(history, end_date):
             history_result.burn_rate += time_per_second
-        history_list.append(history_result)
+        history_list[index] = history_result
 
     return history_list
 
@@ -227,3 +345,33 @@ def _running_time_per_second(history, instance, rules):
         # returns it as a result
         running_time = rule.apply_rule(instance, history, running_time)
     return running_time
+
+
+def _get_rules_key(rules):
+    """
+    Returns a hashable representation of 'rules'
+    or None if any rule could depend on more than provider, machine,
+    status and size.
+    """
+    rules_key = []
+    for rule in rules:
+        if rule.__class__ not in MEMOIZABLE_RULES:
+            return None
+        value = getattr(rule, 'value', None)
+        if isinstance(value, list):
+            value = tuple(value)
+        rules_key.append(
+            (rule.__class__, value, getattr(rule, 'multiplier', None)))
+    return tuple(rules_key)
+
+
+def _get_rate_key(instance, history, rules_key):
+    if rules_key is None:
+        # Unknown rules: Only share the rate between time periods
+        # of the very same history.
+        return (id(instance), id(history))
+    size = history.size
+    return (rules_key, history.status,
+            size.cpu, size.ram, size.disk,
+            getattr(instance.machine, 'identifier', None),
+            getattr(instance.provider, 'identifier', None))
@@ -107,6 +107,7 @@ class Instance(object):
             # Shorter list
             history_list = core_instance.instancestatushistory_set.filter(
                 Q(end_date=None) | Q(end_date__gt=start_date))
+        history_list = history_list.select_related('size', 'status')
         for history in history_list.order_by('start_date'):
             alloc_history = InstanceHistory.from_core(history)
             instance_history.append(alloc_history)
@@ -30,20 +30,24 @@ class PythonAllocationStrategy(object):
         self.recharge_behaviors = recharge_behaviors
         self.rule_behaviors = rule_behaviors
 
-    def get_instance_list(self, identity):
+    def get_instance_list(self, identity, counted_until=None):
+        """
+        counted_until - History that ended on/before this date has been
+                        counted already and will NOT be included.
+        """
         from service.monitoring import _core_instances_for
+        start_date = self.counting_behavior.start_date
+        if counted_until and (not start_date or counted_until > start_date):
+            start_date = counted_until
         # Retrieve the core that could have an impact..
-        core_instances = _core_instances_for(
-            identity,
-            self.counting_behavior.start_date)
+        core_instances = _core_instances_for(identity, start_date)
         # Convert Core Models --> Allocation/core Models
-        alloc_instances = [AllocInstance.from_core(
-            inst, self.counting_behavior.start_date)
-            for inst in core_instances]
+        alloc_instances = [AllocInstance.from_core(inst, start_date)
+                           for inst in core_instances]
         return alloc_instances
 
-    def apply(self, identity, core_allocation):
-        instances = self.get_instance_list(identity)
+    def apply(self, identity, core_allocation, counted_until=None):
+        instances = self.get_instance_list(identity, counted_until)
 
         credits = []
         for behavior in self.recharge_behaviors:
@@ -520,6 +520,85 @@ class TestAllocationEngine(AllocationTestCase):
         allocation = self.allocation_helper.to_allocation()
         self.assertTotalRuntimeEquals(allocation, timedelta(days=45))
 
+    def test_batch_allocations_match_single_allocations(self):
+        """
+        Assert that 'calculate_allocations' matches 'calculate_allocation'
+        for every allocation in the batch
+        """
+        start_time = datetime(2014, 7, 4, hour=12, tzinfo=pytz.utc)
+        end_time = start_time + timedelta(days=3)
+        allocations = []
+        for size in ["test.tiny", "test.small", "test.medium", "test.large"]:
+            allocation_helper = AllocationHelper(
+                self.allocation_helper.start_window,
+                self.allocation_helper.end_window,
+                self.allocation_helper.start_window,
+                interval_delta=relativedelta(days=7))
+            helper = InstanceHelper()
+            helper.add_history_entry(start_time, end_time, size=size)
+            helper.add_history_entry(
+                end_time, end_time + timedelta(days=3),
+                status="suspended", size=size)
+            allocation_helper.add_instance(
+                helper.to_instance("Instance %s" % size))
+            allocations.append(allocation_helper.to_allocation())
+
+        batch_results = engine.calculate_allocations(allocations)
+        self.assertEqual(len(batch_results), len(allocations))
+        for allocation, batch_result in zip(allocations, batch_results):
+            result = engine.calculate_allocation(allocation)
+            self.assertEqual(batch_result.total_runtime(),
+                             result.total_runtime())
+            self.assertEqual(batch_result.total_difference(),
+                             result.total_difference())
+            self.assertEqual(batch_result.get_burn_rate(),
+                             result.get_burn_rate())
+
+    def test_counted_results_match_full_allocation(self):
+        """
+        Assert that counting history ahead of time (As the allocation
+        ledger does) and passing it in as 'counted_results' matches
+        counting all the history at once.
+        """
+        start_time = datetime(2014, 7, 4, hour=12, tzinfo=pytz.utc)
+        end_time = start_time + timedelta(days=10)
+
+        def _new_allocation(history_dates):
+            allocation_helper = AllocationHelper(
+                self.allocation_helper.start_window,
+                self.allocation_helper.end_window,
+                self.allocation_helper.start_window,
+                interval_delta=relativedelta(days=7))
+            helper = InstanceHelper()
+            for (status, start, end) in history_dates:
+                helper.add_history_entry(start, end, status=status)
+            allocation_helper.add_instance(helper.to_instance("Instance 1"))
+            return allocation_helper.to_allocation()
+
+        closed_history = [("active", start_time, end_time)]
+        open_history = [("suspended", end_time, end_time + timedelta(days=5)),
+                        ("active", end_time + timedelta(days=5), None)]
+        full_result = engine.calculate_allocation(
+            _new_allocation(closed_history + open_history))
+        closed_result = engine.calculate_allocation(
+            _new_allocation(closed_history))
+        counted_results = {}
+        for time_period in closed_result.time_periods:
+            counted_results[time_period.start_counting_date] = {
+                instance_result.identifier: instance_result.history_list
+                for instance_result in time_period.instance_results}
+        result = engine.calculate_allocation(
+            _new_allocation(open_history), counted_results=counted_results)
+
+        self.assertEqual(result.total_runtime(), full_result.total_runtime())
+        self.assertEqual(result.total_difference(),
+                         full_result.total_difference())
+        self.assertEqual(result.get_burn_rate(), full_result.get_burn_rate())
+        for time_period, full_period in zip(result.time_periods,
+                                            full_result.time_periods):
+            self.assertEqual(time_period.total_instance_runtime(),
+                             full_period.total_instance_runtime())
+
 
 # From the REPL
 def repl_profile_test_1():
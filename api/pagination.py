@@ -1,7 +1,17 @@
 """
 custom pagination support
 """
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import six
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 # NOTE: this value is set here for v1 api support
 DEFAULT_PAGINATION_SIZE = 20
@@ -28,6 +38,117 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
 
+
+class CursorResultsSetPagination(StandardResultsSetPagination):
+
+    """
+    Supports pagination with page numbers (By default) or with a cursor.
+
+    When '?cursor' is passed (Empty for the first page), results are found
+    by 'position' (Ex: WHERE (start_date, id) < (...)) instead of OFFSET
+    and there is no COUNT(*). Follow 'next' until it is null.
+
+    Views can set 'cursor_ordering', it must be unique (End with the id).
+    """
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-start_date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super(CursorResultsSetPagination, self).paginate_queryset(
+                queryset, request, view=view)
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'cursor_ordering', self.cursor_ordering)
+        self.fields = [_get_field(queryset.model, order.lstrip('-'))
+                       for order in self.ordering]
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position:
+            queryset = queryset.filter(self._get_keyset_query(position))
+        # Fetch one extra item, to find out if there is a next page.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            self.next_position = self._get_position(self.page[-1])
+        else:
+            self.next_position = None
+        return self.page
+
+    def _get_keyset_query(self, position):
+        """
+        (a, b) < (x, y) == (a < x) OR (a == x AND b < y)
+        """
+        query = None
+        for index, order in enumerate(self.ordering):
+            lookup = '__lt' if order.startswith('-') else '__gt'
+            condition = Q(**{order.lstrip('-') + lookup: position[index]})
+            for prev_order, prev_value in zip(self.ordering[:index],
+                                              position[:index]):
+                condition &= Q(**{prev_order.lstrip('-'): prev_value})
+            query = condition if query is None else query | condition
+        return query
+
+    def _get_position(self, obj):
+        position = []
+        for order in self.ordering:
+            value = obj
+            for attr in order.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position.append(six.text_type(value))
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(
+                urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(position) != len(self.fields):
+                raise ValueError("Cursor does not match the ordering")
+            return [field.to_python(value)
+                    for field, value in zip(self.fields, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(json.dumps(position).encode('utf-8'))
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super(CursorResultsSetPagination, self).get_next_link()
+        if not self.next_position:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super(CursorResultsSetPagination, self)\
+                .get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+
+def _get_field(model, field_path):
+    """
+    Return the model field for 'field_path' (Ex: 'instance_source__start_date')
+    """
+    parts = field_path.split('__')
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(parts[-1])
+
 class OptionalPagination(PageNumberPagination):
 
     """
@@ -40,7 +161,10 @@ class OptionalPagination(PageNumberPagination):
         if self.has_page(request):
             self.page_size = DEFAULT_PAGINATION_SIZE
         else:
-            self.page_size = _get_count(queryset)
+            # Everything is returned, count the results instead of
+            # asking the database to COUNT(*) them first.
+            queryset = list(queryset)
+            self.page_size = len(queryset)
 
         return super(OptionalPagination, self).paginate_queryset(
             queryset, request, view=view)
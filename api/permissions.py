@@ -1,18 +1,98 @@
 """
 Atmosphere API's extension of DRF permissions.
 """
+import time
 
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
 from rest_framework import permissions
 
 from threepio import logger
 
-from core.models.cloud_admin import CloudAdministrator, cloud_admin_list, get_cloud_admin_for_provider
+from core.models.cloud_admin import CloudAdministrator, cloud_admin_list
 from core.models import Group, MaintenanceRecord
 
 from api import ServiceUnavailable
 
 
+# key -> (value, expires), see '_get_cached_permission'
+_permission_cache = {}
+# Expired keys are removed once the cache grows past this size
+PERMISSION_CACHE_MAX_SIZE = 1000
+
+
+def _get_cached_permission(key, data_method):
+    """
+    Return the value of 'data_method()' from the permission cache,
+    calling it only when 'key' is missing or expired.
+    """
+    now = time.time()
+    value, expires = _permission_cache.get(key, (None, 0))
+    if expires > now:
+        return value
+    value = data_method()
+    if len(_permission_cache) >= PERMISSION_CACHE_MAX_SIZE:
+        for expired_key in [cache_key for (cache_key, (_, cache_expires))
+                            in _permission_cache.items()
+                            if cache_expires <= now]:
+            _permission_cache.pop(expired_key, None)
+    _permission_cache[key] = (value, now + settings.PERMISSION_CACHE_TIMEOUT)
+    return value
+
+
+def clear_permission_cache(**kwargs):
+    _permission_cache.clear()
+
+
+post_save.connect(clear_permission_cache, sender=MaintenanceRecord)
+post_delete.connect(clear_permission_cache, sender=MaintenanceRecord)
+post_save.connect(clear_permission_cache, sender=CloudAdministrator)
+post_delete.connect(clear_permission_cache, sender=CloudAdministrator)
+
+
+def _get_maintenance_records():
+    """
+    Return the (Global) maintenance records that are active now.
+    Records that start later are cached too, so they take effect on time.
+    """
+    def _list_records():
+        return list(MaintenanceRecord.objects.filter(
+            Q(end_date__gt=timezone.now()) | Q(end_date__isnull=True),
+            provider__isnull=True))
+    now = timezone.now()
+    return [record for record in
+            _get_cached_permission("maintenance", _list_records)
+            if record.start_date <= now and
+            (not record.end_date or record.end_date > now)]
+
+
+def _get_administrator_accounts(user):
+    """
+    Return a list of (admin_uuid, provider_uuid) for each of the
+    cloud administrator accounts of 'user'
+    """
+    def _list_accounts():
+        return [(str(admin_uuid).lower(), str(provider_uuid).lower())
+                for (admin_uuid, provider_uuid)
+                in cloud_admin_list(user).values_list('uuid', 'provider__uuid')]
+    return _get_cached_permission(("cloud_admin", user.id), _list_accounts)
+
+
+def _is_cloud_admin(user, admin_uuid=None, provider_uuid=None):
+    for (account_uuid, account_provider_uuid) in \
+            _get_administrator_accounts(user):
+        if admin_uuid and str(admin_uuid).lower() != account_uuid:
+            continue
+        if provider_uuid and \
+                str(provider_uuid).lower() != account_provider_uuid:
+            continue
+        return True
+    return False
+
+
 class ImageOwnerUpdateAllowed(permissions.BasePermission):
 
     def has_permission(self, request, view):
@@ -61,13 +141,6 @@ class EnabledUserRequired(permissions.BasePermission):
         return request.user.is_enabled
 
 
-def _get_administrator_account(user, admin_uuid):
-    try:
-        return cloud_admin_list(user).get(uuid=admin_uuid)
-    except CloudAdministrator.DoesNotExist:
-        return None
-
-
 class CloudAdminRequired(permissions.BasePermission):
 
     def has_permission(self, request, view):
@@ -78,11 +151,7 @@ class CloudAdminRequired(permissions.BasePermission):
         admin_uuid = kwargs.get('cloud_admin_uuid')
         # Generally you would use this keyword to look at a
         # SPECIFIC cloud_admin
-        if admin_uuid:
-            admin = _get_administrator_account(
-                request.user, admin_uuid)
-        else:
-            admin = cloud_admin_list(request.user).exists()
+        admin = _is_cloud_admin(request.user, admin_uuid=admin_uuid)
         return admin or request.user.is_staff
 
 
@@ -99,20 +168,18 @@ class CloudAdminUpdatingRequired(permissions.BasePermission):
         # You would use this keyword to update a
         # SPECIFIC cloud_admin
         if admin_uuid:
-            admin = _get_administrator_account(
-                request.user, admin_uuid)
+            admin = _is_cloud_admin(request.user, admin_uuid=admin_uuid)
         # When a 'specific Provider' is involved,
         # Ensure that the request.user has admin permission
         # before updating on that provider.
         elif provider_uuid:
-            admin = get_cloud_admin_for_provider(
-                request.user, provider_uuid)
+            admin = _is_cloud_admin(request.user, provider_uuid=provider_uuid)
         # In the event 'cloud_admin' or 'provider' is not specified
         # This decorator will ensure that the request user
         # holds 'CloudAdmin' privileges on at least one provider
         # in order to make the action.
         else:
-            admin = cloud_admin_list(request.user).exists()
+            admin = _is_cloud_admin(request.user)
 
         return True if admin else False
 
@@ -167,8 +234,7 @@ class InMaintenance(permissions.BasePermission):
     """
 
     def has_permission(self, request, view):
-        records = MaintenanceRecord.active()\
-                                   .filter(provider__isnull=True)
+        records = _get_maintenance_records()
         if records:
             if not request.user.is_staff:
                 raise ServiceUnavailable(
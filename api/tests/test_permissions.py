@@ -4,8 +4,17 @@ tests for custom permission classes
 import unittest
 import mock
 
-from api.permissions import CanEditOrReadOnly
-from api.tests.factories import UserFactory, AnonymousUserFactory
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api import ServiceUnavailable
+from api.permissions import CanEditOrReadOnly, CloudAdminRequired,\
+    InMaintenance, clear_permission_cache
+from api.tests.factories import UserFactory, AnonymousUserFactory,\
+    ProviderFactory
+from core.models import CloudAdministrator, MaintenanceRecord
 
 
 class TestCanEditOrReadOnly(unittest.TestCase):
@@ -63,3 +72,46 @@ class TestCanEditOrReadOnly(unittest.TestCase):
         self.request.user = self.anonymous_user
         self.request.method = "GET"
         assert self.permissions.has_object_permission(self.request, self.view, self.obj)
+
+
+class TestCachedPermissions(TestCase):
+    def setUp(self):
+        clear_permission_cache()
+        self.user = UserFactory.create()
+        self.request = mock.Mock()
+        self.request.user = self.user
+        self.request.parser_context = {'kwargs': {}}
+        self.view = mock.Mock()
+
+    def tearDown(self):
+        clear_permission_cache()
+
+    def test_maintenance_is_cached(self):
+        InMaintenance().has_permission(self.request, self.view)
+        with CaptureQueriesContext(connection) as context:
+            InMaintenance().has_permission(self.request, self.view)
+        self.assertEquals(len(context.captured_queries), 0)
+
+    def test_maintenance_change_is_seen(self):
+        assert InMaintenance().has_permission(self.request, self.view)
+        record = MaintenanceRecord.objects.create(
+            start_date=timezone.now(), title="Down", message="For a bit")
+        with self.assertRaises(ServiceUnavailable):
+            InMaintenance().has_permission(self.request, self.view)
+        record.delete()
+        assert InMaintenance().has_permission(self.request, self.view)
+
+    def test_cloud_admin_change_is_seen(self):
+        assert not CloudAdminRequired().has_permission(
+            self.request, self.view)
+        admin = CloudAdministrator.objects.create(
+            user=self.user, provider=ProviderFactory.create())
+        with CaptureQueriesContext(connection) as context:
+            assert CloudAdminRequired().has_permission(
+                self.request, self.view)
+            assert CloudAdminRequired().has_permission(
+                self.request, self.view)
+        self.assertEquals(len(context.captured_queries), 1)
+        self.request.parser_context = {
+            'kwargs': {'cloud_admin_uuid': str(admin.uuid).upper()}}
+        assert CloudAdminRequired().has_permission(self.request, self.view)
@@ -0,0 +1,38 @@
+from django.test import TestCase
+from rest_framework import serializers
+
+from api.tests.factories import UserFactory
+from api.v2.serializers.fields import ModelRelatedField
+from core.models import BootScript, ScriptType
+
+
+class ScriptTitleSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = BootScript
+        fields = ('id', 'title')
+
+
+class ModelRelatedFieldTests(TestCase):
+
+    def setUp(self):
+        self.script = BootScript.objects.create(
+            title='script', created_by=UserFactory.create(),
+            script_text='echo',
+            script_type=ScriptType.objects.get_or_create(name='Raw Text')[0])
+
+    def _field(self, queryset, **kwargs):
+        return ModelRelatedField(
+            queryset=queryset, serializer_class=ScriptTitleSerializer,
+            **kwargs)
+
+    def test_value_is_read_through_the_queryset(self):
+        field = self._field(BootScript.objects.exclude(id=self.script.id))
+        with self.assertRaises(BootScript.DoesNotExist):
+            field.to_representation(self.script)
+
+    def test_prefetched_value_is_used_when_allowed(self):
+        field = self._field(BootScript.objects.all(), use_prefetched=True)
+        with self.assertNumQueries(0):
+            data = field.to_representation(self.script)
+        self.assertEquals(data['title'], 'script')
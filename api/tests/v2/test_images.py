@@ -1,8 +1,14 @@
+import uuid
+
 from rest_framework.test import APITestCase, APIRequestFactory,\
     force_authenticate
 from api.v2.views import ImageViewSet as ViewSet
-from api.tests.factories import UserFactory, AnonymousUserFactory, ImageFactory
+from api.tests.factories import UserFactory, AnonymousUserFactory, ImageFactory,\
+    GroupFactory, LeadershipFactory, ProviderFactory, IdentityFactory
+from core.models import ApplicationSearchDocument, ApplicationVersion,\
+    InstanceSource, ProviderMachine, ProviderMachineMembership, Tag
 from django.core.urlresolvers import reverse
+from django.utils import timezone
 
 from unittest import skip
 
@@ -56,6 +62,130 @@ class GetListTests(APITestCase):
         self.assertIn('end_date', data)
 
 
+class VisibilityTests(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.anonymous_user = AnonymousUserFactory()
+        self.owner = UserFactory.create()
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        LeadershipFactory.create(user=self.user, group=self.group)
+        self.staff_user = UserFactory.create(is_staff=True)
+        self.provider = ProviderFactory.create()
+        IdentityFactory.create(
+            provider=self.provider, created_by=self.staff_user)
+
+        self.public_image, _ = self._create_image('public', private=False)
+        self.private_image, _ = self._create_image('private')
+        self.shared_image, shared_machine = self._create_image('shared')
+        ProviderMachineMembership.objects.create(
+            provider_machine=shared_machine, group=self.group)
+        self.owned_image, _ = self._create_image(
+            'owned', created_by=self.user)
+
+        factory = APIRequestFactory()
+        self.request = factory.get(reverse('api:v2:application-list'))
+
+    def _create_image(self, name, private=True, created_by=None):
+        image = ImageFactory.create(
+            name=name, private=private, created_by=created_by or self.owner)
+        version = ApplicationVersion.objects.create(
+            application=image, name='1.0', created_by=image.created_by)
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        machine = ProviderMachine.objects.create(
+            instance_source=source, application_version=version)
+        return image, machine
+
+    def _image_names(self, user):
+        force_authenticate(self.request, user=user)
+        response = self.view(self.request)
+        return sorted(image['name'] for image in response.data['results'])
+
+    def test_anonymous_user_sees_public_images(self):
+        self.assertEquals(
+            self._image_names(self.anonymous_user), ['public'])
+
+    def test_user_sees_shared_and_owned_images(self):
+        self.assertEquals(
+            self._image_names(self.user), ['owned', 'public', 'shared'])
+
+    def test_staff_sees_images_on_their_providers(self):
+        self.assertEquals(
+            self._image_names(self.staff_user),
+            ['owned', 'private', 'public', 'shared'])
+
+    def test_end_dated_machine_is_hidden(self):
+        machine = ProviderMachine.objects.get(
+            application_version__application=self.public_image)
+        machine.instance_source.end_date = timezone.now()
+        machine.instance_source.save()
+        self.assertEquals(self._image_names(self.anonymous_user), [])
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.user = UserFactory.create()
+        ImageFactory.create(
+            name='Ubuntu 14.04', description='Trusty', created_by=self.user)
+        ImageFactory.create(
+            name='CentOS 7', description='Builds ubuntu packages',
+            created_by=self.user)
+        self.tagged_image = ImageFactory.create(
+            name='My Ubuntu', description='Desktop', created_by=self.user)
+        self.tag = Tag.objects.create(name='docker', description='Containers')
+        self.tagged_image.tags.add(self.tag)
+        self.logged_image = ImageFactory.create(
+            name='Logged', description='Empty', created_by=self.user)
+        ApplicationVersion.objects.create(
+            application=self.logged_image, name='1.0', created_by=self.user,
+            change_log='Installed Docker')
+
+    def _search(self, query):
+        factory = APIRequestFactory()
+        request = factory.get(
+            reverse('api:v2:application-list'), {'search': query})
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        return [image['name'] for image in response.data['results']]
+
+    def test_name_matches_are_ranked_first(self):
+        self.assertEquals(
+            self._search('ubuntu'), ['Ubuntu 14.04', 'My Ubuntu'])
+
+    def test_descriptions_are_not_searched(self):
+        self.assertEquals(self._search('packages'), [])
+
+    def test_search_tags_and_change_logs(self):
+        self.assertEquals(self._search('DOCKER'), ['Logged', 'My Ubuntu'])
+
+    def test_every_term_must_match(self):
+        self.assertEquals(self._search('ubuntu docker'), ['My Ubuntu'])
+
+    def test_document_follows_changes(self):
+        self.tag.name = 'containers'
+        self.tag.save()
+        self.assertEquals(self._search('docker'), ['Logged'])
+        self.tagged_image.tags.remove(self.tag)
+        self.assertEquals(self._search('containers'), [])
+        self.tagged_image.name = 'Renamed'
+        self.tagged_image.save()
+        self.assertEquals(self._search('renamed'), ['Renamed'])
+        self.tagged_image.tags.add(self.tag)
+        self.tag.delete()
+        self.assertEquals(self._search('containers'), [])
+        deleted_ids = [self.tagged_image.id, self.logged_image.id]
+        self.tagged_image.delete()
+        self.assertEquals(self._search('renamed'), [])
+        self.logged_image.delete()
+        self.assertEquals(self._search('docker'), [])
+        self.assertFalse(ApplicationSearchDocument.objects.filter(
+            application__id__in=deleted_ids).exists())
+
+
 class GetDetailTests(APITestCase):
 
     def setUp(self):
@@ -0,0 +1,284 @@
+import sys
+import uuid
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
+
+from api.v2.views import InstanceViewSet as ViewSet, mixins
+from api.v2.views import instance as instance_views
+from api.tests.factories import UserFactory, AnonymousUserFactory,\
+    IdentityFactory, ProviderFactory, GroupFactory,\
+    IdentityMembershipFactory, QuotaFactory, LeadershipFactory,\
+    ImageFactory
+from core.models import ApplicationVersion, BootScript, Instance,\
+    InstanceSource, InstanceStatus, InstanceStatusHistory, ProviderMachine,\
+    ScriptType, Size
+from service.exceptions import InstanceDoesNotExist, VolumeAttachConflict
+
+
+class GetListTests(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.anonymous_user = AnonymousUserFactory()
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        self.leadership = LeadershipFactory.create(
+            user=self.user,
+            group=self.group
+            )
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider,
+            created_by=self.user)
+        self.quota = QuotaFactory.create()
+        IdentityMembershipFactory.create(
+            member=self.group,
+            identity=self.identity,
+            quota=self.quota
+        )
+        self.image = ImageFactory.create(created_by=self.user)
+        self.version = ApplicationVersion.objects.create(
+            application=self.image, name='1.0', created_by=self.user)
+        self.size = Size.objects.create(
+            alias='1', name='tiny', provider=self.provider,
+            cpu=1, mem=1024, disk=0, root=10)
+        self.active = InstanceStatus.objects.get_or_create(name='active')[0]
+        self.script = BootScript.objects.create(
+            title='script', created_by=self.user, script_text='echo',
+            script_type=ScriptType.objects.get_or_create(name='Raw Text')[0])
+
+        factory = APIRequestFactory()
+        url = reverse('api:v2:instance-list')
+        self.request = factory.get(url)
+        force_authenticate(self.request, user=self.user)
+
+    def _create_instances(self, count):
+        for _ in range(count):
+            source = InstanceSource.objects.create(
+                provider=self.provider, identifier=str(uuid.uuid4()))
+            ProviderMachine.objects.create(
+                instance_source=source, application_version=self.version)
+            instance = Instance.objects.create(
+                name='instance', source=source,
+                provider_alias=str(uuid.uuid4()),
+                created_by=self.user, created_by_identity=self.identity,
+                start_date=timezone.now())
+            InstanceStatusHistory.objects.create(
+                instance=instance, size=self.size, status=self.active,
+                start_date=instance.start_date)
+            self.script.instances.add(instance)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.view(self.request)
+            response.render()
+        return len(context.captured_queries)
+
+    def test_is_not_public(self):
+        force_authenticate(self.request, user=self.anonymous_user)
+        response = self.view(self.request)
+        self.assertEquals(response.status_code, 403)
+
+    def test_response_contains_last_history(self):
+        self._create_instances(1)
+        response = self.view(self.request)
+        data = response.data.get('results')[0]
+        self.assertEquals(data['status'], 'active')
+        self.assertEquals(data['size']['alias'], '1')
+        self.assertEquals(data['image']['name'], self.image.name)
+        self.assertEquals(data['version']['name'], '1.0')
+        self.assertEquals([script['title'] for script in data['scripts']],
+                          ['script'])
+
+    def test_queries_do_not_grow_with_instances(self):
+        self._create_instances(2)
+        few_queries = self._count_queries()
+        self._create_instances(18)
+        self.assertEquals(self._count_queries(), few_queries)
+
+    def test_cursor_pagination_streams_every_instance(self):
+        self._create_instances(5)
+        # Ties on start_date are broken by the id
+        Instance.objects.filter(created_by=self.user).update(
+            start_date=timezone.now())
+        expected_ids = sorted(Instance.objects.filter(
+            created_by=self.user).values_list('id', flat=True))
+        factory = APIRequestFactory()
+        url = reverse('api:v2:instance-list') + '?cursor=&page_size=2'
+        seen_ids = []
+        while url:
+            request = factory.get(url)
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as context:
+                response = self.view(request)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in query['sql']
+                                 for query in context.captured_queries))
+            seen_ids.extend(data['id'] for data in response.data['results'])
+            url = response.data['next']
+        self.assertEquals(sorted(seen_ids), expected_ids)
+        self.assertEquals(len(seen_ids), len(set(seen_ids)))
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'get': 'list'})
+        self.user = UserFactory.create()
+        self.versions = [(1, 1450000000.0)]
+        self._get_model_versions = mixins.get_model_versions
+        mixins.get_model_versions = \
+            lambda models, scopes=None: self.versions
+        self.url = reverse('api:v2:instance-list')
+
+    def tearDown(self):
+        mixins.get_model_versions = self._get_model_versions
+
+    def _get(self, etag=None):
+        factory = APIRequestFactory()
+        if etag:
+            request = factory.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        else:
+            request = factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as context:
+            response = self._get(response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertFalse(any('"instance"' in query['sql']
+                             for query in context.captured_queries))
+
+    def test_changed_list_is_sent(self):
+        etag = self._get()['ETag']
+        self.versions = [(2, 1450000001.0)]
+        response = self._get(etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+    def test_no_etag_without_versions(self):
+        self.versions = None
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class BulkActionTests(APITestCase):
+
+    def setUp(self):
+        self.view = ViewSet.as_view({'post': 'bulk_action'})
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create(name=self.user.username)
+        LeadershipFactory.create(user=self.user, group=self.group)
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        IdentityMembershipFactory.create(
+            member=self.group, identity=self.identity,
+            quota=QuotaFactory.create())
+        self.instances = [self._create_instance() for _ in range(2)]
+        self.instance_actions = None
+        self._run_instance_actions = instance_views.run_instance_actions
+        instance_views.run_instance_actions = self._fake_run_instance_actions
+
+    def tearDown(self):
+        instance_views.run_instance_actions = self._run_instance_actions
+
+    def _create_instance(self):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        return Instance.objects.create(
+            name='instance', source=source,
+            provider_alias=str(uuid.uuid4()),
+            created_by=self.user, created_by_identity=self.identity,
+            start_date=timezone.now())
+
+    def _fake_run_instance_actions(self, user, instance_actions):
+        self.instance_actions = instance_actions
+        outcomes = []
+        for (identity, instance_id, action, action_params) in instance_actions:
+            if action == 'suspend':
+                outcomes.append((True, None))
+                continue
+            try:
+                if action == 'detach_volume':
+                    raise VolumeAttachConflict(
+                        message='Volume is still mounted')
+                raise InstanceDoesNotExist(instance_id)
+            except (InstanceDoesNotExist, VolumeAttachConflict):
+                outcomes.append((None, sys.exc_info()))
+        return outcomes
+
+    def _post(self, data):
+        factory = APIRequestFactory()
+        request = factory.post(
+            reverse('api:v2:instance-bulk-action'), data, format='json')
+        force_authenticate(request, user=self.user)
+        return self.view(request)
+
+    def test_results_are_returned_for_every_action(self):
+        response = self._post({'actions': [
+            {'instance': self.instances[0].provider_alias,
+             'action': 'suspend'},
+            {'instance': self.instances[1].provider_alias,
+             'action': 'reboot', 'reboot_type': 'HARD'}]})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            self.instance_actions,
+            [(self.identity, self.instances[0].provider_alias,
+              'suspend', {}),
+             (self.identity, self.instances[1].provider_alias,
+              'reboot', {'reboot_type': 'HARD'})])
+        (suspended, rebooted) = response.data['results']
+        self.assertEquals(suspended['result'], 'success')
+        self.assertEquals(suspended['instance'],
+                          self.instances[0].provider_alias)
+        self.assertEquals(rebooted['result'], 'error')
+        self.assertEquals(rebooted['code'], 404)
+        self.assertEquals(rebooted['action'], 'reboot')
+
+    def test_volume_conflicts_are_409(self):
+        response = self._post({'actions': [
+            {'instance': self.instances[0].provider_alias,
+             'action': 'detach_volume', 'volume_id': 'volume-1'}]})
+        self.assertEquals(response.status_code, 200)
+        (detached,) = response.data['results']
+        self.assertEquals(detached['result'], 'error')
+        self.assertEquals(detached['code'], 409)
+        self.assertEquals(detached['message'], 'Volume is still mounted')
+
+    def test_unknown_instances_are_not_run(self):
+        other_user = UserFactory.create()
+        other_identity = IdentityFactory.create(
+            provider=self.provider, created_by=other_user)
+        other_instance = self._create_instance()
+        other_instance.created_by = other_user
+        other_instance.created_by_identity = other_identity
+        other_instance.save()
+        response = self._post({'actions': [
+            {'instance': self.instances[0].provider_alias,
+             'action': 'suspend'},
+            {'instance': other_instance.provider_alias,
+             'action': 'suspend'}]})
+        self.assertEquals(response.status_code, 404)
+        self.assertIsNone(self.instance_actions)
+
+    def test_actions_are_validated(self):
+        self.assertEquals(self._post({}).status_code, 400)
+        self.assertEquals(self._post(
+            {'actions': [{'instance': self.instances[0].provider_alias}]}
+        ).status_code, 400)
+        with self.settings(BULK_INSTANCE_ACTION_MAX_ITEMS=1):
+            response = self._post({'actions': [
+                {'instance': instance.provider_alias, 'action': 'suspend'}
+                for instance in self.instances]})
+        self.assertEquals(response.status_code, 400)
+        self.assertIsNone(self.instance_actions)
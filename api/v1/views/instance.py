@@ -9,7 +9,7 @@ from threepio import logger
 from core.exceptions import ProviderNotActive
 from core.models import AtmosphereUser as User
 from core.models.identity import Identity
-from core.models.instance import convert_esh_instance
+from core.models.instance import convert_esh_instance, convert_esh_instances
 from core.models.instance import Instance as CoreInstance
 from core.models.boot_script import _save_scripts_to_instance
 from core.models.tag import Tag as CoreTag
@@ -122,12 +122,11 @@ class InstanceList(AuthAPIView):
             return connection_failure(provider_uuid, identity_uuid)
         except InvalidCredsError:
             return invalid_creds(provider_uuid, identity_uuid)
-        core_instance_list = [convert_esh_instance(esh_driver,
-                                                   inst,
+        core_instance_list = convert_esh_instances(esh_driver,
+                                                   esh_instance_list,
                                                    provider_uuid,
                                                    identity_uuid,
                                                    user)
-                              for inst in esh_instance_list]
         # TODO: Core/Auth checks for shared instances
         serialized_data = InstanceSerializer(core_instance_list,
                                              context={"request": request},
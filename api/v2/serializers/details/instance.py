@@ -1,4 +1,6 @@
-from core.models import BootScript, Instance, Application as Image
+from django.db.models import Max
+
+from core.models import BootScript, Instance, InstanceStatusHistory
 from rest_framework import serializers
 from api.v2.serializers.fields import ModelRelatedField
 from api.v2.serializers.summaries import (
@@ -13,16 +15,50 @@ from api.v2.serializers.summaries import (
 from api.v2.serializers.fields.base import UUIDHyperlinkedIdentityField
 
 
+class InstanceListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        instances = list(data.all() if hasattr(data, 'all') else data)
+        _prefetch_last_history(instances)
+        return super(InstanceListSerializer, self).to_representation(
+            instances)
+
+
+def _prefetch_last_history(instances):
+    """
+    Attach the newest InstanceStatusHistory to every instance,
+    using a single query.
+    Requires the 'last_history_start' annotation
+    (See InstanceSerializer.setup_eager_loading)
+    """
+    start_dates = set(instance.last_history_start for instance in instances
+                      if getattr(instance, 'last_history_start', None))
+    if not start_dates:
+        return
+    last_history_map = {}
+    for history in InstanceStatusHistory.objects.filter(
+            instance__in=[instance.id for instance in instances],
+            start_date__in=start_dates).select_related('status', 'size'):
+        last_history_map[(history.instance_id, history.start_date)] = history
+    for instance in instances:
+        last_history = last_history_map.get(
+            (instance.id, getattr(instance, 'last_history_start', None)))
+        if last_history:
+            instance._last_history = last_history
+
+
 class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     identity = IdentitySummarySerializer(source='created_by_identity')
     user = UserSummarySerializer(source='created_by')
     provider = ProviderSummarySerializer(source='created_by_identity.provider')
-    status = serializers.CharField(source='esh_status', read_only=True)
+    status = serializers.SerializerMethodField()
     projects = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     scripts = ModelRelatedField(
         many=True, required=False,
         queryset=BootScript.objects.all(),
         serializer_class=BootScriptSummarySerializer,
+        # Every script is allowed, see 'setup_eager_loading'
+        use_prefetched=True,
         style={'base_template': 'input.html'})
     size = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
@@ -34,19 +70,54 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     )
 
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load everything the serializer needs up-front, so that a page of
+        instances costs a constant number of queries.
+        """
+        return queryset.select_related(
+            'created_by',
+            'created_by_identity__provider',
+            'source__provider',
+            'source__volume',
+            'source__providermachine__application_version__application',
+        ).prefetch_related(
+            'projects',
+            'scripts__script_type',
+        ).annotate(
+            last_history_start=Max('instancestatushistory__start_date'))
+
+    def _get_last_history(self, obj):
+        last_history = getattr(obj, '_last_history', None)
+        if not last_history:
+            last_history = obj.get_last_history()
+            obj._last_history = last_history
+        return last_history
+
+    def get_status(self, obj):
+        if obj.esh:
+            return obj.esh_status()
+        return self._get_last_history(obj).status.name
+
     def get_size(self, obj):
-        size = obj.get_size()
+        size = self._get_last_history(obj).size
         serializer = SizeSummarySerializer(size, context=self.context)
         return serializer.data
 
     def get_image(self, obj):
-        image_uuid = obj.application_uuid()
-        image = Image.objects.get(uuid=image_uuid)
+        provider_machine = obj.provider_machine
+        if not provider_machine:
+            return None
+        image = provider_machine.application_version.application
         serializer = ImageSummarySerializer(image, context=self.context)
         return serializer.data
 
     def get_version(self, obj):
-        version = obj.source.providermachine.application_version
+        provider_machine = obj.provider_machine
+        if not provider_machine:
+            return None
+        version = provider_machine.application_version
         serializer = ImageVersionSummarySerializer(
             version,
             context=self.context)
@@ -54,6 +125,7 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Instance
+        list_serializer_class = InstanceListSerializer
         fields = (
             'id',
             'uuid',
@@ -7,12 +7,19 @@ class ModelRelatedField(serializers.RelatedField):
     """
     Related field that renders the representation based on `serializer_class`
     and converts to an internal representation using `lookup_field`.
+
+    `use_prefetched=True` renders the related objects as they were loaded
+    (Ex: by 'prefetch_related') instead of reading them through `queryset`.
+    Only use it when `queryset` does not restrict what may be shown.
     """
     lookup_field = "pk"
+    use_prefetched = False
 
     def __init__(self, *args, **kwargs):
         self.serializer_class = kwargs.pop("serializer_class")
         self.lookup_field = kwargs.pop("lookup_field", self.lookup_field)
+        self.use_prefetched = kwargs.pop(
+            "use_prefetched", self.use_prefetched)
         super(ModelRelatedField, self).__init__(*args, **kwargs)
 
     def get_queryset(self):
@@ -27,8 +34,10 @@ class ModelRelatedField(serializers.RelatedField):
             "%s should have a `serializer_class` attribute."
             % self.___class__.__name__
         )
-        queryset = self.get_queryset()
-        obj = queryset.get(pk=value.pk)
+        if self.use_prefetched:
+            obj = value
+        else:
+            obj = self.get_queryset().get(pk=value.pk)
         serializer = self.serializer_class(obj, context=self.context)
         return serializer.data
 
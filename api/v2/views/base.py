@@ -10,11 +10,12 @@ from core import exceptions as core_exceptions
 from core.models import IdentityMembership, CloudAdministrator
 from core.models.status_type import StatusType
 
+from api.pagination import CursorResultsSetPagination
 from api.permissions import (
         ApiAuthOptional, ApiAuthRequired, EnabledUserRequired,
         InMaintenance, CloudAdminRequired
     )
-from api.v2.views.mixins import MultipleFieldLookup
+from api.v2.views.mixins import ConditionalGetMixin, MultipleFieldLookup
 
 
 def unresolved_requests_only(fn):
@@ -39,7 +40,7 @@ def unresolved_requests_only(fn):
     return wrapper
 
 
-class AuthViewSet(ModelViewSet):
+class AuthViewSet(ConditionalGetMixin, ModelViewSet):
     http_method_names = ['get', 'put', 'patch', 'post',
                          'delete', 'head', 'options', 'trace']
     permission_classes = (InMaintenance,
@@ -60,7 +61,7 @@ class AuthOptionalViewSet(ModelViewSet):
                           ApiAuthOptional,)
 
 
-class AuthReadOnlyViewSet(ReadOnlyModelViewSet):
+class AuthReadOnlyViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
 
     permission_classes = (InMaintenance,
                           ApiAuthOptional,)
@@ -90,6 +91,7 @@ class BaseRequestViewSet(MultipleFieldLookup, AuthViewSet):
     admin_serializer_class = None
     model = None
     lookup_fields = ("id", "uuid")
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         """
@@ -1,4 +1,8 @@
+from rest_framework.filters import DjangoFilterBackend, OrderingFilter,\
+    SearchFilter
+
 from core.models import Application as Image
+from service.search import IndexedApplicationSearch
 
 from api import permissions
 from api.v2.serializers.details import ImageSerializer
@@ -6,6 +10,18 @@ from api.v2.views.base import AuthOptionalViewSet
 from api.v2.views.mixins import MultipleFieldLookup
 
 
+class ImageSearchFilter(SearchFilter):
+
+    """
+    Search images by their search document, ranked by name.
+    NOTE: 'search_fields' lists what the search document contains.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        return IndexedApplicationSearch.filter_applications(queryset, query)
+
+
 class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
 
     """
@@ -24,9 +40,12 @@ class ImageViewSet(MultipleFieldLookup, AuthOptionalViewSet):
 
     serializer_class = ImageSerializer
 
+    filter_backends = (DjangoFilterBackend, ImageSearchFilter, OrderingFilter)
+
     search_fields = ('id', 'name', 'versions__change_log', 'tags__name',
                      'tags__description', 'created_by__username')
 
     def get_queryset(self):
         request_user = self.request.user
-        return Image.current_apps(request_user)
+        return Image.current_apps(request_user).select_related(
+            'created_by').prefetch_related('tags', 'versions')
@@ -1,18 +1,25 @@
+import sys
+
+from django.conf import settings
+
+from api.pagination import CursorResultsSetPagination
 from api.v2.serializers.details import InstanceSerializer
 from api.v2.serializers.post import InstanceSerializer as POST_InstanceSerializer
 from api.v2.views.base import AuthViewSet
 from api.v2.views.mixins import MultipleFieldLookup
 from core.exceptions import ProviderNotActive
-from core.models import Instance, Identity
+from core.models import Instance, Identity, InstanceStatusHistory,\
+    InstanceStatus, InstanceSource, Size, ProviderMachine, Application,\
+    ApplicationVersion, BootScript, Project, Provider, AtmosphereUser
 from core.models.boot_script import _save_scripts_to_instance
 from core.models.instance import find_instance
 from core.query import only_current
 from rest_framework import status
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 from service.instance import (
     launch_instance, destroy_instance, run_instance_action,
-    update_instance_metadata)
+    run_instance_actions, update_instance_metadata)
 from threepio import logger
 # Things that go bump
 from api.v2.exceptions import (
@@ -40,6 +47,13 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
     serializer_class = InstanceSerializer
     filter_fields = ('created_by__id', 'projects')
     lookup_fields = ("id", "provider_alias")
+    pagination_class = CursorResultsSetPagination
+    etag_models = (Instance, InstanceStatusHistory, InstanceStatus,
+                   InstanceSource, Size, ProviderMachine, Application,
+                   ApplicationVersion, BootScript, Project, Provider,
+                   AtmosphereUser)
+    # Only the instances of the user's identities are listed
+    etag_identity_scoped = True
     http_method_names = ['get', 'put', 'patch', 'post', 'delete', 'head', 'options', 'trace']
 
     def get_serializer_class(self):
@@ -54,9 +68,11 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
         user = self.request.user
         identity_ids = user.current_identities.values_list('id',flat=True)
         qs = Instance.objects.filter(created_by_identity__in=identity_ids)
-        if 'archived' in self.request.query_params:
-            return qs
-        return qs.filter(only_current())
+        if 'archived' not in self.request.query_params:
+            qs = qs.filter(only_current())
+        if self.action in ['list', 'retrieve']:
+            qs = InstanceSerializer.setup_eager_loading(qs)
+        return qs
 
     @detail_route(methods=['post'])
     def update_metadata(self, request, pk=None):
@@ -94,50 +110,73 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
             }
             response = Response(api_response, status=status.HTTP_200_OK)
             return response
-        except (socket_error, ConnectionFailure):
-            return connection_failure(identity)
-        except InstanceDoesNotExist as dne:
+        except Exception:
+            return _instance_action_failure(identity, action, sys.exc_info())
+
+    @list_route(methods=['post'])
+    def bulk_action(self, request):
+        """
+        Run InstanceActions on many instances in one request:
+        {"actions": [{"instance": <id>, "action": <action>, ...params}]}
+        Responds with the result of every action, in the same order.
+        """
+        items = request.data.get('actions')
+        if not isinstance(items, list) or not items:
             return failure_response(
-                status.HTTP_404_NOT_FOUND,
-                'Instance %s no longer exists' % (dne.message,))
-        except InvalidCredsError:
-            return invalid_creds(identity)
-        except HypervisorCapacityError as hce:
-            return over_capacity(hce)
-        except ProviderNotActive as pna:
-            return inactive_provider(pna)
-        except (OverQuotaError, OverAllocationError) as oqe:
-            return over_quota(oqe)
-        except SizeNotAvailable as snae:
-            return size_not_available(snae)
-        except (socket_error, ConnectionFailure):
-            return connection_failure(identity)
-        except InvalidCredsError:
-            return invalid_creds(identity)
-        except VolumeMountConflict as vmc:
-            return mount_failed(vmc)
-        except NotImplemented:
+                status.HTTP_400_BAD_REQUEST,
+                "'actions' must be a list of instance actions")
+        if len(items) > settings.BULK_INSTANCE_ACTION_MAX_ITEMS:
             return failure_response(
-                status.HTTP_409_CONFLICT,
-                "The requested action %s is not available on this provider."
-                % action_params['action'])
-        except ActionNotAllowed:
+                status.HTTP_400_BAD_REQUEST,
+                "At most %s instance actions can be run in one request"
+                % settings.BULK_INSTANCE_ACTION_MAX_ITEMS)
+        if not all(isinstance(item, dict) and item.get('instance')
+                   and item.get('action') for item in items):
             return failure_response(
-                status.HTTP_409_CONFLICT,
-                "The requested action %s has been explicitly "
-                "disabled on this provider." % action_params['action'])
-        except Exception as exc:
-            logger.exception("Exception occurred processing InstanceAction")
-            message = exc.message
-            if message.startswith('409 Conflict'):
-                return failure_response(
-                    status.HTTP_409_CONFLICT,
-                    message)
+                status.HTTP_400_BAD_REQUEST,
+                "Every instance action needs an 'instance' and an 'action'")
+        instance_ids = set(str(item['instance']) for item in items)
+        instances = {}
+        for instance in self.get_queryset().filter(
+                provider_alias__in=instance_ids).select_related(
+                'created_by_identity__provider'):
+            instances[instance.provider_alias] = instance
+        if instance_ids - set(instances.keys()):
             return failure_response(
-                status.HTTP_403_FORBIDDEN,
-                "The requested action %s encountered "
-                "an irrecoverable exception: %s"
-                % (action_params['action'], message))
+                status.HTTP_404_NOT_FOUND,
+                "Instance(s) %s could not be found"
+                % ", ".join(sorted(instance_ids - set(instances.keys()))))
+
+        instance_actions = []
+        for item in items:
+            action_params = dict(item)
+            instance = instances[str(action_params.pop('instance'))]
+            action = action_params.pop('action')
+            instance_actions.append((instance.created_by_identity,
+                                     instance.provider_alias,
+                                     action, action_params))
+        results = []
+        for ((identity, instance_id, action, action_params),
+             (result_obj, exc_info)) in zip(
+                instance_actions,
+                run_instance_actions(request.user, instance_actions)):
+            if exc_info:
+                failure = _instance_action_failure(identity, action, exc_info)
+                result = {
+                    'result': 'error',
+                    'code': failure.status_code,
+                    'message': failure.data['errors'][0]['message'],
+                }
+            else:
+                result = {
+                    'result': 'success',
+                    'code': status.HTTP_200_OK,
+                    'message': 'The requested action <%s> was run successfully' % (action,),
+                    'object': result_obj,
+                }
+            result.update({'instance': instance_id, 'action': action})
+            results.append(result)
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
     def perform_destroy(self, instance):
         user = self.request.user
@@ -217,3 +256,53 @@ class InstanceViewSet(MultipleFieldLookup, AuthViewSet):
             return failure_response(status.HTTP_409_CONFLICT,
                                     str(exc.message))
 
+
+
+def _instance_action_failure(identity, action, exc_info):
+    """
+    Returns the failure response for an InstanceAction that raised 'exc_info'
+    """
+    try:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    except (socket_error, ConnectionFailure):
+        return connection_failure(identity)
+    except InstanceDoesNotExist as dne:
+        return failure_response(
+            status.HTTP_404_NOT_FOUND,
+            'Instance %s no longer exists' % (dne.message,))
+    except InvalidCredsError:
+        return invalid_creds(identity)
+    except HypervisorCapacityError as hce:
+        return over_capacity(hce)
+    except ProviderNotActive as pna:
+        return inactive_provider(pna)
+    except (OverQuotaError, OverAllocationError) as oqe:
+        return over_quota(oqe)
+    except SizeNotAvailable as snae:
+        return size_not_available(snae)
+    except VolumeMountConflict as vmc:
+        return mount_failed(vmc)
+    except VolumeAttachConflict as vac:
+        return failure_response(status.HTTP_409_CONFLICT, vac.message)
+    except NotImplemented:
+        return failure_response(
+            status.HTTP_409_CONFLICT,
+            "The requested action %s is not available on this provider."
+            % action)
+    except ActionNotAllowed:
+        return failure_response(
+            status.HTTP_409_CONFLICT,
+            "The requested action %s has been explicitly "
+            "disabled on this provider." % action)
+    except Exception as exc:
+        logger.exception("Exception occurred processing InstanceAction")
+        message = exc.message
+        if message.startswith('409 Conflict'):
+            return failure_response(
+                status.HTTP_409_CONFLICT,
+                message)
+        return failure_response(
+            status.HTTP_403_FORBIDDEN,
+            "The requested action %s encountered "
+            "an irrecoverable exception: %s"
+            % (action, message))
@@ -5,6 +5,7 @@ import django_filters
 
 from core.models import InstanceStatusHistory
 
+from api.pagination import CursorResultsSetPagination
 from api.v2.serializers.details import InstanceStatusHistorySerializer
 from api.v2.views.base import AuthReadOnlyViewSet
 from api.v2.views.mixins import MultipleFieldLookup
@@ -41,6 +42,7 @@ class InstanceStatusHistoryViewSet(MultipleFieldLookup, AuthReadOnlyViewSet):
     lookup_fields = ("id", "uuid")
     filter_class = InstanceStatusHistoryFilter
     filter_backends = (filters.OrderingFilter, filters.DjangoFilterBackend)
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         """
@@ -1,9 +1,17 @@
 import operator
+from hashlib import md5
 
 from django.db import models
 from django.db.models import Q
 from django.http import Http404
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
 from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from core.models import Group, Identity, IdentityMembership, Leadership
+from core.model_versions import get_model_versions
 
 
 class MultipleFieldLookup(object):
@@ -60,3 +68,77 @@ class MultipleFieldLookup(object):
         obj = get_object_or_404(queryset, filter_chain)
         self.check_object_permissions(self.request, obj)
         return obj
+
+
+class ConditionalGetMixin(object):
+    """
+    Adds an 'ETag' (and 'Last-Modified') to 'list' and 'retrieve', built
+    from the versions of the models the response depends on.
+    A client that sends back the same ETag ('If-None-Match') gets a
+    '304 Not Modified' without the queryset ever being evaluated.
+
+    Only views that set 'etag_models' are conditional, as the list has
+    to name *every* model that ends up in the serialized response.
+    """
+    #: Models the response is built from
+    etag_models = None
+    #: Models that decide what the user can see
+    etag_membership_models = (Group, Identity, IdentityMembership, Leadership)
+    #: The response only holds rows of the user's identities
+    #: (See core.model_versions.track_model_scope)
+    etag_identity_scoped = False
+
+    def get_etag_models(self):
+        return list(self.etag_models) + list(self.etag_membership_models)
+
+    def get_etag_scopes(self):
+        if not self.etag_identity_scoped:
+            return None
+        return list(self.request.user.current_identities.values_list(
+            'id', flat=True))
+
+    def get_etag(self):
+        """
+        Return the (etag, last_modified) of the response
+        (Or (None, None), if the model versions are not available)
+        """
+        if not self.etag_models:
+            return None, None
+        versions = get_model_versions(
+            self.get_etag_models(), scopes=self.get_etag_scopes())
+        if versions is None:
+            return None, None
+        request = self.request
+        etag = md5("%s:%s:%s:%s:%s" % (
+            request.user.pk, request.user.is_staff,
+            getattr(request, "accepted_media_type", None),
+            request.get_full_path(),
+            [version for (version, _) in versions])).hexdigest()
+        last_modified = max(modified for (_, modified) in versions)
+        return etag, last_modified or None
+
+    def conditional_get(self, method, *args, **kwargs):
+        etag, last_modified = self.get_etag()
+        if etag and etag in parse_etags(
+                self.request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = method(*args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        if not etag:
+            return response
+        response["ETag"] = quote_etag(etag)
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        # Clients may keep a copy, as long as they ask before using it.
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, *args, **kwargs):
+        return self.conditional_get(
+            super(ConditionalGetMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, *args, **kwargs):
+        return self.conditional_get(
+            super(ConditionalGetMixin, self).retrieve, *args, **kwargs)
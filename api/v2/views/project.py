@@ -1,12 +1,14 @@
 from rest_framework.decorators import detail_route
 from rest_framework.exceptions import ValidationError
-from core.models import Project, Group
+from core.models import Project, Group, ExternalLink
 from core.query import only_current
 
 from api.v2.serializers.details import ProjectSerializer,\
     VolumeSerializer, InstanceSerializer
 from api.v2.views.base import AuthViewSet
+from api.v2.views.instance import InstanceViewSet
 from api.v2.views.mixins import MultipleFieldLookup
+from api.v2.views.volume import VolumeViewSet
 
 
 class ProjectViewSet(MultipleFieldLookup, AuthViewSet):
@@ -18,6 +20,10 @@ class ProjectViewSet(MultipleFieldLookup, AuthViewSet):
     lookup_fields = ("id", "uuid")
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
+    # Includes the 'instances' and 'volumes' of the project
+    etag_models = tuple(set(InstanceViewSet.etag_models +
+                            VolumeViewSet.etag_models +
+                            (ExternalLink,)))
 
     def perform_destroy(self, serializer):
         project = self.get_object()
@@ -8,11 +8,13 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from api.exceptions import (inactive_provider)
+from api.pagination import CursorResultsSetPagination
 from api.v2.serializers.details import VolumeSerializer, UpdateVolumeSerializer
 from api.v2.views.base import AuthViewSet
 from api.v2.views.mixins import MultipleFieldLookup
 
 from core.exceptions import ProviderNotActive
+from core.models import AtmosphereUser, InstanceSource, Project, Provider
 from core.models.volume import Volume, find_volume
 from core.query import only_current_source
 from service.volume import create_volume_or_fail, destroy_volume_or_fail, update_volume_metadata
@@ -42,6 +44,9 @@ class VolumeViewSet(MultipleFieldLookup, AuthViewSet):
     lookup_fields = ("id", "instance_source__identifier")
     serializer_class = VolumeSerializer
     filter_class = VolumeFilter
+    pagination_class = CursorResultsSetPagination
+    cursor_ordering = ('-instance_source__start_date', '-id')
+    etag_models = (Volume, InstanceSource, Project, Provider, AtmosphereUser)
     http_method_names = ('get', 'post', 'put', 'patch', 'delete',
                          'head', 'options', 'trace')
 
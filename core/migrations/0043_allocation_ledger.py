@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0042_add_external_link_and_project_resources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationLedger',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start_date', models.DateTimeField()),
+                ('checkpoint', models.DateTimeField()),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('identity', models.OneToOneField(related_name='allocation_ledger', to='core.Identity')),
+            ],
+            options={
+                'db_table': 'allocation_ledger',
+            },
+        ),
+        migrations.CreateModel(
+            name='AllocationLedgerEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('period_start', models.DateTimeField()),
+                ('instance_identifier', models.CharField(max_length=256)),
+                ('status_name', models.CharField(max_length=128)),
+                ('clock_time', models.DurationField(default=datetime.timedelta(0))),
+                ('total_time', models.DurationField(default=datetime.timedelta(0))),
+                ('burn_rate', models.DurationField(default=datetime.timedelta(0))),
+                ('ledger', models.ForeignKey(related_name='entries', to='core.AllocationLedger')),
+            ],
+            options={
+                'db_table': 'allocation_ledger_entry',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='allocationledgerentry',
+            unique_together=set([('ledger', 'period_start', 'instance_identifier', 'status_name')]),
+        ),
+    ]
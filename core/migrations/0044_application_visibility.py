@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def build_visibility(apps, schema_editor):
+    from core.models.application_visibility import rebuild_all_visibility
+    rebuild_all_visibility(apps)
+
+
+def go_back(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0043_allocation_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationVisibility',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('public', models.BooleanField(default=False)),
+                ('start_date', models.DateTimeField()),
+                ('end_date', models.DateTimeField(null=True, blank=True)),
+                ('application', models.ForeignKey(related_name='visibility', to='core.Application')),
+                ('group', models.ForeignKey(blank=True, to='core.Group', null=True)),
+                ('provider', models.ForeignKey(blank=True, to='core.Provider', null=True)),
+            ],
+            options={
+                'db_table': 'application_visibility',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='applicationvisibility',
+            index_together=set([('public', 'start_date', 'end_date'), ('group', 'start_date', 'end_date'), ('provider', 'start_date', 'end_date')]),
+        ),
+        migrations.RunPython(
+            build_visibility, go_back),
+    ]
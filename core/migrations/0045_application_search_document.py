@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models, transaction, DatabaseError
+
+from threepio import logger
+
+
+TRIGRAM_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX application_search_document_trgm "
+    "ON application_search_document USING gin (document gin_trgm_ops)",
+]
+
+
+def build_search_documents(apps, schema_editor):
+    from core.models.application_search import rebuild_all_search_documents
+    rebuild_all_search_documents(apps)
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Lets postgres use an index for LIKE '%term%' on the document.
+    NOTE: Search still works (Sequential scan of one table) without it.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        with transaction.atomic():
+            for statement in TRIGRAM_INDEXES:
+                schema_editor.execute(statement)
+    except DatabaseError as exc:
+        logger.warn("Trigram index was not created: %s" % exc)
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS application_search_document_trgm")
+
+
+def go_back(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0044_application_visibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationSearchDocument',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.TextField()),
+                ('document', models.TextField()),
+                ('application', models.OneToOneField(related_name='search_document', to='core.Application')),
+            ],
+            options={
+                'db_table': 'application_search_document',
+            },
+        ),
+        migrations.RunPython(
+            build_search_documents, go_back),
+        migrations.RunPython(
+            create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_application_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaUsage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('cpu', models.IntegerField(default=0)),
+                ('ram', models.IntegerField(default=0)),
+                ('disk', models.IntegerField(default=0)),
+                ('suspended_count', models.IntegerField(default=0)),
+                ('reserved_cpu', models.IntegerField(default=0)),
+                ('reserved_ram', models.IntegerField(default=0)),
+                ('reserved_disk', models.IntegerField(default=0)),
+                ('reserved_until', models.DateTimeField(null=True, blank=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('identity', models.OneToOneField(related_name='quota_usage', to='core.Identity')),
+            ],
+            options={
+                'db_table': 'quota_usage',
+            },
+        ),
+    ]
@@ -0,0 +1,168 @@
+"""
+Model versions for atmosphere.
+
+Every model in 'core' has a version counter (and a last-modified time)
+in redis, bumped whenever one of its rows is saved or deleted.
+The API combines the versions of the models behind a response into an
+ETag, so an unchanged list can be answered without running its queries.
+
+Models that churn (Ex: InstanceStatusHistory, on every monitoring sweep)
+are also versioned per scope (The identity that owns the row), see
+'track_model_scope'. A response that only holds the rows of some scopes
+reads those versions instead, so its ETag only changes when *those* rows
+change, instead of on every save by every user.
+
+NOTE: Bulk operations ('update', 'bulk_create') do not send signals,
+      call 'bump_model_versions' after them.
+"""
+import time
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+import redis
+
+from threepio import logger
+
+
+MODEL_VERSION_KEY = "model_version.{0}"
+MODEL_MODIFIED_KEY = "model_modified.{0}"
+MODEL_SCOPED_VERSION_KEY = "model_version.{0}.{1}"
+MODEL_SCOPED_MODIFIED_KEY = "model_modified.{0}.{1}"
+# Scope bumped when the scope of the changed rows is not known
+ALL_SCOPES = "all"
+# Seconds to wait before trying a redis-server that was not running
+REDIS_RETRY_INTERVAL = 30
+
+_redis_down_until = 0
+# model label -> method returning the scope of a saved/deleted row
+_scope_getters = {}
+
+
+def _redis_connection():
+    from service.cache import redis_connection
+    return redis_connection()
+
+
+def _redis_is_down():
+    return time.time() < _redis_down_until
+
+
+def _mark_redis_down():
+    global _redis_down_until
+    _redis_down_until = time.time() + REDIS_RETRY_INTERVAL
+    logger.exception("EXTERNAL SERVICE redis-server IS NOT RESPONDING! "
+                     "Somebody should turn it on!")
+
+
+def get_model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.model_name)
+
+
+def track_model_scope(model, get_scope):
+    """
+    Version the rows of 'model' per scope.
+    'get_scope(row)' returns the scope of a saved/deleted row, or None
+    when it can not be told without a query (Every scope is bumped).
+    """
+    _scope_getters[get_model_label(model)] = get_scope
+
+
+def _get_version_keys(label, scopes=None):
+    """
+    Returns a list of (version key, modified key) for 'label'
+    """
+    if scopes is None:
+        return [(MODEL_VERSION_KEY.format(label),
+                 MODEL_MODIFIED_KEY.format(label))]
+    return [(MODEL_SCOPED_VERSION_KEY.format(label, scope),
+             MODEL_SCOPED_MODIFIED_KEY.format(label, scope))
+            for scope in scopes]
+
+
+def bump_model_versions(*models, **kwargs):
+    """
+    Mark 'models' as changed.
+    scopes - Only the rows of these scopes changed (See 'track_model_scope')
+    """
+    scopes = kwargs.get('scopes')
+    if not models or _redis_is_down():
+        return
+    now = time.time()
+    try:
+        pipe = _redis_connection().pipeline()
+        for label in set(get_model_label(model) for model in models):
+            # The model version covers every scope
+            keys = _get_version_keys(label)
+            if label in _scope_getters:
+                keys.extend(_get_version_keys(
+                    label, [ALL_SCOPES] if scopes is None else set(scopes)))
+            for (version_key, modified_key) in keys:
+                pipe.incr(version_key)
+                pipe.set(modified_key, now)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        _mark_redis_down()
+
+
+def get_model_versions(models, scopes=None):
+    """
+    Return a list of (version, last_modified) for each model in 'models'
+    (Or None, if the versions are not available)
+    scopes - The response only holds rows of these scopes
+             (See 'track_model_scope')
+    """
+    if _redis_is_down():
+        return None
+    model_keys = []
+    for model in models:
+        label = get_model_label(model)
+        if scopes is not None and label in _scope_getters:
+            model_keys.append(_get_version_keys(
+                label, [ALL_SCOPES] + sorted(scopes)))
+        else:
+            model_keys.append(_get_version_keys(label))
+    try:
+        pipe = _redis_connection().pipeline()
+        for keys in model_keys:
+            for (version_key, modified_key) in keys:
+                pipe.get(version_key)
+                pipe.get(modified_key)
+        values = iter(pipe.execute())
+    except redis.exceptions.RedisError:
+        _mark_redis_down()
+        return None
+    versions = []
+    for keys in model_keys:
+        key_values = [(int(next(values) or 0), float(next(values) or 0))
+                      for key in keys]
+        versions.append((
+            tuple(version for (version, _) in key_values)
+            if len(key_values) > 1 else key_values[0][0],
+            max(modified for (_, modified) in key_values)))
+    return versions
+
+
+def _is_tracked(model):
+    return model._meta.app_label == "core"
+
+
+def model_changed(sender, instance=None, **kwargs):
+    if not _is_tracked(sender):
+        return
+    get_scope = _scope_getters.get(get_model_label(sender))
+    scope = get_scope(instance) if get_scope and instance else None
+    bump_model_versions(
+        sender, scopes=[scope] if scope is not None else None)
+
+
+def model_relation_changed(sender, instance, action, model, **kwargs):
+    if not action.startswith("post_"):
+        return
+    bump_model_versions(*[changed_model for changed_model in
+                          (sender, instance.__class__, model)
+                          if _is_tracked(changed_model)])
+
+
+post_save.connect(model_changed)
+post_delete.connect(model_changed)
+m2m_changed.connect(model_relation_changed)
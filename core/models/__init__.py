@@ -4,10 +4,14 @@
 Collection of models
 """
 from core.models.allocation_strategy import Allocation, AllocationStrategy
+from core.models.allocation_ledger import AllocationLedger,\
+    AllocationLedgerEntry
 from core.models.application import Application, ApplicationMembership,\
     ApplicationScore, ApplicationBookmark, ApplicationThreshold
 from core.models.application_tag import ApplicationTag
 from core.models.application_version import ApplicationVersion, ApplicationVersionMembership
+from core.models.application_visibility import ApplicationVisibility
+from core.models.application_search import ApplicationSearchDocument
 from core.models.cloud_admin import CloudAdministrator
 from core.models.credential import Credential, ProviderCredential
 from core.models.export_request import ExportRequest
@@ -34,6 +38,7 @@ from core.models.instance import Instance, InstanceStatusHistory,\
 from core.models.node import NodeController
 from core.models.boot_script import ScriptType, BootScript, ApplicationVersionBootScript
 from core.models.quota import Quota
+from core.models.quota_usage import QuotaUsage
 from core.models.resource_request import ResourceRequest
 from core.models.size import Size
 from core.models.status_type import StatusType
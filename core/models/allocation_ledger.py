@@ -0,0 +1,154 @@
+"""
+  Allocation Ledger model for atmosphere.
+
+  Keeps the usage that the allocation engine has already counted for an
+  identity, so that each run only has to look at the history that has
+  changed since the last checkpoint.
+"""
+import operator
+
+from django.db import models
+from django.db.models.signals import pre_save, pre_delete
+from django.utils.timezone import timedelta
+
+from threepio import logger
+
+from allocation.models import InstanceHistoryResult
+from core.models.identity import Identity
+from core.models.instance import InstanceStatusHistory
+
+
+class AllocationLedger(models.Model):
+
+    """
+    Every InstanceStatusHistory of 'identity' that ended on/before
+    'checkpoint' has been counted, starting from 'start_date',
+    into the AllocationLedgerEntry(s) of this ledger.
+
+    'fingerprint' describes the rules and time periods that were used
+    to count the history. When it no longer matches the ledger is rebuilt.
+    """
+    identity = models.OneToOneField(Identity, related_name='allocation_ledger')
+    start_date = models.DateTimeField()
+    checkpoint = models.DateTimeField()
+    fingerprint = models.CharField(max_length=32)
+
+    def get_entries(self):
+        """
+        Returns a dict of entry.key -> AllocationLedgerEntry
+        """
+        return {entry.key: entry for entry in self.entries.all()}
+
+    @classmethod
+    def counted_results(cls, entries):
+        """
+        Given a list of AllocationLedgerEntry
+        Return the 'counted_results' expected by the allocation engine
+        """
+        counted_results = {}
+        for entry in entries:
+            period_results = counted_results.setdefault(entry.period_start, {})
+            period_results.setdefault(
+                entry.instance_identifier, []).append(entry.to_result())
+        return counted_results
+
+    def __unicode__(self):
+        return "AllocationLedger: Identity:%s Start:%s Checkpoint:%s" % (
+            self.identity_id, self.start_date, self.checkpoint)
+
+    class Meta:
+        db_table = "allocation_ledger"
+        app_label = "core"
+
+
+class AllocationLedgerEntry(models.Model):
+
+    """
+    Time counted for a single instance & status within the time period
+    that started on 'period_start'
+    """
+    ledger = models.ForeignKey(AllocationLedger, related_name='entries')
+    period_start = models.DateTimeField()
+    instance_identifier = models.CharField(max_length=256)
+    status_name = models.CharField(max_length=128)
+    clock_time = models.DurationField(default=timedelta(0))
+    total_time = models.DurationField(default=timedelta(0))
+    burn_rate = models.DurationField(default=timedelta(0))
+
+    @property
+    def key(self):
+        return (self.period_start, self.instance_identifier, self.status_name)
+
+    def add_result(self, history_result):
+        self.clock_time += history_result.clock_time
+        self.total_time += history_result.total_time
+        self.burn_rate += history_result.burn_rate
+
+    def to_result(self):
+        return InstanceHistoryResult(
+            status_name=self.status_name,
+            clock_time=self.clock_time,
+            total_time=self.total_time,
+            burn_rate=self.burn_rate)
+
+    def __unicode__(self):
+        return "%s %s %s: %s" % (
+            self.period_start, self.instance_identifier,
+            self.status_name, self.total_time)
+
+    class Meta:
+        db_table = "allocation_ledger_entry"
+        app_label = "core"
+        unique_together = ('ledger', 'period_start',
+                           'instance_identifier', 'status_name')
+
+
+def invalidate_ledgers(instance_ids, end_date):
+    """
+    Remove the ledgers that have counted past 'end_date' for the
+    identities of 'instance_ids'.
+    Bulk updates of InstanceStatusHistory do not send signals, call this
+    after them.
+    """
+    if not instance_ids or not end_date:
+        return
+    ledgers = AllocationLedger.objects.filter(
+        identity__instance__id__in=instance_ids,
+        checkpoint__gte=end_date).distinct()
+    for ledger in ledgers:
+        logger.info("Counted history ended at %s. Removing %s"
+                    % (end_date, ledger))
+        ledger.delete()
+
+
+def invalidate_counted_history(sender, instance, **kwargs):
+    """
+    When history that has already been counted (Or would have been
+    counted, if it existed) is created, edited or deleted, the ledger is
+    no longer correct and must be rebuilt.
+    """
+    history = instance
+    if not history.pk and not history.end_date:
+        # New, open history has not been counted by anyone.
+        return
+    # Either the new end_date, or the end_date that is saved right now,
+    # has been counted. (Checked in one query)
+    counted = []
+    if history.end_date:
+        counted.append(models.Q(checkpoint__gte=history.end_date))
+    if history.pk:
+        counted.append(models.Q(
+            identity__instance__instancestatushistory__id=history.pk,
+            identity__instance__instancestatushistory__end_date__lte=models.F(
+                'checkpoint')))
+    ledger = AllocationLedger.objects.filter(
+        reduce(operator.or_, counted),
+        identity__instance=history.instance_id).first()
+    if ledger:
+        logger.info("Counted history %s changed. Removing %s"
+                    % (history, ledger))
+        ledger.delete()
+
+
+pre_save.connect(invalidate_counted_history, sender=InstanceStatusHistory)
+pre_delete.connect(invalidate_counted_history, sender=InstanceStatusHistory)
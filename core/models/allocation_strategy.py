@@ -219,7 +219,7 @@ class AllocationStrategy(models.Model):
                                           tzinfo=timezone.utc)
         return OneTimeRefresh(increase_date)
 
-    def apply(self, identity, core_allocation):
+    def apply(self, identity, core_allocation, counted_until=None):
         """
         Create an allocation.models.allocationstrategy
         """
@@ -229,7 +229,7 @@ class AllocationStrategy(models.Model):
         rules_behaviors = self._parse_rules_behaviors()
         new_strategy = PythonAllocationStrategy(
             counting_behavior, refresh_behaviors, rules_behaviors)
-        return new_strategy.apply(identity, core_allocation)
+        return new_strategy.apply(identity, core_allocation, counted_until)
 
     def execute(self, identity, core_allocation):
         from allocation.engine import calculate_allocation
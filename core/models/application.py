@@ -112,22 +112,22 @@ class Application(models.Model):
 
     @classmethod
     def current_apps(cls, atmo_user=None):
+        """
+        Public, user-owned, shared and (for staff) admin applications.
+        NOTE: Uses the ApplicationVisibility of each application,
+              see 'public_apps', 'shared_with' and 'admin_apps'
+        """
         from core.models.user import AtmosphereUser
-        public_images = Application.public_apps()
+        from core.models.application_visibility import ApplicationVisibility
         if not atmo_user or isinstance(atmo_user, AnonymousUser):
-            return public_images.distinct()
+            return Application.objects.filter(
+                id__in=ApplicationVisibility.visible_to())
         if not isinstance(atmo_user, AtmosphereUser):
             raise Exception("Expected atmo_user to be of type AtmosphereUser"
                             " - Received %s" % type(atmo_user))
-        user_images = atmo_user.application_set.all()
-        shared_images = Application.shared_with(atmo_user)
-        if atmo_user.is_staff:
-            admin_images = Application.admin_apps(atmo_user)
-        else:
-            admin_images = Application.objects.none()
-        all_the_images = (public_images | user_images |
-                shared_images | admin_images).distinct()
-        return all_the_images
+        return Application.objects.filter(
+            Q(id__in=ApplicationVisibility.visible_to(atmo_user)) |
+            Q(created_by=atmo_user))
 
     def _current_versions(self):
         """
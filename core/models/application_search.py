@@ -0,0 +1,171 @@
+"""
+  Application Search Document model for atmosphere.
+
+  A maintained, lower-cased copy of everything an application can be
+  searched by, so that a search is one (trigram indexed) LIKE per term
+  instead of LIKE '%q%' across tags, versions and users.
+"""
+from django.apps import apps as django_apps
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, pre_delete,\
+    m2m_changed
+
+from threepio import logger
+
+from core.models.application import Application
+from core.models.application_version import ApplicationVersion
+from core.models.tag import Tag
+from core.models.user import AtmosphereUser
+
+
+class ApplicationSearchDocument(models.Model):
+
+    """
+    'name' and 'document' are lower-cased.
+    'document' holds the id, name, tags (name and description),
+    version change logs and creator of 'application'
+    (The fields the v2 image catalog has always searched)
+    """
+    application = models.OneToOneField(Application,
+                                       related_name="search_document")
+    name = models.TextField()
+    document = models.TextField()
+
+    def __unicode__(self):
+        return "Search document of %s" % self.application_id
+
+    class Meta:
+        db_table = "application_search_document"
+        app_label = "core"
+
+
+def build_search_documents(application_ids, apps=django_apps):
+    """
+    Returns the list of (Unsaved) ApplicationSearchDocument for
+    'application_ids'
+    NOTE: 'apps' is a parameter so that migrations can use this too.
+    """
+    Document = apps.get_model("core", "ApplicationSearchDocument")
+    Application = apps.get_model("core", "Application")
+    ApplicationVersion = apps.get_model("core", "ApplicationVersion")
+    Tag = apps.get_model("core", "Tag")
+
+    names = {}
+    words = {}
+    for (app_id, name, username) in\
+            Application.objects.filter(id__in=application_ids).values_list(
+                'id', 'name', 'created_by__username'):
+        names[app_id] = name or ""
+        words[app_id] = [str(app_id), name, username]
+    for (app_id, tag_name, tag_description) in Tag.objects.filter(
+            application__id__in=application_ids).values_list(
+            'application', 'name', 'description'):
+        words[app_id].extend([tag_name, tag_description])
+    for (app_id, change_log) in ApplicationVersion.objects.filter(
+            application__id__in=application_ids).values_list(
+            'application', 'change_log'):
+        words[app_id].append(change_log)
+    return [Document(application_id=app_id,
+                     name=names[app_id].lower(),
+                     document="\n".join(
+                         word for word in app_words if word).lower())
+            for (app_id, app_words) in words.items()]
+
+
+def update_search_documents(application_ids, apps=django_apps, create=True):
+    """
+    Rebuild the ApplicationSearchDocument of 'application_ids'
+    Documents are updated in place, missing documents are only
+    created if 'create'.
+    """
+    application_ids = set(application_ids)
+    if not application_ids:
+        return
+    Document = apps.get_model("core", "ApplicationSearchDocument")
+    with transaction.atomic():
+        existing_ids = set(Document.objects.filter(
+            application__id__in=application_ids).values_list(
+            'application', flat=True))
+        new_documents = []
+        for document in build_search_documents(application_ids, apps):
+            if document.application_id in existing_ids:
+                Document.objects.filter(
+                    application_id=document.application_id).update(
+                    name=document.name, document=document.document)
+            elif create:
+                new_documents.append(document)
+        Document.objects.bulk_create(new_documents)
+
+
+def rebuild_all_search_documents(apps=django_apps):
+    Application = apps.get_model("core", "Application")
+    update_search_documents(
+        Application.objects.values_list('id', flat=True), apps)
+
+
+def _get_tagged_application_ids(tag):
+    return Application.objects.filter(tags=tag).values_list('id', flat=True)
+
+
+def _get_changed_application_ids(sender, instance, **kwargs):
+    if sender == Application:
+        return [instance.id]
+    if sender == ApplicationVersion:
+        return [instance.application_id]
+    if sender == Tag:
+        # Removed tags are found *before* the delete, see 'tag_deleting'
+        return getattr(instance, '_search_application_ids', None)\
+            or _get_tagged_application_ids(instance)
+    if sender == AtmosphereUser:
+        update_fields = kwargs.get('update_fields')
+        if update_fields and 'username' not in update_fields:
+            return []
+        return Application.objects.filter(
+            created_by=instance).values_list('id', flat=True)
+    return []
+
+
+def application_search_changed(sender, instance, **kwargs):
+    """
+    Keep the ApplicationSearchDocument up-to-date when applications,
+    versions, tags or users change.
+    """
+    application_ids = list(
+        _get_changed_application_ids(sender, instance, **kwargs))
+    if not application_ids:
+        return
+    logger.debug("Updating search documents of applications %s (%s changed)"
+                 % (application_ids, instance))
+    # NOTE: Versions are deleted along with their application, which
+    # must not get a new document on its way out.
+    update_search_documents(
+        application_ids, create=kwargs.get('signal') != post_delete)
+
+
+def tag_deleting(sender, instance, **kwargs):
+    instance._search_application_ids = list(
+        _get_tagged_application_ids(instance))
+
+
+def application_tags_changed(sender, instance, action, reverse,
+                             pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            update_search_documents([instance.id])
+        return
+    # A tag was added to (or removed from) applications
+    if action == "pre_clear":
+        tag_deleting(Tag, instance)
+    elif action == "post_clear":
+        update_search_documents(instance._search_application_ids)
+    elif action.startswith("post_"):
+        update_search_documents(pk_set or [])
+
+
+for sender in [Application, ApplicationVersion, Tag, AtmosphereUser]:
+    post_save.connect(application_search_changed, sender=sender)
+for sender in [ApplicationVersion, Tag]:
+    post_delete.connect(application_search_changed, sender=sender)
+pre_delete.connect(tag_deleting, sender=Tag)
+m2m_changed.connect(application_tags_changed,
+                    sender=Application.tags.through)
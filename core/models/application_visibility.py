@@ -0,0 +1,222 @@
+"""
+  Application Visibility model for atmosphere.
+
+  A materialized copy of 'who can see which application', so that the
+  image catalog does not have to join (and DISTINCT) through
+  versions -> machines -> instance_source -> provider on every request.
+"""
+from django.apps import apps as django_apps
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+
+from threepio import logger
+
+from core.model_versions import bump_model_versions
+from core.query import only_current
+from core.models.application import Application
+from core.models.application_version import ApplicationVersion,\
+    ApplicationVersionMembership
+from core.models.instance_source import InstanceSource
+from core.models.machine import ProviderMachine, ProviderMachineMembership
+from core.models.provider import Provider
+
+
+class ApplicationVisibility(models.Model):
+
+    """
+    'application' can be seen between 'start_date' and 'end_date' by:
+    * Everyone, if 'public'
+    * Members of 'group'
+    * Staff with an identity on 'provider'
+    """
+    application = models.ForeignKey(Application, related_name="visibility")
+    public = models.BooleanField(default=False)
+    group = models.ForeignKey("Group", null=True, blank=True)
+    provider = models.ForeignKey(Provider, null=True, blank=True)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def visible_to(cls, atmo_user=None, now_time=None):
+        """
+        Returns a queryset of application ids visible to 'atmo_user'
+        (Not including the applications that 'atmo_user' created)
+        """
+        query = models.Q(public=True)
+        if atmo_user:
+            query |= models.Q(group__id__in=atmo_user.group_ids())
+            if atmo_user.is_staff:
+                query |= models.Q(provider__id__in=atmo_user.provider_ids())
+        return cls.objects.filter(
+            only_current(now_time), query).values('application')
+
+    def __unicode__(self):
+        if self.public:
+            visible_to = "Everyone"
+        elif self.group_id:
+            visible_to = "Group:%s" % self.group_id
+        else:
+            visible_to = "Staff of Provider:%s" % self.provider_id
+        return "%s visible to %s from %s until %s" % (
+            self.application_id, visible_to, self.start_date, self.end_date)
+
+    class Meta:
+        db_table = "application_visibility"
+        app_label = "core"
+        index_together = [
+            ("public", "start_date", "end_date"),
+            ("group", "start_date", "end_date"),
+            ("provider", "start_date", "end_date"),
+        ]
+
+
+def _get_window(start_dates, end_dates):
+    """
+    Returns the (start_date, end_date) where ALL of the ranges overlap,
+    or None if they never do.
+    """
+    start_date = max(start_dates)
+    end_dates = [end_date for end_date in end_dates if end_date]
+    end_date = min(end_dates) if end_dates else None
+    if end_date and end_date <= start_date:
+        return None
+    return (start_date, end_date)
+
+
+def build_visibility(application_ids, apps=django_apps):
+    """
+    Returns the list of (Unsaved) ApplicationVisibility for 'application_ids'
+    Mirrors Application.public_apps, shared_with and admin_apps.
+    NOTE: 'apps' is a parameter so that migrations can use this too.
+    """
+    Visibility = apps.get_model("core", "ApplicationVisibility")
+    ProviderMachine = apps.get_model("core", "ProviderMachine")
+    ProviderMachineMembership = apps.get_model(
+        "core", "ProviderMachineMembership")
+    ApplicationVersionMembership = apps.get_model(
+        "core", "ApplicationVersionMembership")
+
+    machines = ProviderMachine.objects.filter(
+        application_version__application__id__in=application_ids
+    ).values_list(
+        'id', 'application_version',
+        'application_version__application',
+        'application_version__application__private',
+        'application_version__application__start_date',
+        'application_version__application__end_date',
+        'application_version__start_date',
+        'application_version__end_date',
+        'instance_source__start_date',
+        'instance_source__end_date',
+        'instance_source__provider',
+        'instance_source__provider__active',
+        'instance_source__provider__end_date')
+    machine_groups = {}
+    for machine_id, group_id in ProviderMachineMembership.objects.filter(
+            provider_machine__application_version__application__id__in=(
+                application_ids)).values_list('provider_machine', 'group'):
+        machine_groups.setdefault(machine_id, set()).add(group_id)
+    version_groups = {}
+    for version_id, group_id in ApplicationVersionMembership.objects.filter(
+            image_version__application__id__in=application_ids
+    ).values_list('image_version', 'group'):
+        version_groups.setdefault(version_id, set()).add(group_id)
+
+    rows = set()
+    for (machine_id, version_id, app_id, private, app_start, app_end,
+         version_start, version_end, machine_start, machine_end,
+         provider_id, provider_active, provider_end) in machines:
+        # Staff can see everything that isn't end-dated on their providers
+        admin_window = _get_window([app_start], [app_end])
+        if admin_window:
+            rows.add((app_id, False, None, provider_id) + admin_window)
+        if not provider_active:
+            continue
+        window = _get_window(
+            [app_start, version_start, machine_start],
+            [app_end, version_end, machine_end, provider_end])
+        if not window:
+            continue
+        if not private:
+            rows.add((app_id, True, None, None) + window)
+        groups = machine_groups.get(machine_id, set()) |\
+            version_groups.get(version_id, set())
+        for group_id in groups:
+            rows.add((app_id, False, group_id, None) + window)
+    return [Visibility(application_id=app_id, public=public,
+                       group_id=group_id, provider_id=provider_id,
+                       start_date=start_date, end_date=end_date)
+            for (app_id, public, group_id, provider_id,
+                 start_date, end_date) in rows]
+
+
+def update_visibility(application_ids, apps=django_apps):
+    """
+    Rebuild the ApplicationVisibility of 'application_ids'
+    """
+    application_ids = set(application_ids)
+    if not application_ids:
+        return
+    Visibility = apps.get_model("core", "ApplicationVisibility")
+    with transaction.atomic():
+        Visibility.objects.filter(
+            application__id__in=application_ids).delete()
+        Visibility.objects.bulk_create(
+            build_visibility(application_ids, apps))
+    bump_model_versions(Visibility)
+
+
+def rebuild_all_visibility(apps=django_apps):
+    Application = apps.get_model("core", "Application")
+    update_visibility(
+        Application.objects.values_list('id', flat=True), apps)
+
+
+def _get_changed_application_ids(sender, instance):
+    if sender == Application:
+        return [instance.id]
+    if sender == ApplicationVersion:
+        return [instance.application_id]
+    if sender == ProviderMachine:
+        return ApplicationVersion.objects.filter(
+            id=instance.application_version_id).values_list(
+            'application', flat=True)
+    if sender == ProviderMachineMembership:
+        return ProviderMachine.objects.filter(
+            id=instance.provider_machine_id).values_list(
+            'application_version__application', flat=True)
+    if sender == ApplicationVersionMembership:
+        return ApplicationVersion.objects.filter(
+            id=instance.image_version_id).values_list(
+            'application', flat=True)
+    if sender == InstanceSource:
+        return ProviderMachine.objects.filter(
+            instance_source__id=instance.id).values_list(
+            'application_version__application', flat=True)
+    if sender == Provider:
+        return ProviderMachine.objects.filter(
+            instance_source__provider__id=instance.id).values_list(
+            'application_version__application', flat=True).distinct()
+    return []
+
+
+def application_visibility_changed(sender, instance, **kwargs):
+    """
+    Keep the ApplicationVisibility up-to-date when applications,
+    versions, machines, memberships or providers change.
+    """
+    application_ids = [app_id for app_id in
+                       _get_changed_application_ids(sender, instance)
+                       if app_id]
+    if not application_ids:
+        return
+    logger.debug("Updating visibility of applications %s (%s changed)"
+                 % (application_ids, instance))
+    update_visibility(application_ids)
+
+
+for sender in [Application, ApplicationVersion, ApplicationVersionMembership,
+               InstanceSource, Provider, ProviderMachine,
+               ProviderMachineMembership]:
+    post_save.connect(application_visibility_changed, sender=sender)
+    post_delete.connect(application_visibility_changed, sender=sender)
@@ -6,7 +6,7 @@ from hashlib import md5
 from datetime import datetime, timedelta
 
 from django.db import models, transaction, DatabaseError
-from django.db.models import Q
+from django.db.models import Q, Max
 from django.utils import timezone
 
 import pytz
@@ -16,12 +16,15 @@ from rtwo.size import MockSize
 
 from threepio import logger
 
+from core.model_versions import bump_model_versions, track_model_scope
 from core.models.instance_source import InstanceSource
 from core.models.identity import Identity
 from core.models.machine import (
     convert_esh_machine, get_or_create_provider_machine)
 from core.models.volume import convert_esh_volume
-from core.models.size import convert_esh_size, Size
+from core.models.provider import Provider
+from core.models.quota_usage import update_quota_usage
+from core.models.size import convert_esh_size, convert_esh_sizes, Size
 from core.models.tag import Tag
 from core.query import only_current
 
@@ -241,6 +244,7 @@ class Instance(models.Model):
         first_history = InstanceStatusHistory.create_history(
             status_name, self, size, start_date, end_date)
         first_history.save()
+        update_quota_usage([self.created_by_identity_id])
         return first_history
 
     def update_history(
@@ -259,7 +263,7 @@ class Instance(models.Model):
         import traceback
         # 1. Get status name
         status_name = _get_status_name_for_provider(
-            self.provider_machine.provider,
+            self.provider,
             status_name,
             task,
             tmp_status)
@@ -287,6 +291,7 @@ class Instance(models.Model):
                 status_name, self, size,
                 start_time=now_time,
                 last_history=last_history)
+            update_quota_usage([self.created_by_identity_id])
             return (True, new_history)
         except ValueError:
             logger.exception("Bad transaction")
@@ -404,6 +409,38 @@ class Instance(models.Model):
             logger.info("END DATING instance %s: %s" % (self.provider_alias, end_date))
             self.end_date = end_date
             self.save()
+        update_quota_usage([self.created_by_identity_id])
+
+    @classmethod
+    def bulk_end_date(cls, instances, end_date=None):
+        """
+        Bulk version of 'end_date_all'. Ties up the loose ends of every
+        instance in 'instances' (And its history) inside one transaction.
+        """
+        from core.models.allocation_ledger import invalidate_ledgers
+        if not instances:
+            return
+        if not end_date:
+            end_date = timezone.now()
+        instance_ids = [instance.id for instance in instances]
+        with transaction.atomic():
+            InstanceStatusHistory.objects.filter(
+                instance__id__in=instance_ids,
+                end_date=None).update(end_date=end_date)
+            cls.objects.filter(
+                id__in=instance_ids,
+                end_date=None).update(end_date=end_date)
+            invalidate_ledgers(instance_ids, end_date)
+        identity_ids = [instance.created_by_identity_id
+                        for instance in instances]
+        bump_model_versions(cls, InstanceStatusHistory, scopes=identity_ids)
+        update_quota_usage(identity_ids)
+        logger.info("END DATING instances %s: %s"
+                    % ([instance.provider_alias for instance in instances],
+                       end_date))
+        for instance in instances:
+            if not instance.end_date:
+                instance.end_date = end_date
 
     def creator_name(self):
         return self.created_by.username
@@ -588,6 +625,62 @@ class InstanceStatusHistory(models.Model):
                 "instance_status_history: Lock is already acquired by"
                 "another transaction.")
 
+    @classmethod
+    def bulk_transaction(cls, history_updates, start_time=None):
+        """
+        Bulk version of 'transaction'.
+        history_updates - list of
+                          (instance, last_history, status_name, size)
+        End-date every 'last_history' that is still open and start the new
+        histories in a single transaction.
+        Returns the list of new histories.
+        """
+        from core.models.allocation_ledger import invalidate_ledgers
+        if not start_time:
+            start_time = timezone.now()
+        status_map = {}
+        new_histories = []
+        with transaction.atomic():
+            # Required to prevent race conditions.
+            open_ids = set(cls.objects.select_for_update().filter(
+                id__in=[update[1].id for update in history_updates],
+                end_date=None).values_list('id', flat=True))
+            for (instance, last_history, status_name, size) \
+                    in history_updates:
+                if last_history.id not in open_ids:
+                    logger.warn("Old history already has end date: %s"
+                                % last_history)
+                    continue
+                status = status_map.get(status_name)
+                if not status:
+                    status = InstanceStatus.objects.get_or_create(
+                        name=status_name)[0]
+                    status_map[status_name] = status
+                new_history = InstanceStatusHistory(
+                    instance=instance, size=size, status=status,
+                    start_date=start_time)
+                logger.info(
+                    "Status Update - User:%s Instance:%s "
+                    "Old:%s New:%s Time:%s" %
+                    (instance.created_by_id,
+                     instance.provider_alias,
+                     last_history.status.name,
+                     status_name,
+                     start_time))
+                last_history.end_date = start_time
+                new_histories.append(new_history)
+            cls.objects.filter(id__in=open_ids).update(end_date=start_time)
+            cls.objects.bulk_create(new_histories)
+            invalidate_ledgers(
+                [update[0].id for update in history_updates
+                 if update[1].id in open_ids],
+                start_time)
+        identity_ids = [update[0].created_by_identity_id
+                        for update in history_updates]
+        bump_model_versions(cls, scopes=identity_ids)
+        update_quota_usage(identity_ids)
+        return new_histories
+
     @classmethod
     def create_history(cls, status_name, instance, size,
                        start_date=None, end_date=None):
@@ -818,33 +911,13 @@ def convert_esh_instance(
     """
     instance_id = esh_instance.id
     ip_address = _find_esh_ip(esh_instance)
-    source_obj = esh_instance.source
     core_instance = find_instance(instance_id)
     if core_instance:
         _update_core_instance(core_instance, ip_address, password)
     else:
-        start_date = _find_esh_start_date(esh_instance)
-        logger.debug("Instance: %s" % instance_id)
-        core_source = convert_instance_source(
-            esh_driver,
-            esh_instance,
-            source_obj,
-            provider_uuid,
-            identity_uuid,
-            user)
-        logger.debug("CoreSource: %s" % core_source)
-        # Use New/Existing core Machine to create core Instance
-        core_instance = create_instance(
-            provider_uuid,
-            identity_uuid,
-            instance_id,
-            core_source.instance_source,
-            ip_address,
-            esh_instance.name,
-            user,
-            start_date,
-            token,
-            password)
+        core_instance = _create_esh_instance(
+            esh_driver, esh_instance, ip_address, provider_uuid,
+            identity_uuid, user, token, password)
     # Add 'esh' object
     core_instance.esh = esh_instance
     # Update the InstanceStatusHistory
@@ -862,7 +935,101 @@ def convert_esh_instance(
     return core_instance
 
 
-def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid):
+def convert_esh_instances(
+        esh_driver,
+        esh_instances,
+        provider_uuid,
+        identity_uuid,
+        user):
+    """
+    Bulk version of 'convert_esh_instance'.
+    Existing instances, their sizes and their last history are retrieved
+    in a constant number of queries, and only the rows that have changed
+    are written.
+    Returns the list of core instances (In the same order as esh_instances)
+    """
+    if not esh_instances:
+        return []
+    provider = Provider.objects.select_related('type').get(uuid=provider_uuid)
+    core_instance_map = {
+        core_instance.provider_alias: core_instance
+        for core_instance in Instance.objects.filter(
+            provider_alias__in=[esh_instance.id
+                                for esh_instance in esh_instances])}
+    # Resolved once per instance, a MockSize costs a call to the cloud
+    esh_size_map = {
+        esh_instance.id: _get_esh_instance_size(esh_driver, esh_instance)
+        for esh_instance in esh_instances}
+    core_size_map = convert_esh_sizes(esh_size_map.values(), provider_uuid)
+
+    core_instances = []
+    for esh_instance in esh_instances:
+        ip_address = _find_esh_ip(esh_instance)
+        core_instance = core_instance_map.get(esh_instance.id)
+        if core_instance:
+            if core_instance.ip_address != ip_address \
+                    or core_instance.end_date:
+                _update_core_instance(core_instance, ip_address, None)
+        else:
+            core_instance = _create_esh_instance(
+                esh_driver, esh_instance, ip_address, provider_uuid,
+                identity_uuid, user)
+            core_instance_map[esh_instance.id] = core_instance
+        # Add 'esh' object
+        core_instance.esh = esh_instance
+        core_instances.append(core_instance)
+
+    # Update the InstanceStatusHistory
+    last_history_map = _get_last_history_map(core_instances)
+    history_updates = []
+    for core_instance in core_instances:
+        esh_instance = core_instance.esh
+        core_size = core_size_map[esh_size_map[esh_instance.id].id]
+        last_history = last_history_map.get(core_instance.id)
+        if not last_history:
+            # No (open) history to continue from, take the long way.
+            core_instance.update_history(
+                esh_instance.extra['status'],
+                core_size,
+                esh_instance.extra.get('task'),
+                esh_instance.extra.get('metadata', {}).get(
+                    'tmp_status', "MISSING"))
+            continue
+        status_name = _get_status_name_for_provider(
+            provider,
+            esh_instance.extra['status'],
+            esh_instance.extra.get('task'),
+            esh_instance.extra.get('metadata', {}).get(
+                'tmp_status', "MISSING"))
+        if last_history.status.name == status_name \
+                and last_history.size_id == core_size.id:
+            continue
+        history_updates.append(
+            (core_instance, last_history, status_name, core_size))
+    if history_updates:
+        InstanceStatusHistory.bulk_transaction(history_updates)
+    return core_instances
+
+
+def _get_last_history_map(core_instances):
+    """
+    Returns a dict of instance id -> newest InstanceStatusHistory
+    Instances whose newest history has already ended are NOT included.
+    """
+    instance_ids = [core_instance.id for core_instance in core_instances]
+    latest_start_dates = dict(
+        InstanceStatusHistory.objects.filter(instance__in=instance_ids)
+        .values_list('instance').annotate(Max('start_date')))
+    last_history_map = {}
+    for history in InstanceStatusHistory.objects.filter(
+            instance__in=instance_ids, end_date=None).select_related(
+            'status'):
+        if history.start_date == latest_start_dates.get(history.instance_id):
+            last_history_map[history.instance_id] = history
+    return last_history_map
+
+
+def _get_esh_instance_size(esh_driver, esh_instance):
     # NOTE: Querying for esh_size because esh_instance
     # Only holds the alias, not all the values.
     # As a bonus this is a cached-call
@@ -873,6 +1040,39 @@ def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid):
         # information.
         # TODO: Switch to 'get_cached_size!'
         esh_size = esh_driver.get_size(esh_size.id)
+    return esh_size
+
+
+def _create_esh_instance(esh_driver, esh_instance, ip_address,
+                         provider_uuid, identity_uuid, user,
+                         token=None, password=None):
+    instance_id = esh_instance.id
+    start_date = _find_esh_start_date(esh_instance)
+    logger.debug("Instance: %s" % instance_id)
+    core_source = convert_instance_source(
+        esh_driver,
+        esh_instance,
+        esh_instance.source,
+        provider_uuid,
+        identity_uuid,
+        user)
+    logger.debug("CoreSource: %s" % core_source)
+    # Use New/Existing core Machine to create core Instance
+    return create_instance(
+        provider_uuid,
+        identity_uuid,
+        instance_id,
+        core_source.instance_source,
+        ip_address,
+        esh_instance.name,
+        user,
+        start_date,
+        token,
+        password)
+
+
+def _esh_instance_size_to_core(esh_driver, esh_instance, provider_uuid):
+    esh_size = _get_esh_instance_size(esh_driver, esh_instance)
     core_size = convert_esh_size(esh_size, provider_uuid)
     return core_size
 
@@ -947,3 +1147,14 @@ def create_instance(
                      (name, provider_alias,))
     # NOTE: No instance_status_history here, because status is not passed
     return new_inst
+
+
+def _get_history_scope(history):
+    # Only known when the instance is already loaded (Ex: 'update_history')
+    instance = getattr(history, '_instance_cache', None)
+    return instance.created_by_identity_id if instance else None
+
+
+# Instances are listed per identity, see core.model_versions
+track_model_scope(Instance, lambda instance: instance.created_by_identity_id)
+track_model_scope(InstanceStatusHistory, _get_history_scope)
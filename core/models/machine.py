@@ -1,11 +1,17 @@
 """
   Machine models for atmosphere.
 """
+from collections import OrderedDict
+import copy
 from hashlib import md5
+import threading
+import time
 
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
-from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist as DoesNotExist
+from django.core.exceptions import MultipleObjectsReturned
 from threepio import logger
 
 from core.models.abstract import BaseSource
@@ -17,6 +23,7 @@ from core.models.application_version import (
         get_version_for_machine)
 from core.models.identity import Identity
 from core.models.provider import Provider
+from core.query import only_current_source
 
 
 class ProviderMachine(BaseSource):
@@ -84,7 +91,7 @@ class ProviderMachine(BaseSource):
             from service.driver import get_account_driver
             accounts = get_account_driver(self.provider)
             image = accounts.get_image(self.identifier)
-            accounts.image_manager.update_image(image, **image_updates)
+            accounts.update_image(image, **image_updates)
         except Exception:
             logger.exception(
                 "Image Update Failed for %s on Provider %s" %
@@ -169,13 +176,92 @@ class ProviderMachineMembership(models.Model):
         unique_together = ('provider_machine', 'group')
 
 
-def build_cached_machines():
-    machine_dict = {}
-    cms = ProviderMachine.objects.all()
-    for cm in cms:
-        machine_dict[(cm.provider.id, cm.identifier)] = cm
-    ProviderMachine.cached_machines = machine_dict
-    return machine_dict
+class ProviderMachineCache(object):
+
+    """
+    A thread-safe, least-recently-used cache of ProviderMachines
+    (With their instance_source and provider) keyed on
+    (provider_uuid, identifier).
+    The first lookup on a provider loads all of its current machines with
+    a single query. Entries are dropped when their ProviderMachine,
+    InstanceSource or Provider is saved/deleted in this process, and
+    re-read after 'timeout' seconds for changes made by other processes.
+    NOTE: Every lookup returns a copy, the cached machines are never shared.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._machines = OrderedDict()
+        self._keys_by_source = {}
+        self._loaded_providers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider_uuid, identifier):
+        key = (str(provider_uuid), identifier)
+        if not self._is_loaded(key[0]):
+            self._load_provider(key[0])
+        with self._lock:
+            entry = self._machines.pop(key, None)
+            if entry and entry[1] >= time.time():
+                # Most recently used goes to the end.
+                self._machines[key] = entry
+                return copy.deepcopy(entry[0])
+        machine = ProviderMachine.objects.select_related(
+            'instance_source__provider').filter(
+            instance_source__provider__uuid=provider_uuid,
+            instance_source__identifier=identifier).first()
+        if not machine:
+            return None
+        self._put([machine])
+        return copy.deepcopy(machine)
+
+    def _is_loaded(self, provider_uuid):
+        with self._lock:
+            return self._loaded_providers.get(provider_uuid, 0) >= time.time()
+
+    def _load_provider(self, provider_uuid):
+        machines = ProviderMachine.objects.select_related(
+            'instance_source__provider').filter(
+            only_current_source(),
+            instance_source__provider__uuid=provider_uuid).order_by(
+            '-instance_source__start_date')[:self.max_size]
+        self._put(machines)
+        with self._lock:
+            self._loaded_providers[provider_uuid] = time.time() + self.timeout
+
+    def _put(self, machines):
+        expire_time = time.time() + self.timeout
+        with self._lock:
+            for machine in machines:
+                source = machine.instance_source
+                key = (str(source.provider.uuid), source.identifier)
+                self._machines.pop(key, None)
+                self._machines[key] = (machine, expire_time)
+                self._keys_by_source[source.id] = key
+            while len(self._machines) > self.max_size:
+                (key, (machine, _)) = self._machines.popitem(last=False)
+                self._keys_by_source.pop(machine.instance_source_id, None)
+
+    def invalidate(self, source_ids):
+        """
+        Remove the machines of InstanceSource 'source_ids'
+        """
+        with self._lock:
+            for source_id in source_ids:
+                key = self._keys_by_source.pop(source_id, None)
+                if key:
+                    self._machines.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._machines.clear()
+            self._keys_by_source.clear()
+            self._loaded_providers.clear()
+
+
+machine_cache = ProviderMachineCache(settings.PROVIDER_MACHINE_CACHE_SIZE,
+                                     settings.PROVIDER_MACHINE_CACHE_TIMEOUT)
 
 
 """
@@ -183,17 +269,6 @@ Useful utility methods for the Core Model..
 """
 
 
-def get_cached_machine(provider_alias, provider_id):
-    if not ProviderMachine.cached_machines:
-        build_cached_machines()
-    cached_mach = ProviderMachine.cached_machines.get(
-        (int(provider_id), provider_alias))
-    if not cached_mach:
-        logger.warn("Cache does not have machine %s on provider %s"
-                    % (provider_alias, provider_id))
-    return cached_mach
-
-
 def get_or_create_provider_machine(image_id, machine_name,
                                    provider_uuid, app=None, version=None):
     """
@@ -264,9 +339,9 @@ def update_application_owner(application, identity):
             {'owner': tenant_id,
              'application_owner': tenant_name})
         print "App data saved for %s" % image_id
-        accounts.image_manager.share_image(image, tenant_name)
+        accounts.share_image(image, tenant_name)
         print "Shared access to %s with %s" % (image_id, tenant_name)
-        accounts.image_manager.unshare_image(image, old_tenant_name)
+        accounts.unshare_image(image, old_tenant_name)
         print "Removed access to %s for %s" % (image_id, old_tenant_name)
 
 
@@ -320,7 +395,6 @@ def create_provider_machine(identifier, provider_uuid, app,
     )
     provider_machine_update_hook(provider_machine, provider_uuid, identifier)
     logger.info("New ProviderMachine created: %s" % provider_machine)
-    add_to_cache(provider_machine)
     return provider_machine
 
 
@@ -374,13 +448,6 @@ def provider_machine_write_hook(provider_machine):
             provider)
 
 
-def add_to_cache(provider_machine):
-    # ProviderMachine.cached_machines[(
-    #    provider_machine.provider.id,
-    #    provider_machine.identifier)] = provider_machine
-    return provider_machine
-
-
 def find_provider_machine(identifier, provider_uuid):
     try:
         if type(identifier) == int:
@@ -394,17 +461,15 @@ def find_provider_machine(identifier, provider_uuid):
         raise MultipleObjectsReturned("Identifier %s is ambiguous. Use the 'pk' value")
 
 def get_provider_machine(identifier, provider_uuid):
-    try:
-        source = InstanceSource.objects.get(
-            provider__uuid=provider_uuid, identifier=identifier, providermachine__isnull=False)
-        return source.providermachine
-    except DoesNotExist:
-        return None
+    return machine_cache.get(provider_uuid, identifier)
 
 
 def _load_machine(esh_machine, provider_uuid):
     name = esh_machine.name
     alias = esh_machine.id
+    provider_machine = get_provider_machine(alias, provider_uuid)
+    if provider_machine:
+        return provider_machine
     app = get_application(provider_uuid, alias, name)
     if not app:
         logger.debug("Creating Application for Image %s" % (alias, ))
@@ -487,3 +552,21 @@ def filter_core_machine(provider_machine):
         if provider_machine.application.end_date:
             return not(provider_machine.application.end_date < now)
     return True
+
+
+def machine_cache_changed(sender, instance, **kwargs):
+    """
+    Keep the 'machine_cache' coherent with the ProviderMachines,
+    InstanceSources and Providers saved/deleted in this process.
+    """
+    if sender == Provider:
+        machine_cache.clear()
+    elif sender == InstanceSource:
+        machine_cache.invalidate([instance.id])
+    else:
+        machine_cache.invalidate([instance.instance_source_id])
+
+
+for sender in [Provider, InstanceSource, ProviderMachine]:
+    post_save.connect(machine_cache_changed, sender=sender)
+    post_delete.connect(machine_cache_changed, sender=sender)
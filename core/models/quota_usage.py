@@ -0,0 +1,199 @@
+"""
+  Quota Usage model for atmosphere.
+
+  The resources that each identity is using, kept up-to-date as instance
+  history is recorded, so that checking quota does not have to list
+  every instance (and size) on the cloud.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+import threading
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from core.models.identity import Identity
+
+
+# Instances in these states do not count against cpu/ram/disk
+SUSPENDED_STATUSES = ('suspended', 'shutoff')
+RESOURCES = ('cpu', 'ram', 'disk')
+# Identities waiting on a recount, see 'batch_quota_usage'
+_batch = threading.local()
+
+
+class QuotaUsage(models.Model):
+
+    """
+    The cpu, ram (MB), disk (GB) and suspended instances of 'identity',
+    counted from the open InstanceStatusHistory of its instances.
+
+    'reserved_*' holds the resources of launches that passed the quota
+    check but are not counted yet, until 'reserved_until'.
+    """
+    identity = models.OneToOneField(Identity, related_name="quota_usage")
+    cpu = models.IntegerField(default=0)
+    ram = models.IntegerField(default=0)
+    disk = models.IntegerField(default=0)
+    suspended_count = models.IntegerField(default=0)
+    reserved_cpu = models.IntegerField(default=0)
+    reserved_ram = models.IntegerField(default=0)
+    reserved_disk = models.IntegerField(default=0)
+    reserved_until = models.DateTimeField(null=True, blank=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    def _reservation_expired(self, now_time=None):
+        if not now_time:
+            now_time = timezone.now()
+        return not self.reserved_until or self.reserved_until <= now_time
+
+    def get_usage(self, now_time=None):
+        """
+        Return the usage (including reservations) as a dict
+        """
+        reservation_expired = self._reservation_expired(now_time)
+        usage = {'suspended_count': self.suspended_count}
+        for resource in RESOURCES:
+            usage[resource] = getattr(self, resource)
+            if not reservation_expired:
+                usage[resource] += getattr(self, 'reserved_' + resource)
+        return usage
+
+    def set_usage(self, usage):
+        """
+        Set the counted usage. Any growth is assumed to be a reserved
+        launch that has been counted, and is taken out of the reservation.
+        """
+        for resource in RESOURCES:
+            grown = usage[resource] - getattr(self, resource)
+            if grown > 0:
+                reserved = getattr(self, 'reserved_' + resource)
+                setattr(self, 'reserved_' + resource, max(0, reserved - grown))
+            setattr(self, resource, usage[resource])
+        self.suspended_count = usage['suspended_count']
+
+    def reserve(self, cpu, ram, disk, now_time=None):
+        if not now_time:
+            now_time = timezone.now()
+        if self._reservation_expired(now_time):
+            self.reserved_cpu = self.reserved_ram = self.reserved_disk = 0
+        self.reserved_cpu += cpu
+        self.reserved_ram += ram
+        self.reserved_disk += disk
+        self.reserved_until = now_time + timedelta(
+            seconds=settings.QUOTA_RESERVATION_TIMEOUT)
+
+    def release(self, cpu, ram, disk):
+        self.reserved_cpu = max(0, self.reserved_cpu - cpu)
+        self.reserved_ram = max(0, self.reserved_ram - ram)
+        self.reserved_disk = max(0, self.reserved_disk - disk)
+
+    def __unicode__(self):
+        return "%s - CPU:%s, RAM:%s, DISK:%s, SUSPENDED:%s" %\
+            (self.identity_id, self.cpu, self.ram, self.disk,
+             self.suspended_count)
+
+    class Meta:
+        db_table = "quota_usage"
+        app_label = "core"
+
+
+def _empty_usage():
+    return {'cpu': 0, 'ram': 0, 'disk': 0, 'suspended_count': 0}
+
+
+def count_quota_usage(identity_ids):
+    """
+    Count the usage of 'identity_ids' from the newest open history of
+    each of their active instances.
+    Returns a dict of identity_id -> usage
+    """
+    from core.models.instance import InstanceStatusHistory
+    usage_map = {identity_id: _empty_usage() for identity_id in identity_ids}
+    last_history_map = {}
+    for (instance_id, identity_id, status_name, cpu, ram, disk) in\
+            InstanceStatusHistory.objects.filter(
+                instance__created_by_identity__id__in=identity_ids,
+                instance__end_date=None,
+                end_date=None).order_by('start_date').values_list(
+                'instance', 'instance__created_by_identity', 'status__name',
+                'size__cpu', 'size__mem', 'size__disk'):
+        last_history_map[instance_id] = (
+            identity_id, status_name, cpu, ram, disk)
+    for (identity_id, status_name, cpu, ram, disk) in \
+            last_history_map.values():
+        usage = usage_map[identity_id]
+        if status_name in SUSPENDED_STATUSES:
+            usage['suspended_count'] += 1
+            continue
+        # NOTE: The 'Unknown Size' uses -1
+        usage['cpu'] += max(cpu, 0)
+        usage['ram'] += max(ram, 0)
+        usage['disk'] += max(disk, 0)
+    return usage_map
+
+
+@contextmanager
+def batch_quota_usage():
+    """
+    Recount the QuotaUsage of every identity updated inside the block
+    once, on the way out, instead of on every history change.
+    (Ex: One recount per user in a monitoring sweep)
+    """
+    if getattr(_batch, 'identity_ids', None) is not None:
+        # The outermost block does the recount
+        yield
+        return
+    _batch.identity_ids = set()
+    try:
+        yield
+    finally:
+        identity_ids = _batch.identity_ids
+        _batch.identity_ids = None
+        _recount_quota_usage(identity_ids)
+
+
+def update_quota_usage(identity_ids):
+    """
+    Recount the QuotaUsage of 'identity_ids'
+    (Or, inside 'batch_quota_usage', when the batch ends)
+    """
+    pending_ids = getattr(_batch, 'identity_ids', None)
+    if pending_ids is not None:
+        pending_ids.update(identity_ids)
+        return
+    _recount_quota_usage(identity_ids)
+
+
+def _recount_quota_usage(identity_ids):
+    identity_ids = sorted(set(
+        identity_id for identity_id in identity_ids if identity_id))
+    if not identity_ids:
+        return
+    for identity_id in set(identity_ids) - set(
+            QuotaUsage.objects.filter(identity__id__in=identity_ids)
+            .values_list('identity', flat=True)):
+        QuotaUsage.objects.get_or_create(identity_id=identity_id)
+    with transaction.atomic():
+        quota_usages = list(QuotaUsage.objects.select_for_update().filter(
+            identity__id__in=identity_ids).order_by('identity'))
+        usage_map = count_quota_usage(identity_ids)
+        for quota_usage in quota_usages:
+            quota_usage.set_usage(usage_map[quota_usage.identity_id])
+            quota_usage.save()
+
+
+def get_quota_usage(identity, lock=False):
+    """
+    Return the QuotaUsage of 'identity' (Counting it the first time)
+    NOTE: 'lock' must be used inside a transaction.
+    """
+    quota_usages = QuotaUsage.objects.filter(identity=identity)
+    if lock:
+        quota_usages = quota_usages.select_for_update()
+    quota_usage = quota_usages.first()
+    if not quota_usage:
+        _recount_quota_usage([identity.id])
+        quota_usage = quota_usages.first()
+    return quota_usage
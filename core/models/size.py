@@ -1,6 +1,10 @@
 import uuid
+from copy import copy
+from datetime import timedelta
 
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from core.models.provider import Provider
 
@@ -69,9 +73,52 @@ class Size(models.Model):
             self.end_date)
 
 
+# (provider_uuid, alias) -> (cloud fingerprint, core Size, expire time)
+# Sizes are converted for every instance in every listing, a size that has
+# not changed on the cloud does not need to be read (or written) again.
+_size_sync_map = {}
+
+
+def _get_cloud_fingerprint(esh_size):
+    return (esh_size.name, esh_size.disk, esh_size.ephemeral,
+            esh_size.cpu, esh_size.ram)
+
+
+def _get_synced_size(esh_size, provider_uuid):
+    """
+    Returns a copy of the core Size last synced with 'esh_size'
+    or None if the cloud size has changed (or was never synced)
+    """
+    sync_entry = _size_sync_map.get((str(provider_uuid), esh_size.id))
+    if not sync_entry:
+        return None
+    (fingerprint, core_size, expire_time) = sync_entry
+    if fingerprint != _get_cloud_fingerprint(esh_size)\
+            or expire_time < timezone.now():
+        return None
+    return copy(core_size)
+
+
+def _set_synced_size(esh_size, provider_uuid, core_size):
+    synced_size = copy(core_size)
+    synced_size.esh = None
+    _size_sync_map[(str(provider_uuid), esh_size.id)] = (
+        _get_cloud_fingerprint(esh_size), synced_size,
+        timezone.now() + timedelta(seconds=settings.SIZE_SYNC_TIMEOUT))
+
+
+def _clear_synced_sizes(core_sizes, provider_uuid):
+    for core_size in core_sizes:
+        _size_sync_map.pop((str(provider_uuid), core_size.alias), None)
+
+
 def convert_esh_size(esh_size, provider_uuid):
     """
     """
+    core_size = _get_synced_size(esh_size, provider_uuid)
+    if core_size:
+        core_size.esh = esh_size
+        return core_size
     alias = esh_size.id
     try:
         core_size = Size.objects.get(alias=alias, provider__uuid=provider_uuid)
@@ -84,21 +131,71 @@ def convert_esh_size(esh_size, provider_uuid):
             raise Exception("Provider UUID: %s does not exist."
                             % provider_uuid)
         core_size = _create_from_cloud_size(esh_size, provider)
+    _set_synced_size(esh_size, provider_uuid, core_size)
     # Attach esh after the save!
     core_size.esh = esh_size
     return core_size
 
 
+def convert_esh_sizes(esh_sizes, provider_uuid):
+    """
+    Bulk version of 'convert_esh_size'.
+    Returns a dict of alias -> core Size for every size in 'esh_sizes'
+    """
+    esh_size_map = {esh_size.id: esh_size for esh_size in esh_sizes}
+    core_size_map = {}
+    for alias, esh_size in esh_size_map.items():
+        core_size = _get_synced_size(esh_size, provider_uuid)
+        if core_size:
+            core_size.esh = esh_size
+            core_size_map[alias] = core_size
+    missing_aliases = [alias for alias in esh_size_map
+                       if alias not in core_size_map]
+    if not missing_aliases:
+        return core_size_map
+    db_size_map = {}
+    for core_size in Size.objects.filter(
+            alias__in=missing_aliases, provider__uuid=provider_uuid):
+        db_size_map.setdefault(core_size.alias, core_size)
+    provider = None
+    for alias in missing_aliases:
+        esh_size = esh_size_map[alias]
+        core_size = db_size_map.get(alias)
+        if core_size:
+            core_size = _update_from_cloud_size(core_size, esh_size)
+        else:
+            if not provider:
+                try:
+                    provider = Provider.objects.get(uuid=provider_uuid)
+                except Provider.DoesNotExist:
+                    raise Exception("Provider UUID: %s does not exist."
+                                    % provider_uuid)
+            core_size = _create_from_cloud_size(esh_size, provider)
+        _set_synced_size(esh_size, provider_uuid, core_size)
+        core_size.esh = esh_size
+        core_size_map[alias] = core_size
+    return core_size_map
+
+
 def _update_from_cloud_size(core_size, esh_size):
     """
     Full scope replacement based on cloud(rtwo) size
+    (Saved only when the cloud size has changed)
     """
-    core_size.name = esh_size.name
-    core_size.disk = esh_size.disk
-    core_size.root = esh_size.ephemeral
-    core_size.cpu = esh_size.cpu
-    core_size.mem = esh_size.ram
-    core_size.save()
+    cloud_values = {
+        'name': esh_size.name,
+        'disk': esh_size.disk,
+        'root': esh_size.ephemeral,
+        'cpu': esh_size.cpu,
+        'mem': esh_size.ram,
+    }
+    changed = False
+    for field_name, value in cloud_values.items():
+        if getattr(core_size, field_name) != value:
+            setattr(core_size, field_name, value)
+            changed = True
+    if changed:
+        core_size.save()
     return core_size
 
 
@@ -126,3 +223,17 @@ def create_size(name, alias, cpu, mem, disk, root, provider_uuid):
         root=root,
         provider=provider)
     return size
+
+
+def size_sync_changed(sender, instance, **kwargs):
+    """
+    Sizes saved/deleted in this process (ex: end-dated, or edited by
+    an admin) are read from the database on their next conversion.
+    """
+    for key in [key for key in _size_sync_map.keys()
+                if key[1] == instance.alias]:
+        _size_sync_map.pop(key, None)
+
+
+post_save.connect(size_sync_changed, sender=Size)
+post_delete.connect(size_sync_changed, sender=Size)
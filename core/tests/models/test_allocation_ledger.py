@@ -0,0 +1,85 @@
+"""
+test allocation ledger models
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models import AllocationLedger, Instance, InstanceSource,\
+    InstanceStatus, InstanceStatusHistory, Size
+
+
+class TestLedgerInvalidation(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.size = Size.objects.create(
+            alias='1', name='small', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+        self.active = InstanceStatus.objects.get_or_create(name='active')[0]
+        self.now = timezone.now()
+        self.checkpoint = self.now - timedelta(days=1)
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        self.instance = Instance.objects.create(
+            name='instance', source=source,
+            provider_alias=str(uuid.uuid4()), created_by=self.user,
+            created_by_identity=self.identity,
+            start_date=self.now - timedelta(days=3))
+        self.history = InstanceStatusHistory.objects.create(
+            instance=self.instance, size=self.size, status=self.active,
+            start_date=self.instance.start_date)
+
+    def _create_ledger(self):
+        return AllocationLedger.objects.create(
+            identity=self.identity, start_date=self.now - timedelta(days=30),
+            checkpoint=self.checkpoint, fingerprint='rules')
+
+    def _has_ledger(self):
+        return AllocationLedger.objects.filter(
+            identity=self.identity).exists()
+
+    def test_bulk_end_date_after_checkpoint_keeps_ledger(self):
+        self._create_ledger()
+        Instance.bulk_end_date([self.instance], self.now)
+        self.assertTrue(self._has_ledger())
+
+    def test_backdated_bulk_end_date_removes_ledger(self):
+        self._create_ledger()
+        Instance.bulk_end_date(
+            [self.instance], self.checkpoint - timedelta(hours=1))
+        self.assertFalse(self._has_ledger())
+
+    def test_backdated_bulk_transaction_removes_ledger(self):
+        self._create_ledger()
+        InstanceStatusHistory.bulk_transaction(
+            [(self.instance, self.history, 'suspended', self.size)],
+            self.checkpoint - timedelta(hours=1))
+        self.assertFalse(self._has_ledger())
+
+    def test_editing_counted_history_removes_ledger(self):
+        self.history.end_date = self.checkpoint - timedelta(hours=2)
+        self.history.save()
+        self._create_ledger()
+        self.history.end_date = self.now
+        self.history.save()
+        self.assertFalse(self._has_ledger())
+
+    def test_new_open_history_is_not_checked(self):
+        self._create_ledger()
+        with CaptureQueriesContext(connection) as context:
+            InstanceStatusHistory.objects.create(
+                instance=self.instance, size=self.size, status=self.active,
+                start_date=self.now)
+        self.assertFalse(any('allocation_ledger' in query['sql']
+                             for query in context.captured_queries))
+        self.assertTrue(self._has_ledger())
@@ -0,0 +1,115 @@
+"""
+test instance models
+"""
+import uuid
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+from rtwo.size import MockSize
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models import Instance, InstanceSource, InstanceStatus,\
+    InstanceStatusHistory, Size
+from core.models.instance import convert_esh_instances
+from core.models.size import _size_sync_map
+
+
+class FakeSize(object):
+
+    def __init__(self, alias):
+        self.id = alias
+        self.name = 'small'
+        self.disk = 10
+        self.ephemeral = 0
+        self.cpu = 1
+        self.ram = 1024
+        self.extra = {}
+
+
+class FakeInstance(object):
+
+    def __init__(self, instance_id, size, status='active'):
+        self.id = instance_id
+        self.size = size
+        self.ip = '10.0.0.1'
+        self.extra = {'status': status}
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.sizes_looked_up = []
+
+    def get_size(self, alias):
+        self.sizes_looked_up.append(alias)
+        return FakeSize(alias)
+
+
+class TestConvertEshInstances(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.size = Size.objects.create(
+            alias='1', name='small', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+        self.driver = FakeDriver()
+        _size_sync_map.clear()
+
+    def tearDown(self):
+        _size_sync_map.clear()
+
+    def _create_instance(self, status='active'):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        instance = Instance.objects.create(
+            name='instance', source=source, ip_address='10.0.0.1',
+            provider_alias=str(uuid.uuid4()), created_by=self.user,
+            created_by_identity=self.identity,
+            start_date=timezone.now() - timedelta(days=1))
+        InstanceStatusHistory.objects.create(
+            instance=instance, size=self.size,
+            status=InstanceStatus.objects.get_or_create(name=status)[0],
+            start_date=instance.start_date)
+        return instance
+
+    def _convert(self, esh_instances):
+        return convert_esh_instances(
+            self.driver, esh_instances, self.provider.uuid,
+            self.identity.uuid, self.user)
+
+    def test_sizes_are_looked_up_once_per_instance(self):
+        instances = [self._create_instance() for _ in range(2)]
+        esh_instances = [
+            FakeInstance(instance.provider_alias,
+                         MockSize('1', self.provider))
+            for instance in instances]
+        core_instances = self._convert(esh_instances)
+        self.assertEquals(self.driver.sizes_looked_up, ['1', '1'])
+        self.assertEquals(core_instances, instances)
+        self.assertEquals(
+            [core_instance.esh for core_instance in core_instances],
+            esh_instances)
+
+    def test_only_changed_status_starts_a_new_history(self):
+        unchanged = self._create_instance()
+        changed = self._create_instance()
+        self._convert([
+            FakeInstance(unchanged.provider_alias, FakeSize('1')),
+            FakeInstance(changed.provider_alias, FakeSize('1'),
+                         'suspended')])
+        self.assertEquals(
+            [history.status.name for history in
+             unchanged.instancestatushistory_set.order_by('start_date')],
+            ['active'])
+        histories = list(
+            changed.instancestatushistory_set.order_by('start_date'))
+        self.assertEquals(
+            [history.status.name for history in histories],
+            ['active', 'suspended'])
+        self.assertIsNotNone(histories[0].end_date)
+        self.assertIsNone(histories[1].end_date)
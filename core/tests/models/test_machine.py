@@ -0,0 +1,75 @@
+"""
+test provider machine models
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory, ImageFactory
+from core.models import ApplicationVersion, InstanceSource, ProviderMachine
+from core.models.machine import ProviderMachineCache, machine_cache
+
+
+class TestProviderMachineCache(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.version = ApplicationVersion.objects.create(
+            application=ImageFactory.create(created_by=self.user),
+            name='1.0', created_by=self.user)
+        self.cache = ProviderMachineCache(max_size=2, timeout=60)
+        machine_cache.clear()
+
+    def _create_machine(self):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()),
+            start_date=timezone.now() - timedelta(minutes=1))
+        return ProviderMachine.objects.create(
+            instance_source=source, application_version=self.version)
+
+    def _get(self, machine):
+        return self.cache.get(self.provider.uuid, machine.identifier)
+
+    def test_provider_is_loaded_with_one_query(self):
+        machines = [self._create_machine() for _ in range(2)]
+        with CaptureQueriesContext(connection) as context:
+            found = [self._get(machine) for machine in machines]
+            self.assertEquals(found[0].instance_source.provider,
+                              self.provider)
+        self.assertEquals(len(context.captured_queries), 1)
+        self.assertEquals(found, machines)
+
+    def test_lookups_return_copies(self):
+        machine = self._create_machine()
+        self._get(machine).esh = "esh machine"
+        self.assertIsNone(self._get(machine).esh)
+
+    def test_least_recently_used_is_evicted(self):
+        machines = [self._create_machine() for _ in range(3)]
+        self._get(machines[2])
+        self._get(machines[0])
+        with CaptureQueriesContext(connection) as context:
+            self._get(machines[1])
+            self._get(machines[0])
+        self.assertEquals(len(context.captured_queries), 1)
+        with CaptureQueriesContext(connection) as context:
+            self._get(machines[2])
+        self.assertEquals(len(context.captured_queries), 1)
+
+    def test_saved_machines_are_re_read(self):
+        machine = self._create_machine()
+        self.assertIsNone(
+            machine_cache.get(self.provider.uuid, 'unknown'))
+        machine_cache.get(self.provider.uuid, machine.identifier)
+        end_date = timezone.now()
+        machine.instance_source.end_date = end_date
+        machine.instance_source.save()
+        self.assertEquals(
+            machine_cache.get(
+                self.provider.uuid, machine.identifier).end_date,
+            end_date)
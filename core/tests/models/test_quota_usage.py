@@ -0,0 +1,90 @@
+"""
+test quota usage models
+"""
+import uuid
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models import Instance, InstanceSource, QuotaUsage, Size
+from core.models.quota_usage import batch_quota_usage, get_quota_usage
+
+
+class TestQuotaUsage(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.small = Size.objects.create(
+            alias='1', name='small', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+        self.large = Size.objects.create(
+            alias='2', name='large', provider=self.provider,
+            cpu=4, mem=8192, disk=40, root=0)
+
+    def _launch(self, size, status='active'):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        instance = Instance.objects.create(
+            name='instance', source=source,
+            provider_alias=str(uuid.uuid4()), created_by=self.user,
+            created_by_identity=self.identity, start_date=timezone.now())
+        instance._build_first_history(status, size, instance.start_date)
+        return instance
+
+    def _usage(self):
+        return QuotaUsage.objects.get(identity=self.identity).get_usage()
+
+    def test_usage_follows_history(self):
+        small_instance = self._launch(self.small)
+        large_instance = self._launch(self.large)
+        self.assertEquals(
+            self._usage(),
+            {'cpu': 5, 'ram': 9216, 'disk': 50, 'suspended_count': 0})
+        large_instance.update_history('suspended', self.large)
+        self.assertEquals(
+            self._usage(),
+            {'cpu': 1, 'ram': 1024, 'disk': 10, 'suspended_count': 1})
+        small_instance.update_history('active', self.large)
+        large_instance.end_date_all()
+        self.assertEquals(
+            self._usage(),
+            {'cpu': 4, 'ram': 8192, 'disk': 40, 'suspended_count': 0})
+
+    def test_launch_uses_up_reservation(self):
+        quota_usage = get_quota_usage(self.identity)
+        quota_usage.reserve(4, 8192, 40)
+        quota_usage.save()
+        self.assertEquals(self._usage()['cpu'], 4)
+        self._launch(self.large)
+        quota_usage = QuotaUsage.objects.get(identity=self.identity)
+        self.assertEquals(quota_usage.reserved_cpu, 0)
+        self.assertEquals(self._usage()['cpu'], 4)
+
+    def test_reservation_expires(self):
+        quota_usage = get_quota_usage(self.identity)
+        quota_usage.reserve(4, 8192, 40)
+        self.assertEquals(quota_usage.get_usage(
+            now_time=quota_usage.reserved_until)['cpu'], 0)
+
+    def test_batch_recounts_once(self):
+        small_instance = self._launch(self.small)
+        large_instance = self._launch(self.large)
+        with CaptureQueriesContext(connection) as context:
+            with batch_quota_usage():
+                small_instance.update_history('suspended', self.small)
+                with batch_quota_usage():
+                    large_instance.update_history('suspended', self.large)
+                self.assertEquals(self._usage()['cpu'], 5)
+        self.assertEquals(
+            len([query for query in context.captured_queries
+                 if 'UPDATE "quota_usage"' in query['sql']]), 1)
+        self.assertEquals(
+            self._usage(),
+            {'cpu': 0, 'ram': 0, 'disk': 0, 'suspended_count': 2})
@@ -0,0 +1,73 @@
+"""
+test size models
+"""
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from api.tests.factories import ProviderFactory
+from core.models import Size
+from core.models.size import convert_esh_size, convert_esh_sizes,\
+    _size_sync_map
+
+
+class FakeSize(object):
+
+    def __init__(self, alias, name='small', cpu=1):
+        self.id = alias
+        self.name = name
+        self.disk = 10
+        self.ephemeral = 0
+        self.cpu = cpu
+        self.ram = 1024
+
+
+class TestSizeSync(TestCase):
+
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+        self.size = Size.objects.create(
+            alias='1', name='small', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+        _size_sync_map.clear()
+
+    def tearDown(self):
+        _size_sync_map.clear()
+
+    def _convert(self, esh_size):
+        return convert_esh_size(esh_size, self.provider.uuid)
+
+    def test_unchanged_size_is_not_written(self):
+        with CaptureQueriesContext(connection) as context:
+            core_size = self._convert(FakeSize('1'))
+        self.assertEquals(core_size, self.size)
+        self.assertEquals(len(context.captured_queries), 1)
+
+    def test_synced_size_is_not_read_again(self):
+        self._convert(FakeSize('1'))
+        with CaptureQueriesContext(connection) as context:
+            core_sizes = convert_esh_sizes(
+                [FakeSize('1')], self.provider.uuid)
+        self.assertEquals(len(context.captured_queries), 0)
+        self.assertEquals(core_sizes['1'], self.size)
+
+    def test_changed_cloud_size_is_written(self):
+        self._convert(FakeSize('1'))
+        self._convert(FakeSize('1', cpu=2))
+        self.assertEquals(Size.objects.get(id=self.size.id).cpu, 2)
+
+    def test_saved_size_is_read_again(self):
+        self._convert(FakeSize('1'))
+        self.size.name = 'renamed'
+        self.size.save()
+        with CaptureQueriesContext(connection) as context:
+            core_size = self._convert(FakeSize('1'))
+        self.assertEquals(len(context.captured_queries), 2)
+        self.assertEquals(core_size.name, 'small')
+
+    @override_settings(SIZE_SYNC_TIMEOUT=-1)
+    def test_expired_size_is_read_again(self):
+        self._convert(FakeSize('1'))
+        with CaptureQueriesContext(connection) as context:
+            self._convert(FakeSize('1'))
+        self.assertEquals(len(context.captured_queries), 1)
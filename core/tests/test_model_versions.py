@@ -0,0 +1,97 @@
+"""
+test model versions
+"""
+import uuid
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core import model_versions
+from core.model_versions import bump_model_versions, get_model_versions
+from core.models import Instance, InstanceSource, InstanceStatus,\
+    InstanceStatusHistory, Size
+from service import cache
+from service.tests.fake_redis import FakeRedis
+
+
+class TestModelVersions(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        model_versions._redis_down_until = 0
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.other_identity = IdentityFactory.create(
+            provider=self.provider, created_by=UserFactory.create())
+        self.size = Size.objects.create(
+            alias='1', name='small', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+
+    def tearDown(self):
+        cache.connection = self._connection
+        model_versions._redis_down_until = 0
+
+    def _create_instance(self, identity):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        return Instance.objects.create(
+            name='instance', source=source,
+            provider_alias=str(uuid.uuid4()),
+            created_by=identity.created_by, created_by_identity=identity,
+            start_date=timezone.now())
+
+    def _versions(self, scopes=None):
+        return [version for (version, _) in get_model_versions(
+            [Instance, InstanceStatusHistory], scopes=scopes)]
+
+    def test_saves_only_change_their_own_scope(self):
+        instance = self._create_instance(self.identity)
+        versions = self._versions(scopes=[self.identity.id])
+        all_versions = self._versions()
+        self._create_instance(self.other_identity).update_history(
+            'active', self.size)
+        self.assertEquals(
+            self._versions(scopes=[self.identity.id]), versions)
+        self.assertNotEquals(self._versions(), all_versions)
+        instance.update_history('active', self.size)
+        self.assertNotEquals(
+            self._versions(scopes=[self.identity.id]), versions)
+
+    def test_unknown_scope_changes_every_scope(self):
+        versions = self._versions(scopes=[self.identity.id])
+        bump_model_versions(InstanceStatusHistory)
+        self.assertNotEquals(
+            self._versions(scopes=[self.identity.id]), versions)
+
+    def test_bulk_updates_change_their_scopes(self):
+        instance = self._create_instance(self.identity)
+        history = InstanceStatusHistory.objects.create(
+            instance=instance, size=self.size,
+            status=InstanceStatus.objects.get_or_create(name='active')[0],
+            start_date=instance.start_date)
+        versions = self._versions(scopes=[self.identity.id])
+        other_versions = self._versions(scopes=[self.other_identity.id])
+        InstanceStatusHistory.bulk_transaction(
+            [(instance, history, 'suspended', self.size)])
+        self.assertNotEquals(
+            self._versions(scopes=[self.identity.id]), versions)
+        self.assertEquals(
+            self._versions(scopes=[self.other_identity.id]), other_versions)
+
+    def test_redis_timeouts_mark_redis_down(self):
+        self.redis.data.clear()
+        self.redis.down = True
+        self.assertIsNone(get_model_versions([Instance]))
+        self.redis.down = False
+        # Not tried again until REDIS_RETRY_INTERVAL has passed
+        self.assertIsNone(get_model_versions([Instance]))
+        bump_model_versions(Instance)
+        self.assertEquals(self.redis.data, {})
+        model_versions._redis_down_until = 0
+        self.assertEquals(get_model_versions([Instance]), [(0, 0.0)])
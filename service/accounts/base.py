@@ -2,10 +2,16 @@
 Methods to cache data.
 """
 import cPickle as pickle
+
+from django.conf import settings
+
 import redis
-# TODO: Make this look like a global (ALL_CAPS?)
-# NOTE: This variable represents the globally-shared connection
-redis_connection = None
+
+from threepio import logger
+
+
+ACCOUNT_CACHE_KEY = "account.{0}.{1}.{2}"
+ACCOUNT_CACHE_LIST_KEY = "account.{0}.{1}"
 
 
 class BaseAccountDriver(object):
@@ -39,13 +45,18 @@ class CachedAccountDriver(object):
     """
     Basic account driver with caching
     -- Use this when your account driver can be cached.
+    Sub-classes convert each resource to plain data for the cache
+    (and back) with '_<resource>_to_cache' and '_<resource>_from_cache'.
     """
-    cache_driver = None
     namespace = None
 
     def __init__(self, namespace="Atmosphere"):
         self.namespace = namespace
-        self.cache_driver = CacheDriver(self.namespace)
+
+    @property
+    def cache_driver(self):
+        # NOTE: Sub-classes may change the namespace after __init__
+        return CacheDriver(self.namespace)
 
     def _get_image(self, *args, **kwargs):
         raise NotImplementedError("Implement this in the sub-class")
@@ -53,107 +64,203 @@ class CachedAccountDriver(object):
     def _list_all_images(self, *args, **kwargs):
         raise NotImplementedError("Implement this in the sub-class")
 
+    def _image_to_cache(self, image):
+        return image
+
+    def _image_from_cache(self, data):
+        return data
+
     def list_images(self, force=False, *args, **kwargs):
         """
+        NOTE: Only the complete list (No args/kwargs) is cached.
         """
-        list_namespace = self.namespace + "_images"
-        get_namespace = self.namespace + "_image"
+        if args or kwargs:
+            return self._list_all_images(*args, **kwargs)
         return self.cache_driver.cache_resource_list(
-            list_namespace,
+            "images",
             self._list_all_images,
-            resource_prefix=get_namespace,
-            force=force,
-            **kwargs)
+            to_cache=self._image_to_cache,
+            from_cache=self._image_from_cache,
+            force=force)
 
     def get_image(self, identifier, force=False, *args, **kwargs):
-        get_namespace = self.namespace + "_image_" + identifier
         return self.cache_driver.cache_resource(
+            "images",
             identifier,
-            get_namespace,
             self._get_image,
+            to_cache=self._image_to_cache,
+            from_cache=self._image_from_cache,
             force=force,
             *args,
             **kwargs)
 
+    def invalidate_image(self, identifier=None):
+        """
+        Call after changing image 'identifier' (Or after creating/deleting
+        an image, without an identifier)
+        """
+        self.cache_driver.invalidate("images", identifier)
+
+
+def _redis_connection():
+    from service.cache import redis_connection
+    return redis_connection()
+
+
+def _log_redis_down():
+    logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
+                 "Somebody should turn it on!")
+
 
 class CacheDriver():
 
-    def __init__(self, namespace, timeout_sec=2 * 60):
+    """
+    A read-through cache (in redis) of account driver resources.
+    * Every resource is kept under its own key:
+      account.<namespace>.<resource_type>.<identifier>
+    * A list is kept as the identifiers of its resources, and is read back
+      with a single MGET of those keys.
+    * Resources expire after settings.ACCOUNT_CACHE_TIMEOUTS[resource_type]
+    When redis-server is not running, every call goes to the cloud.
+    """
+
+    def __init__(self, namespace):
         self.namespace = namespace
-        self.timeout_sec = timeout_sec
-        self.build_redis_connection()
 
-    def build_redis_connection(self):
-        global redis_connection
-        if not redis_connection:
-            redis_connection = redis.StrictRedis()
+    def _key(self, resource_type, identifier):
+        return ACCOUNT_CACHE_KEY.format(
+            self.namespace, resource_type, identifier)
+
+    def _list_key(self, resource_type):
+        return ACCOUNT_CACHE_LIST_KEY.format(self.namespace, resource_type)
+
+    def get_timeout(self, resource_type):
+        timeouts = settings.ACCOUNT_CACHE_TIMEOUTS
+        return timeouts.get(resource_type, timeouts['default'])
 
     def cache_resource(
             self,
+            resource_type,
             identifier,
-            keyname,
             get_method,
+            to_cache=None,
+            from_cache=None,
             force=False,
             *get_method_args,
             **get_method_kwargs):
         """
-        ReCache resources on first call/cache miss/force=True
-        Returned cached resources whenever possible.
-        If 'resource_prefix' is set:
-            set individual resources in the list.
+        Return resource 'identifier', calling 'get_method' on a
+        cache miss (or force=True) and caching the result.
+        'to_cache' and 'from_cache' convert the resource to/from the
+        (picklable) value that is cached.
         """
-        resource = None  # self.get_object(keyname)
-        if not resource or force:
-            resource = get_method(
-                identifier,
-                *get_method_args,
-                **get_method_kwargs)
-            self.set_object(keyname, resource)
+        key = self._key(resource_type, identifier)
+        if not force:
+            cached = self.get_object(key)
+            if cached is not None:
+                return from_cache(cached) if from_cache else cached
+        resource = get_method(
+            identifier,
+            *get_method_args,
+            **get_method_kwargs)
+        if resource is not None:
+            self.set_object(
+                key, to_cache(resource) if to_cache else resource,
+                timeout=self.get_timeout(resource_type))
         return resource
 
     def cache_resource_list(
             self,
-            list_namespace,
+            resource_type,
             list_method,
-            resource_prefix=None,
+            to_cache=None,
+            from_cache=None,
             resource_attr='id',
             force=False,
             **list_method_kwargs):
         """
-        ReCache resources on first call/cache miss/force=True
-        Returned cached resources whenever possible.
-        If 'resource_prefix' is set:
-            set individual resources in the list.
+        Return the list of resources, calling 'list_method' on a
+        cache miss (or force=True). Every resource in the list is
+        cached (and can be read by 'cache_resource') too.
         """
-        resources = None  # self.get_object(list_namespace)
-        if not resources or force:
-            resources = list_method(**list_method_kwargs)
-            # Also set every individual resource in cache
-            if resource_prefix:
-                for resource in resources:
-                    self.set_object(
-                        "%s_%s" %
-                        (resource_prefix,
-                         getattr(
-                             resource,
-                             resource_attr)),
-                        resource)
-            self.set_object(list_namespace, resources)
+        if not force:
+            cached = self._read_list(resource_type)
+            if cached is not None:
+                return [from_cache(value) if from_cache else value
+                        for value in cached]
+        resources = list_method(**list_method_kwargs)
+        self._write_list(resource_type, resources, to_cache, resource_attr)
         return resources
 
+    def _read_list(self, resource_type):
+        """
+        Returns the list of cached values, or None on a miss
+        (Including any resource of the list that has expired)
+        """
+        try:
+            r = _redis_connection()
+            identifiers = r.get(self._list_key(resource_type))
+            if identifiers is None:
+                return None
+            identifiers = pickle.loads(identifiers)
+            if not identifiers:
+                return []
+            values = r.mget([self._key(resource_type, identifier)
+                             for identifier in identifiers])
+        except redis.exceptions.RedisError:
+            _log_redis_down()
+            return None
+        if any(value is None for value in values):
+            return None
+        return [pickle.loads(value) for value in values]
+
+    def _write_list(self, resource_type, resources, to_cache, resource_attr):
+        timeout = self.get_timeout(resource_type)
+        identifiers = []
+        try:
+            pipe = _redis_connection().pipeline()
+            for resource in resources:
+                identifier = getattr(resource, resource_attr)
+                identifiers.append(identifier)
+                pipe.set(self._key(resource_type, identifier),
+                         pickle.dumps(to_cache(resource) if to_cache
+                                      else resource),
+                         ex=timeout)
+            pipe.set(self._list_key(resource_type),
+                     pickle.dumps(identifiers), ex=timeout)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            _log_redis_down()
+
+    def invalidate(self, resource_type, identifier=None):
+        """
+        Forget resource 'identifier' (if given) and the list that
+        holds it.
+        """
+        keys = [self._list_key(resource_type)]
+        if identifier:
+            keys.append(self._key(resource_type, identifier))
+        try:
+            _redis_connection().delete(*keys)
+        except redis.exceptions.RedisError:
+            _log_redis_down()
+
     def _get(self, name):
-        return redis_connection.get(name)
+        return _redis_connection().get(name)
 
     def get_object(self, name):
-        value = self._get(name)
+        try:
+            value = self._get(name)
+        except redis.exceptions.RedisError:
+            _log_redis_down()
+            return None
         return pickle.loads(value) if value else None
 
-    def _set(self, name, value, timeout=None):
-        if not timeout:
-            timeout = self.timeout_sec
-        redis_connection.set(name, value, ex=timeout)
+    def _set(self, name, value, timeout):
+        _redis_connection().set(name, value, ex=timeout)
 
-    def set_object(self, name, value, timeout=None):
-        if not timeout:
-            timeout = self.timeout_sec
-        self._set(name, pickle.dumps(value), timeout=timeout)
+    def set_object(self, name, value, timeout):
+        try:
+            self._set(name, pickle.dumps(value), timeout=timeout)
+        except redis.exceptions.RedisError:
+            _log_redis_down()
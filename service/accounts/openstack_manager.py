@@ -30,7 +30,8 @@ from core.models import AtmosphereUser as User
 from core.ldap import get_uid_number
 from core.models.identity import Identity
 
-from service.accounts.base import BaseAccountDriver
+from service.accounts.base import CachedAccountDriver
+from service.cache import invalidate_provisioned_state
 
 
 def get_unique_id(userid):
@@ -47,7 +48,57 @@ def get_random_uid(userid):
     return int(random.uniform(1, MAX_SUBNET))
 
 
-class AccountDriver(BaseAccountDriver):
+class TenantDirectory(object):
+    """
+    The projects (tenants) of a provider, indexed by id and by name.
+    Build one per sweep (See AccountDriver.get_tenant_directory).
+    It starts from the (cached) project list, and is refreshed from
+    keystone (once) the first time an unknown tenant is looked up.
+    """
+
+    def __init__(self, account_driver):
+        self.account_driver = account_driver
+        self.refreshed = False
+        self._index(account_driver.list_projects())
+
+    def _index(self, projects):
+        self.projects_by_id = {project.id: project for project in projects}
+        self.projects_by_name = {project.name: project
+                                 for project in projects}
+
+    def refresh(self):
+        self._index(self.account_driver.list_projects(force=True))
+        self.refreshed = True
+
+    def _lookup(self, index_name, key):
+        project = getattr(self, index_name).get(key)
+        if project is None and not self.refreshed:
+            self.refresh()
+            project = getattr(self, index_name).get(key)
+        return project
+
+    def get_by_id(self, tenant_id):
+        return self._lookup('projects_by_id', tenant_id)
+
+    def get_by_name(self, tenant_name):
+        return self._lookup('projects_by_name', tenant_name)
+
+    def get_name(self, tenant_id):
+        """
+        Returns the name of 'tenant_id' (or None, if it does not exist)
+        """
+        project = self.get_by_id(tenant_id)
+        return project.name if project else None
+
+    def all(self):
+        return self.projects_by_id.values()
+
+    def id_to_name_map(self):
+        return {tenant_id: project.name
+                for (tenant_id, project) in self.projects_by_id.items()}
+
+
+class AccountDriver(CachedAccountDriver):
     user_manager = None
     image_manager = None
     network_manager = None
@@ -95,6 +146,7 @@ class AccountDriver(BaseAccountDriver):
     def clear_cache(self):
         self.admin_driver.provider.machineCls.invalidate_provider_cache(
                 self.admin_driver.provider)
+        self.invalidate_image()
         return self.admin_driver
 
     def _init_by_provider(self, provider, *args, **kwargs):
@@ -187,9 +239,10 @@ class AccountDriver(BaseAccountDriver):
                     if self.identity_version > 2:
                         kwargs.update({'domain': 'default'})
                     project = self.user_manager.create_project(project_name, **kwargs)
+                    self.cache_driver.invalidate("projects")
 
                 # 2. Create User (And add them to the project)
-                user = self.get_user(username)
+                user = self.get_user(username, force=True)
                 if not user:
                     logger.info("Creating account: %s - %s - %s"
                                 % (username, password, project))
@@ -198,6 +251,7 @@ class AccountDriver(BaseAccountDriver):
                         kwargs.update({'domain': 'default'})
                     user = self.user_manager.create_user(username, password,
                                                          project, **kwargs)
+                    self.cache_driver.invalidate("users")
                 # 3.1 Include the admin in the project
                 # TODO: providercredential initialization of
                 #  "default_admin_role"
@@ -351,6 +405,45 @@ class AccountDriver(BaseAccountDriver):
             glance_image.id,
             project.id,
             'accepted')
+        self.invalidate_image_members(glance_image.id)
+
+    def update_image(self, glance_image, **kwargs):
+        result = self.image_manager.update_image(glance_image, **kwargs)
+        self.invalidate_image(glance_image.id)
+        return result
+
+    def share_image(self, glance_image, project_name, **kwargs):
+        result = self.image_manager.share_image(
+            glance_image, project_name, **kwargs)
+        self.invalidate_image_members(glance_image.id)
+        return result
+
+    def unshare_image(self, glance_image, project_name, **kwargs):
+        result = self.image_manager.unshare_image(
+            glance_image, project_name, **kwargs)
+        self.invalidate_image_members(glance_image.id)
+        return result
+
+    def list_image_members(self, image_id, force=False):
+        """
+        Returns the (glance) members of image 'image_id'
+        (An empty list for public images)
+        """
+        return self.cache_driver.cache_resource(
+            "image_members",
+            image_id,
+            self._list_image_members,
+            to_cache=lambda members: [dict(member) for member in members],
+            from_cache=lambda members: [
+                self.image_manager.glance.image_members.model(member)
+                for member in members],
+            force=force)
+
+    def _list_image_members(self, image_id):
+        return list(self.image_manager.shared_images_for(image_id=image_id))
+
+    def invalidate_image_members(self, image_id):
+        self.cache_driver.invalidate("image_members", image_id)
 
         
 
@@ -405,8 +498,21 @@ class AccountDriver(BaseAccountDriver):
         # Return the identity
         return identity
 
+    def invalidate_provisioned_project(self, project_name):
+        """
+        Forget what was provisioned for the identities of 'project_name'
+        (See 'service.instance._provision_openstack_instance')
+        """
+        if not self.core_provider:
+            return
+        invalidate_provisioned_state(*Identity.objects.filter(
+            provider=self.core_provider,
+            credential__key='ex_tenant_name',
+            credential__value=project_name))
+
     def rebuild_project_network(self, username, project_name,
                                 dns_nameservers=[]):
+        self.invalidate_provisioned_project(project_name)
         self.network_manager.delete_project_network(username, project_name)
         net_args = self._base_network_creds()
         self.network_manager.create_project_network(
@@ -419,6 +525,7 @@ class AccountDriver(BaseAccountDriver):
         return True
 
     def delete_security_group(self, identity):
+        invalidate_provisioned_state(identity)
         identity_creds = self.parse_identity(identity)
         project_name = identity_creds["tenant_name"]
         project = self.user_manager.keystone.tenants.find(name=project_name)
@@ -430,6 +537,7 @@ class AccountDriver(BaseAccountDriver):
         return True
 
     def delete_network(self, identity, remove_network=True):
+        invalidate_provisioned_state(identity)
         # Core credentials need to be converted to openstack names
         identity_creds = self.parse_identity(identity)
         username = identity_creds["username"]
@@ -467,6 +575,7 @@ class AccountDriver(BaseAccountDriver):
 
         # 1. Network cleanup
         if project:
+            self.invalidate_provisioned_project(projectname)
             self.network_manager.delete_project_network(username, projectname)
             # 2. Role cleanup (Admin too)
             self.user_manager.delete_all_roles(username, projectname)
@@ -474,10 +583,12 @@ class AccountDriver(BaseAccountDriver):
             self.user_manager.delete_all_roles(adminuser, projectname)
             # 3. Project cleanup
             self.user_manager.delete_project(projectname)
+            self.cache_driver.invalidate("projects", project.id)
         # 4. User cleanup
         user = self.user_manager.get_user(username)
         if user:
             self.user_manager.delete_user(username)
+            self.cache_driver.invalidate("users", user.id)
         return True
 
     def hashpass(self, username):
@@ -499,6 +610,23 @@ class AccountDriver(BaseAccountDriver):
     def _list_all_images(self, *args, **kwargs):
         return self.image_manager.list_images(*args, **kwargs)
 
+    def _image_to_cache(self, image):
+        return dict(image)
+
+    def _image_from_cache(self, data):
+        return self.image_manager.glance.images.model(data)
+
+    def _keystone_to_cache(self, resource):
+        return resource.to_dict()
+
+    def _project_from_cache(self, data):
+        projects = self.user_manager.keystone_projects()
+        return projects.resource_class(projects, data, loaded=True)
+
+    def _user_from_cache(self, data):
+        users = self.user_manager.keystone.users
+        return users.resource_class(users, data, loaded=True)
+
     def tenant_instances_map(
             self,
             status_list=[],
@@ -511,21 +639,23 @@ class AccountDriver(BaseAccountDriver):
         * match_all (bool) - If True, instances must match ALL words in the list.
         * include_empty (bool) - If True, include ALL tenants in the map.
         """
-        all_projects = self.list_projects()
+        tenant_directory = self.get_tenant_directory()
         all_instances = self.list_all_instances()
         if include_empty:
-            project_map = {proj: [] for proj in all_projects}
+            project_map = {proj: [] for proj in tenant_directory.all()}
         else:
             project_map = {}
         for instance in all_instances:
             try:
                 # NOTE: will someday be 'projectId'
                 tenant_id = instance.extra['tenantId']
-
-                project = [p for p in all_projects if p.id == tenant_id][0]
             except (ValueError, KeyError):
                 raise Exception(
                     "The implementaion for recovering a tenant id has changed. Update the code base above this line!")
+            project = tenant_directory.get_by_id(tenant_id)
+            if not project:
+                raise Exception("Tenant %s of instance %s was not found"
+                                % (tenant_id, instance.id))
 
             metadata = instance._node.extra.get('metadata', {})
             instance_status = instance.extra.get('status')
@@ -564,14 +694,20 @@ class AccountDriver(BaseAccountDriver):
     def list_all_instances(self, **kwargs):
         return self.admin_driver.list_all_instances(**kwargs)
 
-    def list_all_images(self, **kwargs):
-        return self.image_manager.list_images(**kwargs)
+    def list_all_images(self, force=False, **kwargs):
+        return self.list_images(force=force, **kwargs)
 
     def list_all_snapshots(self, **kwargs):
         return [img for img in self.list_all_images(**kwargs) if 'snapshot' in img.get('image_type','image').lower()]
 
-    def get_project_by_id(self, project_id):
-        return self.user_manager.get_project_by_id(project_id)
+    def get_project_by_id(self, project_id, force=False):
+        return self.cache_driver.cache_resource(
+            "projects",
+            project_id,
+            self.user_manager.get_project_by_id,
+            to_cache=self._keystone_to_cache,
+            from_cache=self._project_from_cache,
+            force=force)
 
     def get_project(self, project_name, **kwargs):
         if self.identity_version > 2:
@@ -579,9 +715,10 @@ class AccountDriver(BaseAccountDriver):
         return self.user_manager.get_project(project_name, **kwargs)
 
     def _make_tenant_id_map(self):
-        all_projects = self.list_projects()
-        tenant_id_map = {project.id: project.name for project in all_projects}
-        return tenant_id_map
+        return self.get_tenant_directory().id_to_name_map()
+
+    def get_tenant_directory(self):
+        return TenantDirectory(self)
 
     def create_trust(
             self,
@@ -635,10 +772,21 @@ class AccountDriver(BaseAccountDriver):
     def list_trusts(self):
         return [t for t in self.openstack_sdk.identity.trusts()]
 
-    def list_projects(self, **kwargs):
-        if self.identity_version > 2:
-            kwargs = self._parse_domain_kwargs(kwargs, domain_override='domain')
-        return self.user_manager.list_projects(**kwargs)
+    def list_projects(self, force=False, **kwargs):
+        """
+        NOTE: Only the complete list (No kwargs) is cached.
+        """
+        if kwargs:
+            if self.identity_version > 2:
+                kwargs = self._parse_domain_kwargs(
+                    kwargs, domain_override='domain')
+            return self.user_manager.list_projects(**kwargs)
+        return self.cache_driver.cache_resource_list(
+            "projects",
+            self.user_manager.list_projects,
+            to_cache=self._keystone_to_cache,
+            from_cache=self._project_from_cache,
+            force=force)
 
     def list_roles(self, **kwargs):
         """
@@ -657,10 +805,10 @@ class AccountDriver(BaseAccountDriver):
             raise Exception("role name/id %s matched more than one value -- Fix the code" % (role_name_or_id,))
         return found_roles[0]
 
-    def get_user(self, user_name_or_id, **list_kwargs):
+    def get_user(self, user_name_or_id, force=False, **list_kwargs):
         if self.identity_version > 2:
             list_kwargs = self._parse_domain_kwargs(list_kwargs)
-        user_list = self.list_users(**list_kwargs)
+        user_list = self.list_users(force=force, **list_kwargs)
         found_users = [user for user in user_list if user.id == user_name_or_id or user.name == user_name_or_id]
         if not found_users:
             return None
@@ -685,10 +833,20 @@ class AccountDriver(BaseAccountDriver):
         kwargs[domain_override] = domain.id
         return kwargs
 
-    def list_users(self, **kwargs):
-        if self.identity_version > 2:
-            kwargs = self._parse_domain_kwargs(kwargs)
-        return self.user_manager.keystone.users.list(**kwargs)
+    def list_users(self, force=False, **kwargs):
+        """
+        NOTE: Only the complete list (No kwargs) is cached.
+        """
+        if kwargs:
+            if self.identity_version > 2:
+                kwargs = self._parse_domain_kwargs(kwargs)
+            return self.user_manager.keystone.users.list(**kwargs)
+        return self.cache_driver.cache_resource_list(
+            "users",
+            self.user_manager.keystone.users.list,
+            to_cache=self._keystone_to_cache,
+            from_cache=self._user_from_cache,
+            force=force)
 
     def list_usergroup_names(self):
         return [user.name for (user, project) in self.list_usergroups()]
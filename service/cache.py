@@ -1,4 +1,9 @@
 import cPickle as pickle
+import time
+import uuid
+import zlib
+from collections import Counter
+
 from django.conf import settings
 from django.utils import timezone
 
@@ -6,12 +11,12 @@ import redis
 
 from threepio import logger
 
-from service.driver import get_esh_driver, get_admin_driver
+from service.driver import get_admin_driver, get_pooled_esh_driver
 
 
-admin_drivers = {}
-drivers = {}
 connection = None
+# Hit/Miss counters for this process, see 'get_cache_stats'
+cache_stats = Counter()
 
 INSTANCES_KEY_PROVIDER = "instances.{0}"
 INSTANCES_KEY_IDENTITY = "instances.{0}.{1}"
@@ -19,55 +24,211 @@ VOLUMES_KEY_PROVIDER = "volumes.{0}"
 VOLUMES_KEY_IDENTITY = "volumes.{0}.{1}"
 MACHINES_KEY_PROVIDER = "machines.{0}"
 MACHINES_KEY_IDENTITY = "machines.{0}.{1}"
-
-
-def _get_cached_admin_driver(provider, force=True):
-    if not admin_drivers.get(provider) or force:
-        admin_drivers[provider] = get_admin_driver(provider)
-    return admin_drivers[provider]
-
-
-def _get_cached_driver(provider=None, identity=None, force=True):
+SIZES_KEY_PROVIDER = "sizes.{0}"
+SIZES_KEY_IDENTITY = "sizes.{0}.{1}"
+INSTANCE_STATES_KEY = "instance_states.{0}.{1}"
+PROVISIONED_KEY = "provisioned.{0}"
+LOCK_KEY = "{0}.lock"
+# Delete the lock only if it is still held with our token,
+# a lock that expired may already belong to another worker.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _get_cached_admin_driver(provider, force=False):
+    return get_admin_driver(provider, pooled=True, force=force)
+
+
+def _get_cached_driver(provider=None, identity=None, force=False):
     if provider:
         return _get_cached_admin_driver(provider, force)
-    if not drivers.get(identity) or force:
-        drivers[identity] = get_esh_driver(identity)
-    return drivers[identity]
+    return get_pooled_esh_driver(identity, force=force)
 
 
 def redis_connection():
     global connection
     if not connection:
-        connection = redis.StrictRedis()
+        connection = redis.StrictRedis.from_url(
+            settings.CLOUD_CACHE_REDIS_URL,
+            socket_timeout=settings.CLOUD_CACHE_SOCKET_TIMEOUT)
     return connection
 
 
+def _log_redis_error():
+    logger.exception("EXTERNAL SERVICE redis-server IS NOT RESPONDING! "
+                     "Somebody should turn it on!")
+
+
 def _invalidate(key):
     r = redis_connection()
     if key:
-        r.delete(key)
+        try:
+            r.delete(key)
+        except redis.exceptions.RedisError:
+            _log_redis_error()
+
+
+"""
+Serializers -- Select one using settings.CLOUD_CACHE_SERIALIZER
+NOTE: rtwo objects can only be pickled, 'zlib' is a compressed pickle.
+"""
+
 
+def _pickle_dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
 
-def _get_cached(key, data_method, scrub_method, force=False):
+
+def _zlib_dumps(value):
+    return zlib.compress(_pickle_dumps(value))
+
+
+def _zlib_loads(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+SERIALIZERS = {
+    "pickle": (_pickle_dumps, pickle.loads),
+    "zlib": (_zlib_dumps, _zlib_loads),
+}
+
+
+def _get_serializer():
+    try:
+        return SERIALIZERS[settings.CLOUD_CACHE_SERIALIZER]
+    except KeyError:
+        raise Exception("Unknown CLOUD_CACHE_SERIALIZER '%s'. Options: %s"
+                        % (settings.CLOUD_CACHE_SERIALIZER,
+                           SERIALIZERS.keys()))
+
+
+def _get_timeout(kind):
+    return settings.CLOUD_CACHE_TIMEOUTS.get(
+        kind, settings.CLOUD_CACHE_TIMEOUTS['default'])
+
+
+def get_cache_stats():
+    """
+    Returns a dict of '<kind>.<hit|stale|miss|error>' -> count
+    for this process.
+    """
+    return dict(cache_stats)
+
+
+def _read_cache(r, key):
+    """
+    Returns (is_fresh, data) or None if the key is not cached
+    (A value that can not be read back is treated as NOT cached)
+    """
+    cached = r.get(key)
+    if not cached:
+        return None
+    loads = _get_serializer()[1]
+    try:
+        (fresh_until, data) = loads(cached)
+    except Exception:
+        logger.exception("Could not read redis({0}), "
+                         "it will be refreshed".format(key))
+        return None
+    return (fresh_until > time.time(), data)
+
+
+def _write_cache(r, key, kind, data):
+    dumps = _get_serializer()[0]
+    timeout = _get_timeout(kind)
+    value = dumps((time.time() + timeout, data))
+    # Stale data is kept around, to be served while it is refreshed
+    try:
+        r.set(key, value, ex=timeout + settings.CLOUD_CACHE_STALE_TIMEOUT)
+    except redis.exceptions.RedisError:
+        # The data is still good, it just won't be shared.
+        _log_redis_error()
+        cache_stats["%s.error" % kind] += 1
+
+
+def _refresh_cache(r, key, kind, data_method, scrub_method):
+    data = data_method()
+    scrub_method(data)
+    logger.debug("Updated redis({0}) using {1} and {2}".format(
+        key, data_method, scrub_method))
+    _write_cache(r, key, kind, data)
+    return data
+
+
+def _acquire_lock(r, key):
+    """
+    Returns a token to '_release_lock' with, or None if the lock is held.
+    """
+    token = uuid.uuid4().hex
+    if r.set(LOCK_KEY.format(key), token, nx=True,
+             ex=settings.CLOUD_CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_lock(r, key, token):
+    try:
+        r.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY.format(key), token)
+    except redis.exceptions.RedisError:
+        # The lock expires on its own.
+        _log_redis_error()
+
+
+def _get_cached(key, data_method, scrub_method, force=False,
+                kind="default", allow_stale=True):
+    """
+    Read 'key' from the cache, using 'data_method' (and 'scrub_method')
+    to refresh it.
+    * Only one worker (per key) calls 'data_method' at a time,
+      the others wait for the new value.
+    * When the value is stale, it is returned right away while
+      one worker refreshes it (Unless 'allow_stale' is False).
+    """
     try:
         r = redis_connection()
-        if force:
-            _invalidate(key)
-        data = r.get(key)
-    except redis.exceptions.ConnectionError:
-        logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
-                     "Somebody should turn it on!")
-        data = None
-    if not data:
+        cached = None if force else _read_cache(r, key)
+        if cached and cached[0]:
+            cache_stats["%s.hit" % kind] += 1
+            return cached[1]
+        if cached and allow_stale:
+            # Stale-While-Revalidate
+            cache_stats["%s.stale" % kind] += 1
+            token = _acquire_lock(r, key)
+            if token:
+                try:
+                    return _refresh_cache(
+                        r, key, kind, data_method, scrub_method)
+                finally:
+                    _release_lock(r, key, token)
+            return cached[1]
+        cache_stats["%s.miss" % kind] += 1
+        wait_until = time.time() + settings.CLOUD_CACHE_LOCK_TIMEOUT
+        while True:
+            token = _acquire_lock(r, key)
+            if token:
+                break
+            # Another worker is already refreshing this key
+            time.sleep(0.1)
+            cached = _read_cache(r, key)
+            if cached and (cached[0] or allow_stale) and not force:
+                return cached[1]
+            if time.time() > wait_until:
+                logger.warn("Timed out waiting on redis({0})".format(key))
+                return _refresh_cache(
+                    r, key, kind, data_method, scrub_method)
+        try:
+            return _refresh_cache(r, key, kind, data_method, scrub_method)
+        finally:
+            _release_lock(r, key, token)
+    except redis.exceptions.RedisError:
+        _log_redis_error()
+        cache_stats["%s.error" % kind] += 1
         data = data_method()
         scrub_method(data)
-        logger.debug("Updated redis({0}) using {1} and {2}".format(
-            key, data_method, scrub_method))
-        r.set(key, pickle.dumps(data))
-        r.expire(key, 30)
         return data
-    logger.debug("Actual type {0}".format(type(data)))
-    return pickle.loads(data)
 
 
 def _scrub(objects):
@@ -86,7 +247,7 @@ def _validate_parameters(provider, identity):
         raise Exception("Use either provider or identity but not both.")
 
 
-def get_cached_driver(provider=None, identity=None, force=True):
+def get_cached_driver(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
     return _get_cached_driver(provider=provider,
                               identity=identity,
@@ -115,7 +276,8 @@ def get_cached_instances(provider=None, identity=None, force=False):
     return _get_cached(key,
                        instances_method,
                        _scrub,
-                       force=force)
+                       force=force,
+                       kind="instances")
 
 
 def invalidate_cached_instances(provider=None, identity=None):
@@ -140,7 +302,8 @@ def get_cached_volumes(provider=None, identity=None, force=False):
     return _get_cached(key,
                        volumes_method,
                        _scrub,
-                       force=force)
+                       force=force,
+                       kind="volumes")
 
 
 def invalidate_cached_volumes(provider=None, identity=None):
@@ -165,7 +328,8 @@ def get_cached_machines(provider=None, identity=None, force=False):
     return _get_cached(key,
                        machines_method,
                        _scrub,
-                       force=force)
+                       force=force,
+                       kind="machines")
 
 
 def invalidate_cached_machines(provider=None, identity=None):
@@ -175,3 +339,114 @@ def invalidate_cached_machines(provider=None, identity=None):
         key = MACHINES_KEY_IDENTITY.format(identity.created_by.username,
                                            identity.id)
     _invalidate(key)
+
+
+def get_cached_sizes(provider=None, identity=None, force=False):
+    _validate_parameters(provider, identity)
+    cached_driver = _get_cached_driver(provider=provider, identity=identity,
+                                       force=force)
+    sizes_method = cached_driver.list_sizes
+    if provider:
+        key = SIZES_KEY_PROVIDER.format(provider.id)
+    else:
+        key = SIZES_KEY_IDENTITY.format(identity.created_by.username,
+                                        identity.id)
+    return _get_cached(key,
+                       sizes_method,
+                       _scrub,
+                       force=force,
+                       kind="sizes")
+
+
+def invalidate_cached_sizes(provider=None, identity=None):
+    if provider:
+        key = SIZES_KEY_PROVIDER.format(provider.id)
+    else:
+        key = SIZES_KEY_IDENTITY.format(identity.created_by.username,
+                                        identity.id)
+    _invalidate(key)
+
+
+def _list_instance_states(driver):
+    """
+    Returns a dict of instance alias -> (status, task)
+    for every instance that 'driver' can see.
+    """
+    instance_states = {}
+    for instance in driver.list_instances():
+        extra = instance._node.extra
+        instance_states[instance.id] = (extra['status'].lower(),
+                                        extra.get('task'))
+    return instance_states
+
+
+def get_cached_instance_states(driver, force=False):
+    """
+    Returns a dict of instance alias -> (status, task) for the tenant of
+    'driver'. Every task waiting on an instance in the same tenant shares
+    a single 'list_instances' call per tick
+    (See CLOUD_CACHE_TIMEOUTS['instance_states'])
+    Stale states are never returned, a task would wait on (or act on)
+    a state the instance has already left.
+    """
+    tenant_name = driver.identity.credentials.get(
+        'ex_tenant_name', driver.identity.get_username())
+    key = INSTANCE_STATES_KEY.format(driver.provider.identifier, tenant_name)
+    return _get_cached(key,
+                       lambda: _list_instance_states(driver),
+                       lambda instance_states: None,
+                       force=force,
+                       kind="instance_states",
+                       allow_stale=False)
+
+
+def get_provisioned_state(core_identity):
+    """
+    Returns a dict of what has already been provisioned on the cloud for
+    'core_identity' (See '_provision_openstack_instance').
+    An empty dict is returned when nothing is known.
+    """
+    key = PROVISIONED_KEY.format(core_identity.uuid)
+    try:
+        cached = redis_connection().hgetall(key)
+    except redis.exceptions.RedisError:
+        _log_redis_error()
+        cache_stats["provisioned.error"] += 1
+        return {}
+    cache_stats["provisioned.%s" % ("hit" if cached else "miss")] += 1
+    loads = _get_serializer()[1]
+    return {name: loads(value) for (name, value) in cached.items()}
+
+
+def set_provisioned_state(core_identity, **state):
+    """
+    Remember that each item of 'state' has been provisioned for
+    'core_identity'.
+    """
+    if not state:
+        return
+    key = PROVISIONED_KEY.format(core_identity.uuid)
+    dumps = _get_serializer()[0]
+    try:
+        pipe = redis_connection().pipeline()
+        pipe.hmset(key, {name: dumps(value)
+                         for (name, value) in state.items()})
+        pipe.expire(key, _get_timeout("provisioned"))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        _log_redis_error()
+
+
+def invalidate_provisioned_state(*core_identities):
+    """
+    Forget what was provisioned for 'core_identities'
+    (Call this whenever their network, security group or keypair is removed)
+    """
+    keys = [PROVISIONED_KEY.format(core_identity.uuid)
+            for core_identity in core_identities]
+    if not keys:
+        return
+    try:
+        redis_connection().delete(*keys)
+    except redis.exceptions.RedisError:
+        _log_redis_error()
@@ -0,0 +1,73 @@
+"""
+Run (cloud) calls at the same time, using threads.
+
+NOTE: rtwo/libcloud drivers are NOT thread-safe. Calls should take
+      their driver from 'get_cached_driver' (Checked out to one thread),
+      rather than sharing one driver between calls.
+"""
+import Queue
+import sys
+import threading
+
+from django.db import connection as db_connection
+
+from service.driver import release_pooled_drivers
+
+
+def map_concurrently(calls, concurrency):
+    """
+    Run each call, a tuple of (method, *args), using up to 'concurrency'
+    threads.
+    Returns a list of (result, exc_info), in the same order as 'calls'.
+    'exc_info' is None unless the call raised an exception.
+    """
+    outcomes = [None] * len(calls)
+    call_queue = Queue.Queue()
+    for (index, call) in enumerate(calls):
+        call_queue.put((index, call))
+
+    def _run_queued_calls():
+        while True:
+            try:
+                (index, call) = call_queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                outcomes[index] = (call[0](*call[1:]), None)
+            except Exception:
+                outcomes[index] = (None, sys.exc_info())
+
+    def _run_queued_calls_thread():
+        try:
+            _run_queued_calls()
+        finally:
+            # Pooled drivers are handed back, for the next threads to use
+            release_pooled_drivers()
+            # Each thread opens its own database connection.
+            db_connection.close()
+
+    concurrency = min(concurrency, len(calls))
+    if concurrency <= 1:
+        _run_queued_calls()
+        return outcomes
+    threads = [threading.Thread(target=_run_queued_calls_thread)
+               for _ in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def run_concurrently(*calls):
+    """
+    Run each call, a tuple of (method, *args), in its own thread.
+    Returns the list of results, in the same order as 'calls'.
+    If any call fails, the first exception (in order) is raised
+    once every call has finished.
+    """
+    outcomes = map_concurrently(calls, len(calls))
+    for (result, exc_info) in outcomes:
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return [result for (result, exc_info) in outcomes]
@@ -1,7 +1,15 @@
+from collections import OrderedDict
+from hashlib import md5
+import threading
+import time
 import uuid
 
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
 from core.exceptions import ProviderNotActive
 from core.models import AtmosphereUser as User
+from core.models.credential import Credential, ProviderCredential
 from core.models.identity import Identity as CoreIdentity
 from core.models.provider import Provider as CoreProvider
 from core.models.size import convert_esh_size
@@ -80,13 +88,16 @@ def get_driver(driverCls, provider, identity, **provider_credentials):
         return driver
 
 
-def get_admin_driver(provider):
+def get_admin_driver(provider, pooled=False, force=False):
     """
     Create an admin driver for a given provider.
+    pooled - Take the driver from the 'driver_pool' (See get_pooled_esh_driver)
     """
     try:
-        return get_esh_driver(
-            provider.accountprovider_set.all().first().identity)
+        admin_identity = provider.accountprovider_set.all().first().identity
+        if pooled:
+            return get_pooled_esh_driver(admin_identity, force=force)
+        return get_esh_driver(admin_identity)
     except:
         logger.info("Admin driver for provider %s not found." %
                     (provider.location))
@@ -192,6 +203,194 @@ def get_esh_driver(core_identity, username=None, **kwargs):
         raise
 
 
+class DriverPool(object):
+
+    """
+    A thread-safe pool of (authenticated) esh drivers.
+    Re-using a driver re-uses its session/token, so the cloud is only
+    authenticated against when the driver is first built.
+    Drivers are keyed on identity, username and a fingerprint of the
+    credentials used to build them.
+
+    NOTE: rtwo/libcloud drivers are NOT thread-safe. A thread checks out
+          a driver for its own use, and keeps it until it calls 'release'.
+          Released drivers are idle, and can be checked out by any thread.
+    * Idle drivers are dropped, least-recently-used first, past 'max_size'.
+    * Drivers are re-built after 'timeout' seconds.
+    * When the credentials change, drivers built with the old ones are
+      dropped (rather than released).
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        # (identity_id, username, fingerprint) -> [(driver, expire_time)]
+        self._idle = OrderedDict()
+        # (identity_id, username) -> newest fingerprint
+        self._fingerprints = {}
+        # identity_id -> count of 'invalidate' calls
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def _held_drivers(self):
+        # key -> (driver, expire_time, generation) of the current thread
+        if not hasattr(self._held, 'drivers'):
+            self._held.drivers = {}
+        return self._held.drivers
+
+    def _generation(self, key):
+        return (self._generations.get(key[0], 0),
+                self._generations.get(None, 0))
+
+    def _is_current(self, key, expire_time, generation, now_time):
+        return expire_time >= now_time\
+            and generation == self._generation(key)\
+            and self._fingerprints.get(key[:-1]) == key[-1]
+
+    def checkout(self, key):
+        """
+        Returns a driver for 'key' that only the current thread will use
+        (Or None, if a new driver has to be built, see 'hold')
+        """
+        held_drivers = self._held_drivers()
+        now_time = time.time()
+        with self._lock:
+            self._note_fingerprint(key)
+            if key in held_drivers:
+                (driver, expire_time, generation) = held_drivers[key]
+                if self._is_current(key, expire_time, generation, now_time):
+                    return driver
+                del held_drivers[key]
+            idle_drivers = self._idle.get(key, [])
+            while idle_drivers:
+                (driver, expire_time) = idle_drivers.pop()
+                if expire_time >= now_time:
+                    held_drivers[key] = (driver, expire_time,
+                                         self._generation(key))
+                    return driver
+            self._idle.pop(key, None)
+            return None
+
+    def hold(self, key, driver):
+        """
+        Check out 'driver', newly built for 'key', to the current thread.
+        """
+        with self._lock:
+            self._note_fingerprint(key)
+            self._held_drivers()[key] = (
+                driver, time.time() + self.timeout, self._generation(key))
+
+    def release(self):
+        """
+        Return the drivers of the current thread to the pool.
+        """
+        held_drivers = self._held_drivers()
+        now_time = time.time()
+        with self._lock:
+            for (key, (driver, expire_time, generation))\
+                    in held_drivers.items():
+                if not self._is_current(key, expire_time, generation,
+                                        now_time):
+                    continue
+                # Most recently used goes to the end.
+                idle_drivers = self._idle.pop(key, [])
+                idle_drivers.append((driver, expire_time))
+                self._idle[key] = idle_drivers
+            held_drivers.clear()
+            idle_count = sum(len(idle_drivers)
+                             for idle_drivers in self._idle.values())
+            while idle_count > self.max_size:
+                # Least recently used first
+                oldest_key = next(iter(self._idle))
+                self._idle[oldest_key].pop(0)
+                if not self._idle[oldest_key]:
+                    del self._idle[oldest_key]
+                idle_count -= 1
+
+    def _note_fingerprint(self, key):
+        # Drivers built with other credentials are no longer valid
+        if self._fingerprints.get(key[:-1]) == key[-1]:
+            return
+        self._fingerprints[key[:-1]] = key[-1]
+        for old_key in self._idle.keys():
+            if old_key[:-1] == key[:-1] and old_key != key:
+                del self._idle[old_key]
+
+    def invalidate(self, identity_ids=None):
+        """
+        Drop all drivers of 'identity_ids' (Or ALL drivers, if None),
+        including those checked out by a thread.
+        """
+        with self._lock:
+            for identity_id in (identity_ids if identity_ids is not None
+                                else [None]):
+                self._generations[identity_id] = \
+                    self._generations.get(identity_id, 0) + 1
+            for key in self._idle.keys():
+                if identity_ids is None or key[0] in identity_ids:
+                    del self._idle[key]
+
+
+driver_pool = DriverPool(settings.DRIVER_POOL_SIZE,
+                         settings.DRIVER_POOL_TIMEOUT)
+
+
+def _get_credentials_fingerprint(core_identity):
+    identity_creds = Credential.objects.filter(
+        identity_id=core_identity.id).values_list('key', 'value')
+    provider_creds = ProviderCredential.objects.filter(
+        provider_id=core_identity.provider_id).values_list('key', 'value')
+    return md5(repr((sorted(identity_creds),
+                     sorted(provider_creds)))).hexdigest()
+
+
+def get_pooled_esh_driver(core_identity, username=None, force=False,
+                          **kwargs):
+    """
+    Same as 'get_esh_driver', but the driver is checked out of the
+    'driver_pool'. The calling thread keeps the driver (and gets the same
+    one on every call) until 'release_pooled_drivers' is called.
+    force - Build (and authenticate) a new driver.
+    """
+    if kwargs:
+        # Drivers with custom options are not shared.
+        return get_esh_driver(core_identity, username, **kwargs)
+    if not core_identity.provider.is_active():
+        raise ProviderNotActive(core_identity.provider)
+    key = (core_identity.id, username,
+           _get_credentials_fingerprint(core_identity))
+    driver = None if force else driver_pool.checkout(key)
+    if not driver:
+        driver = get_esh_driver(core_identity, username)
+        driver_pool.hold(key, driver)
+    return driver
+
+
+def release_pooled_drivers():
+    """
+    Return the drivers checked out by this thread to the 'driver_pool'.
+    Call this before a (short-lived) thread ends, so others can re-use them.
+    """
+    driver_pool.release()
+
+
+def credentials_changed(sender, instance, **kwargs):
+    """
+    Drop the pooled drivers built with the old credentials.
+    """
+    if sender == ProviderCredential:
+        driver_pool.invalidate(set(CoreIdentity.objects.filter(
+            provider_id=instance.provider_id).values_list('id', flat=True)))
+    else:
+        driver_pool.invalidate([instance.identity_id])
+
+
+for sender in [Credential, ProviderCredential]:
+    post_save.connect(credentials_changed, sender=sender)
+    post_delete.connect(credentials_changed, sender=sender)
+
+
 def prepare_driver(request, provider_uuid, identity_uuid,
                    raise_exception=False):
     """
@@ -205,7 +404,7 @@ def prepare_driver(request, provider_uuid, identity_uuid,
         core_identity = CoreIdentity.objects.get(provider__uuid=provider_uuid,
                                                  uuid=identity_uuid)
         if core_identity in request.user.identity_set.all():
-            return get_esh_driver(core_identity=core_identity)
+            return get_pooled_esh_driver(core_identity=core_identity)
         else:
             raise ValueError(
                 "User %s is NOT the owner of Identity UUID: %s" %
@@ -1,4 +1,5 @@
 import os.path
+import sys
 import time
 import uuid
 
@@ -21,7 +22,7 @@ from core.query import only_current
 from core.models.instance_source import InstanceSource
 from core.models.application import Application
 from core.models.identity import Identity as CoreIdentity
-from core.models.instance import convert_esh_instance, find_instance, InstanceAction
+from core.models.instance import convert_esh_instance, convert_esh_instances, find_instance, InstanceAction
 from core.models.size import convert_esh_size
 from core.models.machine import ProviderMachine
 from core.models.volume import convert_esh_volume
@@ -30,9 +31,12 @@ from core.models.provider import AccountProvider, Provider, ProviderInstanceActi
 from atmosphere import settings
 from atmosphere.settings import secrets
 
-from service.cache import get_cached_driver, invalidate_cached_instances
+from service.cache import get_cached_driver, invalidate_cached_instances,\
+    get_provisioned_state, set_provisioned_state, invalidate_provisioned_state
+from service.concurrency import map_concurrently
 from service.driver import _retrieve_source
 from service.licensing import _test_license
+from service.quota import release_quota
 from service.exceptions import (
     OverAllocationError, OverQuotaError, SizeNotAvailable,
     HypervisorCapacityError, SecurityGroupNotCreated,
@@ -624,19 +628,22 @@ def offload_instance(esh_driver, esh_instance,
     return offloaded
 
 
-def destroy_instance(user, core_identity_uuid, instance_alias):
+def destroy_instance(user, core_identity_uuid, instance_alias,
+                     esh_driver=None, esh_instance=None):
     """
     Use this function to destroy an instance (From the API, or the REPL)
+    'esh_driver' and 'esh_instance' can be passed when already retrieved.
     """
     # TODO: Test how this f(n) works when called multiple times
     success, esh_instance = _destroy_instance(
-        core_identity_uuid, instance_alias)
+        core_identity_uuid, instance_alias,
+        esh_driver=esh_driver, esh_instance=esh_instance)
     if not success and esh_instance:
         raise Exception("Instance could not be destroyed")
     elif esh_instance:
         os_cleanup_networking(core_identity_uuid)
         core_instance = end_date_instance(
-            user, esh_instance, core_identity_uuid)
+            user, esh_instance, core_identity_uuid, esh_driver=esh_driver)
         return core_instance
     else:
         # Edge case - If you attempt to delete more than once...
@@ -644,10 +651,12 @@ def destroy_instance(user, core_identity_uuid, instance_alias):
         return core_instance
 
 
-def end_date_instance(user, esh_instance, core_identity_uuid):
+def end_date_instance(user, esh_instance, core_identity_uuid,
+                      esh_driver=None):
     # Retrieve the 'hopefully now deleted' instance and end date it.
     identity = CoreIdentity.objects.get(uuid=core_identity_uuid)
-    esh_driver = get_cached_driver(identity=identity)
+    if not esh_driver:
+        esh_driver = get_cached_driver(identity=identity)
     try:
         core_instance = convert_esh_instance(esh_driver, esh_instance,
                                              identity.provider.uuid,
@@ -709,18 +718,20 @@ def os_cleanup_networking(core_identity_uuid):
         destroy_chain.apply_async()
     return
 
-def _destroy_instance(identity_uuid, instance_alias):
+def _destroy_instance(identity_uuid, instance_alias, esh_driver=None,
+                      esh_instance=None):
     """
     Responsible for actually destroying the instance
     Return:
     Deleted, Instance
     """
-    identity = CoreIdentity.objects.get(uuid=identity_uuid)
-    esh_driver = get_cached_driver(identity=identity)
+    if not esh_driver:
+        identity = CoreIdentity.objects.get(uuid=identity_uuid)
+        esh_driver = get_cached_driver(identity=identity)
     # Bail if driver cant be created
     if not esh_driver:
         return (False, None)
-    instance = esh_driver.get_instance(instance_alias)
+    instance = esh_instance or esh_driver.get_instance(instance_alias)
     # Bail if instance doesnt exist
     if not instance:
         return (True, None)
@@ -778,12 +789,11 @@ def get_core_instances(identity_uuid):
     identity = CoreIdentity.objects.get(uuid=identity_uuid)
     driver = get_cached_driver(identity=identity)
     instances = driver.list_instances()
-    core_instances = [convert_esh_instance(driver,
-                                           esh_instance,
+    core_instances = convert_esh_instances(driver,
+                                           instances,
                                            identity.provider.uuid,
                                            identity.uuid,
                                            identity.created_by)
-                      for esh_instance in instances]
     return core_instances
 
 
@@ -792,25 +802,32 @@ def _pre_launch_validation(
         esh_driver,
         identity_uuid,
         boot_source,
-        size):
+        size,
+        esh_source=None):
     """
     Used BEFORE launching a volume/instance .. Raise exceptions here to be dealt with by the caller.
+    'esh_source' is the (already retrieved) machine/volume of 'boot_source'
     """
     identity = CoreIdentity.objects.get(uuid=identity_uuid)
 
     # May raise OverQuotaError or OverAllocationError
-    check_quota(username, identity_uuid, size)
-
-    # May raise UnderThresholdError
-    check_application_threshold(username, identity_uuid, size, boot_source)
-
-    if boot_source.is_machine():
-        machine = _retrieve_source(
-            esh_driver,
-            boot_source.identifier,
-            "machine")
-        # may raise an exception if licensing doesnt match identity
-        _test_for_licensing(machine, identity)
+    quota_reserved = check_quota(username, identity_uuid, size)
+    try:
+        # May raise UnderThresholdError
+        check_application_threshold(username, identity_uuid, size, boot_source)
+
+        if boot_source.is_machine():
+            machine = esh_source or _retrieve_source(
+                esh_driver,
+                boot_source.identifier,
+                "machine")
+            # may raise an exception if licensing doesnt match identity
+            _test_for_licensing(machine, identity)
+    except Exception:
+        if quota_reserved:
+            release_quota(identity_uuid, size)
+        raise
+    return quota_reserved
 
 
 def launch_instance(user, identity_uuid,
@@ -842,31 +859,50 @@ def launch_instance(user, identity_uuid,
 
     esh_driver = get_cached_driver(identity=identity)
 
-    # May raise Exception("Size not available")
-    size = check_size(esh_driver, size_alias, provider_uuid)
     # May raise Exception("Volume/Machine not available")
     boot_source = get_boot_source(user.username, identity_uuid, source_alias)
+    # May raise Exception("Size not available")
+    size = check_size(esh_driver, size_alias, provider_uuid)
+    # Retrieved once, for the validation and launch steps below
+    esh_source = _retrieve_boot_source(esh_driver, boot_source)
 
     # Raise any other exceptions before launching here
-    _pre_launch_validation(
+    quota_reserved = _pre_launch_validation(
         user.username,
         esh_driver,
         identity_uuid,
         boot_source,
-        size)
-
-    core_instance = _select_and_launch_source(
-        user,
-        identity_uuid,
-        esh_driver,
-        boot_source,
         size,
-        name=name,
-        deploy=deploy,
-        **launch_kwargs)
+        esh_source=esh_source)
+
+    try:
+        core_instance = _select_and_launch_source(
+            user,
+            identity_uuid,
+            esh_driver,
+            boot_source,
+            size,
+            name=name,
+            deploy=deploy,
+            esh_source=esh_source,
+            **launch_kwargs)
+    except Exception:
+        if quota_reserved:
+            release_quota(identity_uuid, size)
+        # The cloud may no longer match what was provisioned
+        invalidate_provisioned_state(identity)
+        raise
     return core_instance
 
 
+def _retrieve_boot_source(esh_driver, boot_source):
+    if boot_source.is_volume():
+        return _retrieve_source(esh_driver, boot_source.identifier, "volume")
+    elif boot_source.is_machine():
+        return _retrieve_source(esh_driver, boot_source.identifier, "machine")
+    return None
+
+
 # NOTE: Harmonizing these four methods below would be nice..
 
 
@@ -883,21 +919,24 @@ def _select_and_launch_source(
         size,
         name,
         deploy=True,
+        esh_source=None,
         **launch_kwargs):
     """
     Select launch route based on whether boot_source is-a machine/volume
+    'esh_source' is the (already retrieved) machine/volume of 'boot_source'
     """
     identity = CoreIdentity.objects.get(uuid=identity_uuid)
     if boot_source.is_volume():
         # NOTE: THIS route works when launching an EXISTING volume ONLY
         #      to CREATE a new bootable volume (from an existing volume/image/snapshot)
         #      use service/volume.py 'boot_volume'
-        volume = _retrieve_source(esh_driver, boot_source.identifier, "volume")
+        volume = esh_source or _retrieve_source(
+            esh_driver, boot_source.identifier, "volume")
         core_instance = launch_volume_instance(
             esh_driver, identity, volume, size, name,
             deploy=deploy, **launch_kwargs)
     elif boot_source.is_machine():
-        machine = _retrieve_source(
+        machine = esh_source or _retrieve_source(
             esh_driver,
             boot_source.identifier,
             "machine")
@@ -1241,6 +1280,10 @@ def _test_for_licensing(esh_machine, identity):
 
 
 def check_quota(username, identity_uuid, esh_size, resuming=False):
+    """
+    Returns True if the quota for 'esh_size' was reserved
+    (Give it back with 'release_quota' if the launch does not happen)
+    """
     from service.monitoring import check_over_allocation
     from service.quota import check_over_quota
     (over_quota, resource,
@@ -1249,15 +1292,20 @@ def check_quota(username, identity_uuid, esh_size, resuming=False):
                                                   esh_size, resuming=resuming)
     if over_quota and settings.ENFORCING:
         raise OverQuotaError(resource, requested, used, allowed)
+    reserved = bool(not over_quota and esh_size and not resuming)
     (over_allocation, time_diff) =\
         check_over_allocation(username,
                               identity_uuid)
     if over_allocation and settings.ENFORCING:
+        if reserved:
+            release_quota(identity_uuid, esh_size)
         raise OverAllocationError(time_diff)
+    return reserved
 
 
-def security_group_init(core_identity, max_attempts=3):
-    os_driver = OSAccountDriver(core_identity.provider)
+def security_group_init(core_identity, max_attempts=3, os_driver=None):
+    if not os_driver:
+        os_driver = OSAccountDriver(core_identity.provider)
     creds = core_identity.get_credentials()
     # TODO: Remove kludge when openstack connections can be
     # Deemed reliable. Otherwise generalize this pattern so it
@@ -1276,8 +1324,9 @@ def security_group_init(core_identity, max_attempts=3):
     raise SecurityGroupNotCreated()
 
 
-def keypair_init(core_identity):
-    os_driver = OSAccountDriver(core_identity.provider)
+def keypair_init(core_identity, os_driver=None):
+    if not os_driver:
+        os_driver = OSAccountDriver(core_identity.provider)
     creds = core_identity.get_credentials()
     with open(settings.ATMOSPHERE_KEYPAIR_FILE, 'r') as pub_key_file:
         public_key = pub_key_file.read()
@@ -1289,16 +1338,30 @@ def keypair_init(core_identity):
     return keypair
 
 
-def network_init(core_identity):
+def network_init(core_identity, os_driver=None):
+    if not os_driver:
+        os_driver = OSAccountDriver(core_identity.provider)
+    network_and_subnet = _create_network(core_identity, os_driver)
+    if not network_and_subnet:
+        return
+    (network, subnet) = network_and_subnet
+    lc_network = _to_lc_network(os_driver.admin_driver, network, subnet)
+    return lc_network
+
+
+def _create_network(core_identity, os_driver=None):
+    """
+    Returns the (network, subnet) of 'core_identity', or None if
+    the provider can not create virtual networks.
+    """
+    if not os_driver:
+        os_driver = OSAccountDriver(core_identity.provider)
     provider_creds = core_identity.provider.get_credentials()
     if 'router_name' not in provider_creds.keys():
         logger.warn("ProviderCredential 'router_name' missing:"
                     "cannot create virtual network")
-        return
-    os_driver = OSAccountDriver(core_identity.provider)
-    (network, subnet) = os_driver.create_network(core_identity)
-    lc_network = _to_lc_network(os_driver.admin_driver, network, subnet)
-    return lc_network
+        return None
+    return os_driver.create_network(core_identity)
 
 
 def _to_lc_network(driver, network, subnet):
@@ -1318,12 +1381,36 @@ def _provision_openstack_instance(core_identity, admin_user=False):
     TODO: "CloudAdministrators" logic goes here to dictate
           What we should do to provision an instance..
     """
+    # What has already been provisioned for this identity is not
+    # created (or even checked) again, see 'get_provisioned_state'
+    provisioned = get_provisioned_state(core_identity)
+    new_state = {}
     # NOTE: Admin users do NOT need a security group created for them!
-    if not admin_user:
-        security_group_init(core_identity)
-    network = network_init(core_identity)
-    keypair_init(core_identity)
-    return network
+    need_security_group = not admin_user\
+        and not provisioned.get('security_group')
+    os_driver = None
+    if need_security_group or 'network' not in provisioned\
+            or not provisioned.get('keypair'):
+        # One OSAccountDriver (and authentication) for every step
+        os_driver = OSAccountDriver(core_identity.provider)
+    if need_security_group:
+        security_group_init(core_identity, 3, os_driver)
+        new_state['security_group'] = True
+    if 'network' not in provisioned:
+        new_state['network'] = _create_network(core_identity, os_driver)
+    if not provisioned.get('keypair'):
+        keypair_init(core_identity, os_driver)
+        new_state['keypair'] = True
+    set_provisioned_state(core_identity, **new_state)
+
+    network_and_subnet = new_state.get(
+        'network', provisioned.get('network'))
+    if not network_and_subnet:
+        return None
+    (network, subnet) = network_and_subnet
+    admin_driver = os_driver.admin_driver if os_driver\
+        else get_cached_driver(provider=core_identity.provider)
+    return _to_lc_network(admin_driver, network, subnet)
 
 
 def _extra_openstack_args(core_identity, ex_metadata={}):
@@ -1594,7 +1681,12 @@ def run_instance_action(user, identity, instance_id, action_type, action_params)
     esh_instance = esh_driver.get_instance(instance_id)
     if not esh_instance:
         raise InstanceDoesNotExist(instance_id)
+    return _run_instance_action(user, identity, esh_driver, esh_instance,
+                                action_type, action_params)
+
 
+def _run_instance_action(user, identity, esh_driver, esh_instance,
+                         action_type, action_params):
     if 'volume' in action_type:
         # Take care of volume actions separately
         result_obj = run_instance_volume_action(
@@ -1662,3 +1754,78 @@ def run_instance_action(user, identity, instance_id, action_type, action_params)
         raise ActionNotAllowed(
             'Unable to to perform action %s.' % (action_type))
     return result_obj
+
+
+def run_instance_actions(user, instance_actions, concurrency=None):
+    """
+    Run many InstanceActions at once.
+    'instance_actions' is a list of
+    (identity, instance_id, action_type, action_params).
+
+    The actions of each identity are run one after the other, with one
+    driver and one listing of its instances. Up to 'concurrency'
+    identities are handled at the same time
+    (Default: settings.BULK_INSTANCE_ACTION_CONCURRENCY).
+    Returns a list of (result_obj, exc_info), in the same order as
+    'instance_actions'. 'exc_info' is None unless the action failed.
+    """
+    if not concurrency:
+        concurrency = settings.BULK_INSTANCE_ACTION_CONCURRENCY
+    identities = {}
+    identity_actions = {}
+    for (index, (identity, instance_id, action_type, action_params))\
+            in enumerate(instance_actions):
+        identities[identity.id] = identity
+        identity_actions.setdefault(identity.id, []).append(
+            (index, instance_id, action_type, action_params))
+    identity_ids = identity_actions.keys()
+    outcomes = [None] * len(instance_actions)
+    for (identity_id, (identity_outcomes, exc_info)) in zip(
+            identity_ids, map_concurrently(
+                [(_run_identity_instance_actions, user,
+                  identities[identity_id], identity_actions[identity_id])
+                 for identity_id in identity_ids],
+                concurrency)):
+        if exc_info:
+            # The driver or the instances could not be retrieved
+            identity_outcomes = [
+                (index, (None, exc_info))
+                for (index, _, _, _) in identity_actions[identity_id]]
+        for (index, outcome) in identity_outcomes:
+            outcomes[index] = outcome
+    return outcomes
+
+
+def _run_identity_instance_actions(user, identity, actions):
+    """
+    Run the 'actions' of 'identity' one after the other, in this thread.
+    Returns a list of (index, (result_obj, exc_info))
+    """
+    esh_driver = get_cached_driver(identity=identity)
+    if not esh_driver:
+        raise InvalidCredsError("Driver could not be created")
+    esh_instances = {esh_instance.id: esh_instance
+                     for esh_instance in esh_driver.list_instances()}
+    outcomes = []
+    for (index, instance_id, action_type, action_params) in actions:
+        try:
+            outcome = (_run_bulk_instance_action(
+                user, identity, esh_driver, esh_instances, instance_id,
+                action_type, action_params), None)
+        except Exception:
+            outcome = (None, sys.exc_info())
+        outcomes.append((index, outcome))
+    return outcomes
+
+
+def _run_bulk_instance_action(user, identity, esh_driver, esh_instances,
+                              instance_id, action_type, action_params):
+    esh_instance = esh_instances.get(instance_id)
+    if 'terminate' == action_type:
+        destroy_instance(user, identity.uuid, instance_id,
+                         esh_driver=esh_driver, esh_instance=esh_instance)
+        return None
+    if not esh_instance:
+        raise InstanceDoesNotExist(instance_id)
+    return _run_instance_action(user, identity, esh_driver, esh_instance,
+                                action_type, action_params)
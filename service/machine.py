@@ -213,7 +213,7 @@ def upload_privacy_data(machine_request, new_machine):
 
     if is_public:
         print "Marking image %s private" % img.id
-        accounts.image_manager.update_image(img, visibility='private')
+        accounts.update_image(img, visibility='private')
 
     accounts.clear_cache()
     admin_driver = accounts.admin_driver  # cache has been cleared
@@ -273,7 +273,7 @@ def add_membership(image_version, group):
                 print "Created new ProviderMachineMembership: %s" \
                     % (obj,)
             # Share with the *cloud* last!
-            accounts.image_manager.share_image(img, project_name)
+            accounts.share_image(img, project_name)
             accounts.accept_shared_image(img, project_name)
             logger.info("Added Cloud Access: %s-%s"
                         % (img, project_name))
@@ -322,7 +322,7 @@ def remove_membership(image_version, group):
             logger.info("Removed ProviderMachineMembership: %s-%s"
                         % (provider_machine, group))
             # Perform a *CLOUD* remove last.
-            accounts.image_manager.unshare_image(img, project_name)
+            accounts.unshare_image(img, project_name)
             logger.info("Removed Cloud Access: %s-%s"
                         % (img, project_name))
     return
@@ -354,8 +354,7 @@ def share_with_self(private_userlist, username):
 
 def get_current_projects_for_image(accounts, image_id):
     projects = []
-    shared_with = accounts.image_manager.shared_images_for(
-        image_id=image_id)
+    shared_with = accounts.list_image_members(image_id)
     projects = [accounts.get_project_by_id(member.member_id)
                 for member in shared_with]
     return projects
@@ -363,16 +362,14 @@ def get_current_projects_for_image(accounts, image_id):
 
 def get_current_projects_for_image(accounts, image_id):
     projects = []
-    shared_with = accounts.image_manager.shared_images_for(
-        image_id=image_id)
+    shared_with = accounts.list_image_members(image_id)
     projects = [accounts.get_project_by_id(member.member_id)
                 for member in shared_with]
     return projects
 
 
 def sync_cloud_access(accounts, img, names=None):
-    shared_with = accounts.image_manager.shared_images_for(
-        image_id=img.id)
+    shared_with = accounts.list_image_members(img.id)
     # Find tenants who are marked as 'sharing' on openstack but not on DB
     # Or just in One-line..
     projects = get_current_projects_for_image(accounts, img.id)
@@ -383,7 +380,7 @@ def sync_cloud_access(accounts, img, names=None):
         if project and project not in projects:
             print "Sharing image %s with project named %s" \
                 % (img.id, name)
-            accounts.image_manager.share_image(img, name)
+            accounts.share_image(img, name)
             projects.append(project)
     return projects
 
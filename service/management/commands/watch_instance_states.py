@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from service.state_watcher import InstanceStateWatcher, get_event_source
+
+
+class Command(BaseCommand):
+    help = 'Track instance state from the events of INSTANCE_STATE_WATCHER.'
+
+    def handle(self, *args, **options):
+        if not settings.INSTANCE_STATE_WATCHER:
+            raise CommandError("Set INSTANCE_STATE_WATCHER to an event source "
+                               "before starting the watcher.")
+        watcher = InstanceStateWatcher(get_event_source())
+        self.stdout.write("Watching instance states from %s"
+                          % settings.INSTANCE_STATE_WATCHER)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
@@ -1,4 +1,4 @@
-import random
+import hashlib
 import time
 from datetime import timedelta
 from django.core.exceptions import ObjectDoesNotExist
@@ -11,16 +11,29 @@ from core.models import AccountProvider
 from core.models.allocation_strategy import Allocation as CoreAllocation
 from core.models.allocation_strategy import AllocationStrategy as CoreAllocationStrategy
 from core.models.credential import Credential
+from core.model_versions import bump_model_versions
 from core.models import IdentityMembership, Identity, InstanceStatusHistory
+from core.models import AllocationLedger, AllocationLedgerEntry
+from core.models.allocation_ledger import invalidate_ledgers
 from core.models.instance import Instance as CoreInstance
 from core.models.instance import convert_esh_instance,\
     _esh_instance_size_to_core
-from core.models.size import convert_esh_size
+from core.models.quota_usage import update_quota_usage
+from core.models.size import convert_esh_sizes
 from allocation.models import Allocation, AllocationResult
+from allocation.models import Instance as AllocInstance
 from service.cache import get_cached_instances, get_cached_driver
+from service.concurrency import map_concurrently
 from service.instance import suspend_instance, stop_instance, destroy_instance, shelve_instance, offload_instance
-from allocation.engine import calculate_allocation
+from allocation.engine import calculate_allocation, calculate_allocations,\
+    get_allocation_window, _get_rules_key
 from django.conf import settings
+from django.db import IntegrityError, transaction
+
+
+# Longest wait (Seconds) between checks of instances that are being
+# suspended/stopped/.. for over-allocation
+OVER_ALLOCATION_MAX_POLL_DELAY = 10
 
 
 # Private
@@ -52,7 +65,9 @@ def _core_instances_for(identity, start_date=None):
     if not start_date:
         # Can't use 'None' as a query value
         start_date = timezone.datetime(1970, 1, 1).replace(tzinfo=pytz.utc)
-    return CoreInstance.objects.filter(
+    return CoreInstance.objects.select_related(
+        'source__provider', 'source__providermachine', 'source__volume'
+    ).filter(
         Q(instancestatushistory__end_date=None) |
         Q(instancestatushistory__end_date__gt=start_date) |
         Q(end_date=None) | Q(end_date__gt=start_date),
@@ -68,15 +83,11 @@ def _select_identities(provider, users=None):
     return provider.identity_set.all()
 
 
-def _convert_tenant_id_to_names(instances, tenants):
+def _convert_tenant_id_to_names(instances, tenant_directory):
     for i in instances:
-        for tenant in tenants:
-            if type(tenant) == dict:
-                if tenant['id'] == i.owner:
-                    i.owner = tenant['name']
-            else:
-                if tenant.id == i.owner:
-                    i.owner = tenant.name
+        tenant_name = tenant_directory.get_name(i.owner)
+        if tenant_name:
+            i.owner = tenant_name
     return instances
 
 
@@ -119,7 +130,7 @@ def get_allocation_result_for(
     try:
         allocation_result = _get_allocation_result(
             identity, start_date, end_date,
-            print_logs=print_logs)
+            print_logs=print_logs, save_ledger=True)
         logger.debug("Result for Username %s: %s"
                      % (username, allocation_result))
         return allocation_result
@@ -134,17 +145,62 @@ def get_allocation_result_for(
         raise
 
 
+def get_allocation_results_for(
+        provider, usernames, print_logs=False, start_date=None, end_date=None):
+    """
+    Batch version of 'get_allocation_result_for'
+    Given provider and a list of usernames:
+    * Create 'Allocation' for every username
+    * Calculate every 'AllocationResult' in a single pass of the engine
+    Returns a dict of username -> AllocationResult
+    NOTE: Usernames that fail to build an 'Allocation' are logged and left
+          out. Callers fall back to 'get_allocation_result_for', which
+          tries again and raises the error for that username alone.
+    """
+    allocation_results = {}
+    batch_usernames = []
+    allocation_inputs = []
+    rate_cache = {}
+    for username in usernames:
+        identity = _get_identity_from_tenant_name(provider, username)
+        if not identity:
+            allocation_results[username] = _empty_allocation_result()
+            continue
+        try:
+            if settings.USE_ALLOCATION_LEDGER:
+                allocation_results[username] = _get_ledger_allocation_result(
+                    identity, print_logs=print_logs, rate_cache=rate_cache)
+                continue
+            allocation_inputs.append(_get_allocation_input(identity))
+            batch_usernames.append(username)
+        except IdentityMembership.DoesNotExist:
+            allocation_results[username] = _empty_allocation_result()
+        except Exception:
+            logger.exception("Unable to monitor Identity:%s - Left out of "
+                             "the batch" % (identity,))
+    batch_results = calculate_allocations(
+        allocation_inputs, print_logs=print_logs)
+    for username, allocation_result in zip(batch_usernames, batch_results):
+        allocation_results[username] = allocation_result
+    return allocation_results
+
+
 def user_over_allocation_enforcement(
-        provider, username, print_logs=False, start_date=None, end_date=None):
+        provider, username, print_logs=False, start_date=None, end_date=None,
+        allocation_result=None, wait_until=None, action_concurrency=None):
     """
     Begin monitoring 'username' on 'provider'.
     * Calculate allocation from START of month to END of month
+      (Unless a pre-calculated 'allocation_result' is provided)
     * If user is deemed OverAllocation, apply enforce_allocation_policy
+    wait_until - See '_wait_for_settled_instances'
+    action_concurrency - See 'provider_over_allocation_enforcement'
     """
     identity = _get_identity_from_tenant_name(provider, username)
-    allocation_result = get_allocation_result_for(
-        provider, username,
-        print_logs, start_date, end_date)
+    if allocation_result is None:
+        allocation_result = get_allocation_result_for(
+            provider, username,
+            print_logs, start_date, end_date)
     # ASSERT: allocation_result has been retrieved successfully
     # Make some enforcement decision based on the allocation_result's output.
 
@@ -176,13 +232,15 @@ def user_over_allocation_enforcement(
                allocation_result.total_runtime(),
                diff_amount))
         try:
-            enforce_allocation_policy(identity, user)
+            enforce_allocation_policy(
+                identity, user, wait_until, action_concurrency)
         except:
             logger.info("Unable to enforce allocation for user: %s" % user)
     return allocation_result
 
 
-def enforce_allocation_policy(identity, user):
+def enforce_allocation_policy(identity, user, wait_until=None,
+                              action_concurrency=None):
     """
     Add additional logic here to determine the proper 'action to take'
     when THIS identity/user combination is given
@@ -191,7 +249,8 @@ def enforce_allocation_policy(identity, user):
     2. Notify the 'ProviderAdministrator' that a user has exceeded
        their allocation, but that NO action has been taken.
     """
-    return provider_over_allocation_enforcement(identity, user)
+    return provider_over_allocation_enforcement(
+        identity, user, wait_until, action_concurrency)
 
 
 def _execute_provider_action(identity, user, instance, action_name):
@@ -229,7 +288,7 @@ def _execute_provider_action(identity, user, instance, action_name):
                 identity.uuid,
                 user)
         elif action_name == 'Terminate':
-            destroy_instance(user, identity.uuid, instance)
+            destroy_instance(user, identity.uuid, instance.id)
         else:
             raise Exception("Encountered Unknown Action Named %s" % action)
     except ObjectDoesNotExist:
@@ -240,71 +299,128 @@ def _execute_provider_action(identity, user, instance, action_name):
         return
 
 
-def provider_over_allocation_enforcement(identity, user):
+def provider_over_allocation_enforcement(identity, user, wait_until=None,
+                                         concurrency=None):
+    """
+    Run the 'over_allocation_action' of the provider on every active
+    instance of 'identity', using up to 'concurrency' threads
+    (Default: settings.OVER_ALLOCATION_ACTION_CONCURRENCY).
+    With one thread, the actions run here, on this thread's driver.
+    """
+    if not concurrency:
+        concurrency = settings.OVER_ALLOCATION_ACTION_CONCURRENCY
     provider = identity.provider
     action = provider.over_allocation_action
     if not action:
         logger.debug("No 'over_allocation_action' provided for %s" % provider)
         return False
     driver = get_cached_driver(identity=identity)
-    esh_instances = driver.list_instances()
-    # TODO: Parallelize this operation so you don't wait for larger instances
-    # to finish 'wait_for' task below..
-    for instance in esh_instances:
-        try:
-            if driver._is_active_instance(instance):
-                # Suspend active instances, update the task in the DB
-                # NOTE: identity.created_by COULD BE the Admin User, indicating that this action/InstanceHistory was
-                #       executed by the administrator.. Future Release Idea.
-                _execute_provider_action(
-                    identity,
-                    identity.created_by,
-                    instance,
-                    action.name)
-                # NOTE: Intentionally added to allow time for
-                #      the Cloud to begin 'suspend' operation
-                #      before querying for the instance again.
-                # TODO: Instead: Add "wait_for" change from active to any
-                # terminal, non-active state?
-                wait_time = random.uniform(2, 6)
-                time.sleep(wait_time)
-                updated_esh = driver.get_instance(instance.id)
+    esh_instances = [instance for instance in driver.list_instances()
+                     if driver._is_active_instance(instance)]
+    if not esh_instances:
+        return True  # User was over_allocation
+    # Suspend (or stop, shelve..) every active instance at once
+    # NOTE: identity.created_by COULD BE the Admin User, indicating that this action/InstanceHistory was
+    #       executed by the administrator.. Future Release Idea.
+    outcomes = map_concurrently(
+        [(_execute_provider_action, identity, identity.created_by,
+          instance, action.name) for instance in esh_instances],
+        concurrency)
+    acted_instances = []
+    failures = []
+    for (instance, (result, exc_info)) in zip(esh_instances, outcomes):
+        if not exc_info:
+            acted_instances.append(instance)
+        # Raise ANY exception that doesn't say
+        # 'This instance is already in the requested VM state'
+        # NOTE: This is OpenStack specific
+        elif 'in vm_state' not in exc_info[1].message:
+            failures.append(exc_info)
+    if acted_instances:
+        # Wait for the cloud to finish the actions, then record the new
+        # state of every instance in one pass.
+        updated_instances = _wait_for_settled_instances(
+            driver, [instance.id for instance in acted_instances], wait_until)
+        core_instances = list(CoreInstance.objects.filter(
+            provider_alias__in=[instance.id for instance in acted_instances],
+            end_date=None))
+        known_aliases = set(core_instance.provider_alias
+                            for core_instance in core_instances)
+        update_instances(driver, identity, updated_instances, core_instances)
+        for updated_esh in updated_instances:
+            if updated_esh.id not in known_aliases:
                 convert_esh_instance(
                     driver, updated_esh,
                     identity.provider.uuid,
                     identity.uuid,
                     user)
-        except Exception as e:
-            # Raise ANY exception that doesn't say
-            # 'This instance is already in the requested VM state'
-            # NOTE: This is OpenStack specific
-            if 'in vm_state' not in e.message:
-                raise
+    if failures:
+        exc_info = failures[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
     return True  # User was over_allocation
 
 
+def _is_settled_instance(instance):
+    return instance.extra['status'].lower() != 'active'\
+        and not instance.extra.get('task')
+
+
+def _wait_for_settled_instances(driver, instance_ids, wait_until=None):
+    """
+    Wait (Until 'wait_until', or settings.OVER_ALLOCATION_WAIT_TIMEOUT)
+    until none of 'instance_ids' is active or busy with a task.
+    Every check is a single 'list_instances' for all of them.
+    Returns the last known esh instances of 'instance_ids' that still exist.
+    NOTE: Pass the same 'wait_until' for every user of a sweep, so the
+          sweep waits once, not once per user.
+    """
+    if not wait_until:
+        wait_until = time.time() + settings.OVER_ALLOCATION_WAIT_TIMEOUT
+    delay = 1
+    while True:
+        instances = [instance for instance in driver.list_instances()
+                     if instance.id in instance_ids]
+        if all(_is_settled_instance(instance) for instance in instances):
+            return instances
+        remaining = wait_until - time.time()
+        if remaining <= 0:
+            logger.info("Instances %s did not settle in time" % (
+                [instance.id for instance in instances
+                 if not _is_settled_instance(instance)],))
+            return instances
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, OVER_ALLOCATION_MAX_POLL_DELAY)
+
+
 def update_instances(driver, identity, esh_list, core_list):
     """
     End-date core instances that don't show up in esh_list
     && Update the values of instances that do
     """
-    esh_ids = [instance.id for instance in esh_list]
-    # logger.info('%s Instances for Identity %s: %s'
-    #            % (len(esh_ids), identity, esh_ids))
-    for core_instance in core_list:
-        try:
-            index = esh_ids.index(core_instance.provider_alias)
-        except ValueError:
-            logger.info("Did not find instance %s in ID List: %s" %
-                        (core_instance.provider_alias, esh_ids))
-            core_instance.end_date_all()
-            continue
-        esh_instance = esh_list[index]
-        esh_size = driver.get_size(esh_instance.size.id)
-        core_size = convert_esh_size(esh_size, identity.provider.uuid)
+    esh_map = {instance.id: instance for instance in esh_list}
+    missing_instances = [core_instance for core_instance in core_list
+                         if core_instance.provider_alias not in esh_map]
+    if missing_instances:
+        logger.info("Did not find instances %s in ID List: %s" %
+                    ([core_instance.provider_alias
+                      for core_instance in missing_instances],
+                     esh_map.keys()))
+        CoreInstance.bulk_end_date(missing_instances)
+    found_instances = [core_instance for core_instance in core_list
+                       if core_instance.provider_alias in esh_map]
+    if not found_instances:
+        return
+    # Each size is looked up once, no matter how many instances use it
+    size_aliases = set(esh_map[core_instance.provider_alias].size.id
+                       for core_instance in found_instances)
+    core_size_map = convert_esh_sizes(
+        [driver.get_size(size_alias) for size_alias in size_aliases],
+        identity.provider.uuid)
+    for core_instance in found_instances:
+        esh_instance = esh_map[core_instance.provider_alias]
         core_instance.update_history(
             esh_instance.extra['status'],
-            core_size,
+            core_size_map[esh_instance.size.id],
             esh_instance.extra.get('task'),
             esh_instance.extra.get(
                 'metadata', {}).get('tmp_status','MISSING'))
@@ -325,74 +441,90 @@ def _cleanup_missing_instances(
     if not identity:
         return instances
 
-    core_instances = _core_instances_for(identity, start_date)
-    fixed_instances = []
-    for inst in core_instances:
-        if not core_running_instances or inst not in core_running_instances:
-            inst.end_date_all()
-            fixed_instances.append(inst)
-        else:
-            # Instance IS in the list of running instances.. Further cleaning
-            # can be done at this level.
-            non_end_dated_history = inst.instancestatushistory_set.filter(
-                end_date=None)
-            count = len(non_end_dated_history)
-            if count > 1:
-                history_names = [ish.status.name for ish
-                                 in non_end_dated_history]
-                # Note: We have the 'wrong' instance, we want the one that
-                # includes the ESH driver
-                core_running_inst = [i for i in core_running_instances
-                                     if i == inst][0]
-                new_history = _resolve_history_conflict(
-                    identity, core_running_inst, non_end_dated_history)
-                fixed_instances.append(inst)
-                logger.warn(
-                    "Instance %s contained %s "
-                    "NON END DATED history:%s. "
-                    " New History: %s" %
-                    (inst.provider_alias,
-                     count, history_names, new_history))
-            # Gather the updated values..
-            instances.append(inst)
+    core_instances = list(_core_instances_for(identity, start_date))
+    # NOTE: We want the running instances, they include the ESH driver
+    running_map = {inst.id: inst for inst in core_running_instances or []}
+    missing_instances = [inst for inst in core_instances
+                         if inst.id not in running_map]
+    instances = [inst for inst in core_instances
+                 if inst.id in running_map]
+    # Instances can only have one 'open' history
+    open_history_map = {}
+    for history in InstanceStatusHistory.objects.filter(
+            instance__id__in=[inst.id for inst in instances],
+            end_date=None).select_related('status'):
+        open_history_map.setdefault(history.instance_id, []).append(history)
+    conflicts = [(running_map[instance_id], bad_history)
+                 for instance_id, bad_history in open_history_map.items()
+                 if len(bad_history) > 1]
+    with transaction.atomic():
+        CoreInstance.bulk_end_date(missing_instances)
+        new_histories = _resolve_history_conflicts(identity, conflicts)
+    for (core_running_inst, bad_history), new_history in zip(
+            conflicts, new_histories):
+        logger.warn(
+            "Instance %s contained %s "
+            "NON END DATED history:%s. "
+            " New History: %s" %
+            (core_running_inst.provider_alias,
+             len(bad_history),
+             [ish.status.name for ish in bad_history],
+             new_history))
+    # The DB now matches the cloud, so this is where usage is reconciled.
+    update_quota_usage([identity.id])
+    fixed_count = len(missing_instances) + len(conflicts)
     # Return the updated list
-    if fixed_instances:
+    if fixed_count:
         logger.warn("Cleaned up %s instances for %s"
-                    % (len(fixed_instances), identity.created_by.username))
+                    % (fixed_count, identity.created_by.username))
     return instances
 
 
-def _resolve_history_conflict(
-        identity, core_running_instance,
-        bad_history, reset_time=None):
+def _resolve_history_conflicts(identity, conflicts, reset_time=None):
     """
+    conflicts - list of (core_running_instance, bad_history)
+
+    End-date all of the 'bad_history' and start a new history for each
+    instance, using its current status & size.
+    Returns the list of new histories.
+
     NOTE 1: This is a 'band-aid' fix until we are 100% that Transaction will
             not create conflicting un-end-dated objects.
 
-    NOTE 2: It is EXPECTED that this instance has the 'esh' attribute
+    NOTE 2: It is EXPECTED that each instance has the 'esh' attribute
             Failure to add the 'esh' attribute will generate a ValueError!
     """
-    if not getattr(core_running_instance, 'esh'):
-        raise ValueError("Esh is missing from %s" % core_running_instance)
-    esh_instance = core_running_instance.esh
-
-    # Check for temporary status and fetch that
-    tmp_status = esh_instance.extra.get('metadata', {}).get("tmp_status")
-    new_status = tmp_status or esh_instance.extra['status']
-
+    if not conflicts:
+        return []
+    for (core_running_instance, _) in conflicts:
+        if not getattr(core_running_instance, 'esh', None):
+            raise ValueError("Esh is missing from %s" % core_running_instance)
     esh_driver = get_cached_driver(identity=identity)
-    new_size = _esh_instance_size_to_core(
-        esh_driver, esh_instance, identity.provider.uuid)
     if not reset_time:
         reset_time = timezone.now()
-    for history in bad_history:
-        history.end_date = reset_time
-        history.save()
-    new_history = InstanceStatusHistory.create_history(
-        new_status,
-        core_running_instance, new_size,
-        reset_time)
-    return new_history
+    new_histories = []
+    for (core_running_instance, _) in conflicts:
+        esh_instance = core_running_instance.esh
+        # Check for temporary status and fetch that
+        tmp_status = esh_instance.extra.get(
+            'metadata', {}).get("tmp_status")
+        new_status = tmp_status or esh_instance.extra['status']
+        new_size = _esh_instance_size_to_core(
+            esh_driver, esh_instance, identity.provider.uuid)
+        new_histories.append(InstanceStatusHistory.create_history(
+            new_status,
+            core_running_instance, new_size,
+            reset_time))
+    with transaction.atomic():
+        InstanceStatusHistory.objects.filter(
+            id__in=[history.id for conflict in conflicts
+                    for history in conflict[1]]
+        ).update(end_date=reset_time)
+        InstanceStatusHistory.objects.bulk_create(new_histories)
+        invalidate_ledgers(
+            [conflict[0].id for conflict in conflicts], reset_time)
+    bump_model_versions(InstanceStatusHistory, scopes=[identity.id])
+    return new_histories
 
 
 def _get_instance_owner_map(provider, users=None):
@@ -417,9 +549,10 @@ def _get_instance_owner_map(provider, users=None):
 
     all_instances = get_cached_instances(provider=provider, identity=account_identity, force=True)
     #all_tenants = admin_driver._connection._keystone_list_tenants()
-    all_tenants = accounts.list_projects()
+    tenant_directory = accounts.get_tenant_directory()
     # Convert instance.owner from tenant-id to tenant-name all at once
-    all_instances = _convert_tenant_id_to_names(all_instances, all_tenants)
+    all_instances = _convert_tenant_id_to_names(
+        all_instances, tenant_directory)
     # Make a mapping of owner-to-instance
     instance_map = _make_instance_owner_map(all_instances, users=users)
     logger.info("Instance owner map created")
@@ -491,27 +624,186 @@ def _empty_allocation_result():
 
 
 def _get_allocation_result(identity, start_date=None, end_date=None,
-                           print_logs=False):
+                           print_logs=False, save_ledger=False):
     """
     Given an identity, retrieve the provider strategy and apply the strategy
     to this identity.
+    save_ledger - Move the AllocationLedger forward (Monitoring only, the
+                  API reads the ledger without writing it)
     """
 
     if not identity:
         return _empty_allocation_result()
+    if settings.USE_ALLOCATION_LEDGER:
+        return _get_ledger_allocation_result(
+            identity, print_logs=print_logs, save_ledger=save_ledger)
+    allocation_input = _get_allocation_input(identity)
+    allocation_result = calculate_allocation(
+        allocation_input,
+        print_logs=print_logs)
+    return allocation_result
+
+
+def _get_ledger_allocation_result(identity, print_logs=False,
+                                  rate_cache=None, save_ledger=True):
+    """
+    Same result as '_get_allocation_result', but only the history that has
+    NOT been counted by the AllocationLedger of this identity is loaded and
+    run through the engine.
+    History that has ended since the last checkpoint is counted and
+    the ledger is moved forward.
+    """
+    ledger = AllocationLedger.objects.filter(identity=identity).first()
+    counted_until = ledger.checkpoint if ledger else None
+    allocation_input = _get_allocation_input(identity, counted_until)
+    fingerprint = _get_ledger_fingerprint(allocation_input)
+    if ledger and (ledger.fingerprint != fingerprint or
+                   ledger.start_date != allocation_input.start_date):
+        logger.info("Rules or time periods have changed. Removing %s"
+                    % (ledger,))
+        ledger.delete()
+        ledger = None
+        allocation_input = _get_allocation_input(identity)
+    if not fingerprint:
+        # Counting can not be split up for this allocation
+        return calculate_allocation(
+            allocation_input, print_logs=print_logs, rate_cache=rate_cache)
+
+    (window_start, window_end) = get_allocation_window(allocation_input)
+    checkpoint = min(window_end, timezone.now())\
+        - settings.ALLOCATION_LEDGER_DELAY
+    closed_instances = []
+    open_instances = []
+    for instance in allocation_input.instances:
+        closed_history = []
+        open_history = []
+        for history in instance.history:
+            if history.end_date and history.end_date <= checkpoint:
+                closed_history.append(history)
+            else:
+                open_history.append(history)
+        if closed_history:
+            closed_instances.append(AllocInstance(
+                instance.identifier, instance.provider, instance.machine,
+                closed_history))
+        if open_history:
+            open_instances.append(AllocInstance(
+                instance.identifier, instance.provider, instance.machine,
+                open_history))
+
+    # Count the history that has closed since the last checkpoint
+    entries = ledger.get_entries() if ledger else {}
+    changed_entries = {}
+    if closed_instances:
+        closed_result = calculate_allocation(
+            _copy_allocation(allocation_input, closed_instances),
+            rate_cache=rate_cache)
+        for time_period in closed_result.time_periods:
+            for instance_result in time_period.instance_results:
+                for history_result in instance_result.history_list:
+                    if not (history_result.clock_time or
+                            history_result.total_time or
+                            history_result.burn_rate):
+                        continue
+                    key = (time_period.start_counting_date,
+                           instance_result.identifier,
+                           history_result.status_name)
+                    entry = entries.get(key)
+                    if not entry:
+                        entry = AllocationLedgerEntry(
+                            period_start=key[0],
+                            instance_identifier=key[1],
+                            status_name=key[2])
+                        entries[key] = entry
+                    entry.add_result(history_result)
+                    changed_entries[key] = entry
+
+    allocation_result = calculate_allocation(
+        _copy_allocation(allocation_input, open_instances),
+        print_logs=print_logs, rate_cache=rate_cache,
+        counted_results=AllocationLedger.counted_results(entries.values()))
+    if save_ledger and checkpoint > window_start and \
+            (not ledger or checkpoint > ledger.checkpoint):
+        _save_allocation_ledger(
+            identity, ledger, allocation_input.start_date, checkpoint,
+            fingerprint, changed_entries.values())
+    return allocation_result
+
+
+def _save_allocation_ledger(identity, ledger, start_date, checkpoint,
+                            fingerprint, changed_entries):
+    """
+    Move the ledger forward to 'checkpoint'.
+    If another worker has moved the ledger since it was loaded, the ledger
+    is left alone (The next run will count the history instead).
+    """
+    with transaction.atomic():
+        if ledger:
+            updated = AllocationLedger.objects.filter(
+                pk=ledger.pk, checkpoint=ledger.checkpoint).update(
+                checkpoint=checkpoint)
+            if not updated:
+                return
+        else:
+            try:
+                with transaction.atomic():
+                    ledger = AllocationLedger.objects.create(
+                        identity=identity, start_date=start_date,
+                        checkpoint=checkpoint, fingerprint=fingerprint)
+            except IntegrityError:
+                return
+        new_entries = []
+        for entry in changed_entries:
+            if entry.pk:
+                entry.save()
+            else:
+                entry.ledger = ledger
+                new_entries.append(entry)
+        AllocationLedgerEntry.objects.bulk_create(new_entries)
+
+
+def _get_ledger_fingerprint(allocation):
+    """
+    Describes the rules and the time periods that counting depends on.
+    Returns None when the history can not be counted ahead of time.
+    """
+    if not allocation.start_date or not allocation.end_date:
+        return None
+    rules_key = _get_rules_key(allocation.rules)
+    if rules_key is None:
+        return None
+    credit_dates = sorted(
+        (credit.__class__.__name__, credit.increase_date)
+        for credit in allocation.credits)
+    rules_key = [(rule_class.__name__, value, multiplier)
+                 for (rule_class, value, multiplier) in rules_key]
+    return hashlib.md5(repr((allocation.start_date,
+                             allocation.interval_delta,
+                             rules_key, credit_dates))).hexdigest()
+
+
+def _copy_allocation(allocation, instances):
+    return Allocation(
+        credits=allocation.credits, rules=allocation.rules,
+        instances=instances, start_date=allocation.start_date,
+        end_date=allocation.end_date,
+        interval_delta=allocation.interval_delta)
+
+
+def _get_allocation_input(identity, counted_until=None):
+    """
+    Given an identity, return the 'Allocation' (Input) for the engine
+    counted_until - Leave out history that ended on/before this date
+    """
     username = identity.created_by.username
     core_allocation = get_allocation(username, identity.uuid)
     if not core_allocation:
         logger.warn("User:%s Identity:%s does not have an allocation assigned"
                     % (username, identity))
-    allocation_input = apply_strategy(identity, core_allocation)
-    allocation_result = calculate_allocation(
-        allocation_input,
-        print_logs=print_logs)
-    return allocation_result
+    return apply_strategy(identity, core_allocation, counted_until)
 
 
-def apply_strategy(identity, core_allocation):
+def apply_strategy(identity, core_allocation, counted_until=None):
     """
     Given identity and core allocation, grab the ProviderStrategy
     and apply it. Returns an "AllocationInput"
@@ -520,7 +812,7 @@ def apply_strategy(identity, core_allocation):
     if not strategy:
         return Allocation(credits=[], rules=[], instances=[],
                           start_date=None, end_date=None, interval_delta=None)
-    return strategy.apply(identity, core_allocation)
+    return strategy.apply(identity, core_allocation, counted_until)
 
 
 def _get_strategy(identity):
@@ -1,6 +1,9 @@
+from django.db import transaction
+
 from threepio import logger
 
 from core.models import IdentityMembership, Identity, Provider
+from core.models.quota_usage import get_quota_usage
 
 from service.accounts.openstack_manager import AccountDriver
 from service.cache import get_cached_driver
@@ -51,27 +54,32 @@ def set_provider_quota(identity_uuid, limit_dict=None):
 
 
 def get_current_quota(identity_uuid):
-    driver = get_cached_driver(
-        identity=Identity.objects.get(uuid=identity_uuid))
-    cpu = ram = disk = suspended = 0
-    instances = driver.list_instances()
-    # prefetch sizes
-    sizes = {size.id:size for size in driver.list_sizes()}
-    for instance in instances:
-        if instance.extra['status'] == 'suspended'\
-                or instance.extra['status'] == 'shutoff':
-            suspended += 1
-            continue
-        size = sizes[instance.size.id]
-        cpu += size.cpu
-        ram += size.ram
-        disk += size.disk
-    return {'cpu': cpu, 'ram': ram, 'disk': disk, 'suspended_count': suspended}
+    """
+    Returns the resources in use by the identity (Including the resources
+    reserved by launches in progress), see core.models.quota_usage
+    """
+    identity = Identity.objects.get(uuid=identity_uuid)
+    return get_quota_usage(identity).get_usage()
+
+
+def release_quota(identity_uuid, esh_size):
+    """
+    Give back the resources reserved for a launch of 'esh_size'
+    (When the launch has failed)
+    """
+    identity = Identity.objects.get(uuid=identity_uuid)
+    with transaction.atomic():
+        quota_usage = get_quota_usage(identity, lock=True)
+        quota_usage.release(esh_size.cpu, esh_size.ram, esh_size.disk)
+        quota_usage.save()
 
 
 def check_over_quota(username, identity_uuid, esh_size=None, resuming=False):
     """
     Checks quota based on current limits (and an instance of size, if passed).
+    When a launch (not 'resuming') passes the check, the resources of
+    'esh_size' are reserved, so that concurrent launches can not both
+    pass the check. (See 'release_quota')
 
     return 5-tuple: ((bool) over_quota,
                      (str) resource_over_quota,
@@ -81,9 +89,17 @@ def check_over_quota(username, identity_uuid, esh_size=None, resuming=False):
     """
     membership = IdentityMembership.objects.get(identity__uuid=identity_uuid,
                                                 member__name=username)
-    user_quota = membership.quota
+    with transaction.atomic():
+        quota_usage = get_quota_usage(membership.identity, lock=True)
+        over_quota = _check_over_quota(
+            membership.quota, quota_usage.get_usage(), esh_size, resuming)
+        if not over_quota[0] and esh_size and not resuming:
+            quota_usage.reserve(esh_size.cpu, esh_size.ram, esh_size.disk)
+            quota_usage.save()
+    return over_quota
+
 
-    current = get_current_quota(identity_uuid)
+def _check_over_quota(user_quota, current, esh_size=None, resuming=False):
     logger.debug("Current Quota:%s" % current)
     cur_cpu = current['cpu']
     cur_ram = current['ram']
@@ -5,13 +5,14 @@ Provide pluggable machine search for Atmosphere.
 from abc import ABCMeta, abstractmethod
 import operator
 
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, IntegerField
 
 from core.models.machine import compare_core_machines, filter_core_machine,\
     ProviderMachine
 from core.models.provider import Provider
 from core.models.application import Application
-from core.query import only_current_source
+from core.models.application_search import ApplicationSearchDocument
+from core.query import only_current_apps, only_current_source
 from functools import reduce
 
 
@@ -66,21 +67,24 @@ class CoreApplicationSearch(BaseSearchProvider):
     """
 
     @classmethod
-    def search(cls, query, identity=None):
+    def get_base_apps(cls, identity=None):
         if identity:
-            base_apps = Application.objects.filter(
+            return Application.objects.filter(
                 # Privately owned OR public machines
                 Q(private=True,
                   versions__machines__instance_source__created_by_identity=identity)
                 | Q(private=False,
                     versions__machines__instance_source__provider=identity.provider))
-        else:
-            active_providers = Provider.get_active()
-            base_apps = Application.objects.filter(
-                # Public machines
-                private=False,
-                # Providermachine's provider is active
-                versions__machines__instance_source__provider__in=active_providers)
+        active_providers = Provider.get_active()
+        return Application.objects.filter(
+            # Public machines
+            private=False,
+            # Providermachine's provider is active
+            versions__machines__instance_source__provider__in=active_providers)
+
+    @classmethod
+    def search(cls, query, identity=None):
+        base_apps = cls.get_base_apps(identity)
         # AND query matches on:
         query_match = base_apps.filter(
             # app tag name
@@ -93,3 +97,47 @@ class CoreApplicationSearch(BaseSearchProvider):
             | Q(description__icontains=query),
             *only_current_source())
         return query_match.distinct()
+
+
+class IndexedApplicationSearch(CoreApplicationSearch):
+
+    """
+    Search core.models.application Application using the
+    ApplicationSearchDocument (See core/models/application_search.py)
+
+    Every term of the query must be found in the document.
+    Results are ranked by how well the query matches the application name.
+    """
+
+    @classmethod
+    def search(cls, query, identity=None):
+        return cls.filter_applications(
+            cls.get_base_apps(identity).filter(
+                only_current_apps()).distinct(),
+            query)
+
+    @classmethod
+    def get_terms(cls, query):
+        return query.replace(',', ' ').lower().split()
+
+    @classmethod
+    def filter_applications(cls, applications, query):
+        """
+        Filter (and rank) the 'applications' queryset by 'query'
+        """
+        terms = cls.get_terms(query)
+        if not terms:
+            return applications
+        documents = ApplicationSearchDocument.objects.all()
+        for term in terms:
+            documents = documents.filter(document__contains=term)
+        name = " ".join(terms)
+        return applications.filter(
+            id__in=documents.values('application')
+        ).annotate(search_rank=Case(
+            When(search_document__name=name, then=Value(3)),
+            When(search_document__name__startswith=name, then=Value(2)),
+            When(search_document__name__contains=name, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField())
+        ).order_by('-search_rank', 'name')
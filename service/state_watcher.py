@@ -0,0 +1,328 @@
+"""
+Event-driven tracking of instance state.
+
+Instead of asking the cloud 'Is it ready yet?' every few seconds,
+the InstanceStateWatcher listens to a stream of instance events
+(Ex: The nova notification bus), records the latest state of every
+instance in redis, updates the InstanceStatusHistory and wakes up any
+task that is waiting on that instance.
+
+Run the watcher with: ./manage.py watch_instance_states
+"""
+import json
+import time
+import uuid
+import Queue
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import redis
+
+from threepio import logger
+
+from core.models.instance import find_instance
+from core.models.size import Size
+
+
+INSTANCE_STATE_KEY = "instance_state.{0}"
+INSTANCE_WAITERS_KEY = "instance_state_waiters.{0}"
+INSTANCE_WAKE_KEY = "instance_state_wake.{0}.{1}"
+# Instance state is kept around long enough to cover a (slow) launch.
+INSTANCE_STATE_TIMEOUT = 2 * 60 * 60
+# Longest a waiting task sleeps between checks of the instance state
+# (Kept below CLOUD_CACHE_SOCKET_TIMEOUT, see '_get_wake_interval')
+INSTANCE_WAKE_INTERVAL = 3
+
+# nova 'vm_state' -> The 'status' reported by the nova API (and rtwo)
+VM_STATE_STATUS_MAP = {
+    'building': 'build',
+    'stopped': 'shutoff',
+    'rescued': 'rescue',
+    'resized': 'verify_resize',
+}
+
+
+class InstanceEvent(object):
+
+    """
+    A change in the state of a single instance.
+    """
+
+    def __init__(self, instance_alias, status, task=None,
+                 size_alias=None, timestamp=None):
+        self.instance_alias = instance_alias
+        self.status = status.lower()
+        self.task = task
+        self.size_alias = size_alias
+        self.timestamp = timestamp or time.time()
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "task": self.task,
+            "size_alias": self.size_alias,
+            "timestamp": self.timestamp,
+        }
+
+    def __repr__(self):
+        return self.__unicode__()
+
+    def __unicode__(self):
+        return "<InstanceEvent: %s %s - %s>" % (
+            self.instance_alias, self.status, self.task)
+
+
+class BaseEventSource(object):
+
+    """
+    A source of InstanceEvents.
+    Subclasses implement 'events', which yields InstanceEvent(s)
+    until the source is stopped.
+    """
+
+    def events(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        pass
+
+
+class LocalEventSource(BaseEventSource):
+
+    """
+    An in-process source of events (For testing and development).
+    """
+
+    def __init__(self):
+        self._queue = Queue.Queue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def events(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            yield event
+
+    def stop(self):
+        self._queue.put(None)
+
+
+class NovaNotificationSource(BaseEventSource):
+
+    """
+    Listens to the 'compute.instance.*' notifications that nova
+    publishes to its AMQP notification bus.
+    """
+    queue_name = "atmosphere_instance_state"
+
+    def __init__(self, url=None, exchange="nova",
+                 routing_key="notifications.info"):
+        self.url = url or settings.NOVA_NOTIFICATION_URL
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self._running = False
+
+    @classmethod
+    def to_event(cls, event_type, payload):
+        """
+        Convert a nova notification to an InstanceEvent
+        (Or None, if the notification is not related to instance state)
+        """
+        if not event_type or not event_type.startswith("compute.instance."):
+            return None
+        instance_alias = payload.get("instance_id")
+        vm_state = payload.get("state")
+        if not instance_alias or not vm_state:
+            return None
+        status = VM_STATE_STATUS_MAP.get(vm_state, vm_state)
+        task = payload.get("new_task_state", payload.get("state_description"))
+        return InstanceEvent(instance_alias, status, task or None,
+                             size_alias=payload.get("instance_flavor_id"))
+
+    def events(self):
+        from kombu import Connection, Exchange, Queue as KombuQueue
+        exchange = Exchange(self.exchange, type="topic", durable=False)
+        queue = KombuQueue(self.queue_name, exchange,
+                           routing_key=self.routing_key,
+                           durable=False, auto_delete=True)
+        events = []
+
+        def _on_message(body, message):
+            if isinstance(body, basestring):
+                body = json.loads(body)
+            if "oslo.message" in body:
+                body = json.loads(body["oslo.message"])
+            event = self.to_event(body.get("event_type"),
+                                  body.get("payload", {}))
+            if event:
+                events.append(event)
+            message.ack()
+
+        self._running = True
+        with Connection(self.url) as conn:
+            with conn.Consumer(queue, callbacks=[_on_message]):
+                while self._running:
+                    try:
+                        conn.drain_events(timeout=1)
+                    except Exception as exc:
+                        if not _is_timeout(exc):
+                            raise
+                    while events:
+                        yield events.pop(0)
+
+    def stop(self):
+        self._running = False
+
+
+def _is_timeout(exc):
+    import socket
+    return isinstance(exc, socket.timeout)
+
+
+def get_event_source():
+    """
+    Return the event source selected by settings.INSTANCE_STATE_WATCHER
+    """
+    return import_string(settings.INSTANCE_STATE_WATCHER)()
+
+
+def instance_state_watcher_enabled():
+    return bool(getattr(settings, "INSTANCE_STATE_WATCHER", None))
+
+
+class InstanceStateWatcher(object):
+
+    """
+    Consumes InstanceEvents from 'source':
+    * Records the latest state of the instance, for waiting tasks
+    * Updates the InstanceStatusHistory
+    * Wakes up tasks waiting on the instance
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def run(self):
+        for event in self.source.events():
+            try:
+                self.handle(event)
+            except Exception:
+                logger.exception("Could not handle %s" % event)
+
+    def stop(self):
+        self.source.stop()
+
+    def handle(self, event):
+        record_instance_state(event)
+        self.update_history(event)
+
+    def update_history(self, event):
+        core_instance = find_instance(event.instance_alias)
+        if not core_instance:
+            return None
+        if event.status == "deleted":
+            core_instance.end_date_all()
+            return core_instance
+        core_size = None
+        if event.size_alias:
+            core_size = Size.objects.filter(
+                alias=event.size_alias,
+                provider=core_instance.provider).first()
+        if not core_size:
+            last_history = core_instance.get_last_history()
+            core_size = last_history.size
+        core_instance.update_history(event.status, core_size, event.task)
+        return core_instance
+
+
+def _redis_connection():
+    from service.cache import redis_connection
+    return redis_connection()
+
+
+def record_instance_state(event):
+    """
+    Record the state of the instance and wake up every task waiting on it
+    """
+    r = _redis_connection()
+    waiters_key = INSTANCE_WAITERS_KEY.format(event.instance_alias)
+    r.set(INSTANCE_STATE_KEY.format(event.instance_alias),
+          json.dumps(event.to_dict()), ex=INSTANCE_STATE_TIMEOUT)
+    waiters = r.smembers(waiters_key)
+    if not waiters:
+        return
+    pipe = r.pipeline()
+    for waiter in waiters:
+        wake_key = INSTANCE_WAKE_KEY.format(event.instance_alias, waiter)
+        pipe.lpush(wake_key, event.timestamp)
+        pipe.expire(wake_key, _get_wake_interval() * 2)
+    pipe.execute()
+
+
+def _get_wake_interval():
+    """
+    A blocking read must return before the socket times out,
+    or an idle wait is reported as a redis error.
+    """
+    return max(1, min(INSTANCE_WAKE_INTERVAL,
+                      settings.CLOUD_CACHE_SOCKET_TIMEOUT - 1))
+
+
+def get_instance_state(instance_alias):
+    """
+    Return the last state recorded for 'instance_alias' as a dict
+    (Or None, if no state has been recorded)
+    """
+    state = _redis_connection().get(INSTANCE_STATE_KEY.format(instance_alias))
+    if not state:
+        return None
+    return json.loads(state)
+
+
+def is_status_ready(state, status_query, tasks_allowed=False):
+    if not state:
+        return False
+    if state["status"] not in status_query:
+        return False
+    return tasks_allowed or not state["task"]
+
+
+def wait_for_instance_state(instance_alias, is_ready, timeout=None):
+    """
+    Block until 'is_ready(state)' returns True for the recorded state
+    of 'instance_alias', or 'timeout' seconds have passed.
+    Returns True if the instance is ready.
+    """
+    if timeout is None:
+        timeout = settings.INSTANCE_STATE_WATCHER_WAIT
+    waiter = uuid.uuid4().hex
+    waiters_key = INSTANCE_WAITERS_KEY.format(instance_alias)
+    wake_key = INSTANCE_WAKE_KEY.format(instance_alias, waiter)
+    wait_until = time.time() + timeout
+    wake_interval = _get_wake_interval()
+    try:
+        r = _redis_connection()
+        # Register *before* looking at the state, so no event is missed.
+        r.sadd(waiters_key, waiter)
+        r.expire(waiters_key, INSTANCE_STATE_TIMEOUT)
+        try:
+            while True:
+                if is_ready(get_instance_state(instance_alias)):
+                    return True
+                remaining = wait_until - time.time()
+                if remaining <= 0:
+                    return False
+                r.blpop(wake_key, timeout=max(
+                    1, int(min(remaining, wake_interval))))
+        finally:
+            r.srem(waiters_key, waiter)
+            r.delete(wake_key)
+    except redis.exceptions.RedisError:
+        logger.exception("EXTERNAL SERVICE redis-server IS NOT RESPONDING! "
+                         "Somebody should turn it on!")
+        # Fall back to asking the cloud.
+        return True
@@ -33,6 +33,7 @@ def remove_empty_networks_for(provider_id):
             try:
                 celery_logger.debug("Removing project network for User:%s, Project:%s"
                              % (user, project))
+                os_driver.invalidate_provisioned_project(project)
                 os_driver.network_manager.delete_project_network(user, project)
             except NeutronClientException:
                 celery_logger.exception("Neutron unable to remove project"
@@ -4,6 +4,7 @@ NOTE: At this point create options do not have a hard-set requirement for 'CoreI
 Delete/remove operations do. This should be investigated further..
 """
 from operator import attrgetter
+import random
 import sys
 import re
 import time
@@ -16,6 +17,7 @@ from celery.decorators import task
 from celery.task import current
 from celery.result import allow_join_result
 
+from libcloud.common.exceptions import RateLimitReachedError
 from libcloud.compute.types import DeploymentError
 
 #TODO: Internalize exception into RTwo
@@ -32,12 +34,15 @@ from core.models.instance import Instance
 from core.models.identity import Identity
 from core.models.profile import UserProfile
 
+from service.cache import get_cached_instance_states
 from service.deploy import inject_env_script, check_process, wrap_script, echo_test_script,\
     deploy_to as ansible_deploy_to
 from service.driver import get_driver, get_account_driver
 from service.exceptions import AnsibleDeployException
 from service.instance import _update_instance_metadata
 from service.networking import _generate_ssh_kwargs
+from service.state_watcher import instance_state_watcher_enabled,\
+    wait_for_instance_state, is_status_ready
 
 
 def _update_status_log(instance, status_update):
@@ -83,7 +88,7 @@ def complete_resize(driverCls, provider, identity, instance_alias,
         complete_resize.retry(exc=exc)
 
 
-@task(name="wait_for_instance", max_retries=250, default_retry_delay=15)
+@task(name="wait_for_instance", max_retries=64, default_retry_delay=15)
 def wait_for_instance(
         instance_alias,
         driverCls,
@@ -94,8 +99,9 @@ def wait_for_instance(
         return_id=False,
         **task_kwargs):
     """
-    #Task makes 250 attempts to 'look at' the instance, waiting 15sec each try
-    Cumulative time == 1 hour 2 minutes 30 seconds before FAILURE
+    #Task makes 64 attempts to 'look at' the instance, waiting longer after
+    each try (See INSTANCE_POLL_MIN_DELAY, INSTANCE_POLL_MAX_DELAY)
+    Cumulative time ~= 1 hour 1 minute before FAILURE
 
     status_query = "active" Match only one value, active
     status_query = ["active","suspended"] or match multiple values.
@@ -109,6 +115,12 @@ def wait_for_instance(
                                     instance_alias, status_query,
                                     tasks_allowed, return_id), {})
 
+        # Only the first attempt blocks on the state watcher, later
+        # attempts are spaced out by the retry countdown instead.
+        if instance_state_watcher_enabled() and \
+                not wait_for_instance.request.retries:
+            _wait_for_instance_state(instance_alias, status_query,
+                                     tasks_allowed)
         result = _is_instance_ready(driverCls, provider, identity,
                                     instance_alias, status_query,
                                     tasks_allowed, return_id)
@@ -118,7 +130,30 @@ def wait_for_instance(
             # Ignore 'normal' errors.
             celery_logger.exception(exc)
 
-        wait_for_instance.retry(exc=exc)
+        wait_for_instance.retry(
+            exc=exc,
+            countdown=_get_poll_countdown(current.request.retries, exc))
+
+
+def _is_rate_limited(exc):
+    # Nova responds with '413 overLimit' when we are rate-limited
+    return isinstance(exc, RateLimitReachedError) or \
+        "overlimit" in str(exc).lower()
+
+
+def _get_poll_countdown(retries, exc=None):
+    """
+    Back off from INSTANCE_POLL_MIN_DELAY to INSTANCE_POLL_MAX_DELAY.
+    Jitter keeps instances that were launched together from being
+    checked together.
+    """
+    max_delay = settings.INSTANCE_POLL_MAX_DELAY
+    if exc and _is_rate_limited(exc):
+        delay = max(max_delay, getattr(exc, 'retry_after', 0))
+    else:
+        delay = min(max_delay,
+                    settings.INSTANCE_POLL_MIN_DELAY * 2 ** retries)
+    return delay + random.uniform(0, delay * 0.2)
 
 
 def _eager_override(task_class, run_method, args, kwargs):
@@ -136,28 +171,53 @@ def _eager_override(task_class, run_method, args, kwargs):
     return None
 
 
+def _wait_for_instance_state(instance_alias, status_query,
+                             tasks_allowed=False):
+    """
+    Wait for the state watcher to see the instance in 'status_query'.
+    Returns False if it never shows up, the caller should still ask the
+    cloud ('_is_instance_ready') as an event may have been missed.
+    """
+    def is_ready(state):
+        return state and (
+            state['status'] == 'deleted' or
+            is_status_ready(state, status_query, tasks_allowed))
+
+    if wait_for_instance_state(instance_alias, is_ready):
+        return True
+    celery_logger.debug("Instance: %s - Not seen ready by the state watcher"
+                        % instance_alias)
+    return False
+
+
 def _is_instance_ready(driverCls, provider, identity,
                        instance_alias, status_query,
                        tasks_allowed=False, return_id=False):
     # TODO: Refactor so that terminal states can be found. IE if waiting for
     # 'active' and in status: Suspended - none - GIVE up!!
     driver = get_driver(driverCls, provider, identity)
-    instance = driver.get_instance(instance_alias)
-    if not instance:
-        celery_logger.debug("Instance has been terminated: %s." % instance_alias)
-        if return_id:
-            return None
-        return False
-    i_status = instance._node.extra['status'].lower()
-    i_task = instance._node.extra['task']
+    instance_states = get_cached_instance_states(driver)
+    if instance_alias in instance_states:
+        i_status, i_task = instance_states[instance_alias]
+    else:
+        # Not listed in this tick (Ex: Launched after the list was made)
+        instance = driver.get_instance(instance_alias)
+        if not instance:
+            celery_logger.debug("Instance has been terminated: %s."
+                                % instance_alias)
+            if return_id:
+                return None
+            return False
+        i_status = instance._node.extra['status'].lower()
+        i_task = instance._node.extra['task']
     if (i_status not in status_query) or (i_task and not tasks_allowed):
         raise Exception(
             "Instance: %s: Status: (%s - %s) - Not Ready"
-            % (instance.id, i_status, i_task))
+            % (instance_alias, i_status, i_task))
     celery_logger.debug("Instance %s: Status: (%s - %s) - Ready"
-                 % (instance.id, i_status, i_task))
+                 % (instance_alias, i_status, i_task))
     if return_id:
-        return instance.id
+        return instance_alias
     return True
 
 
@@ -972,6 +1032,12 @@ def deploy_ready_test(driverCls, provider, identity, instance_id,
         "deploy_ready_test task %s/%s started at %s." %
         (current_count, total, datetime.now()))
     try:
+        if instance_state_watcher_enabled():
+            # SSH won't succeed until the instance is active.
+            wait_for_instance_state(
+                instance_id,
+                lambda state: state and state['status'] in ['active',
+                                                            'deleted'])
         # Sanity checks -- get your ducks in a row.
         driver = get_driver(driverCls, provider, identity)
         instance = driver.get_instance(instance_id)
@@ -1161,6 +1227,11 @@ def update_metadata(driverCls, provider, identity, instance_alias, metadata,
     """
     try:
         celery_logger.debug("update_metadata task started at %s." % datetime.now())
+        if instance_state_watcher_enabled():
+            # Metadata can't be set while the instance is building.
+            wait_for_instance_state(
+                instance_alias,
+                lambda state: state and state['status'] != 'build')
         driver = get_driver(driverCls, provider, identity)
         instance = driver.get_instance(instance_alias)
         if not instance:
@@ -1397,8 +1468,7 @@ def update_membership_for(provider_uuid):
         #if not img.is_public:
         if img.get('visibility','') is not 'public':
             # Lookup members
-            image_members = acct_driver.image_manager.shared_images_for(
-                image_id=img.id)
+            image_members = acct_driver.list_image_members(img.id)
             # add machine to each member
             #(Who owns the cred:ex_project_name) in MachineMembership
             # for member in image_members:
@@ -1,17 +1,22 @@
 from datetime import timedelta
+import time
 
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Q, Count
+from django.db.models import Q
 
 from celery.decorators import task
 
+from core.model_versions import bump_model_versions
 from core.query import (
     only_current, only_current_source,
-    source_in_range, inactive_versions)
-from core.models.size import Size, convert_esh_size
-from core.models.instance import convert_esh_instance
+    source_in_range)
+from core.models.size import Size, convert_esh_sizes, _clear_synced_sizes
+from core.models.instance import convert_esh_instances
 from core.models.provider import Provider
-from core.models.machine import get_or_create_provider_machine, ProviderMachine
+from core.models.quota_usage import batch_quota_usage
+from core.models.machine import get_or_create_provider_machine, ProviderMachine, machine_cache
 from core.models.application import Application, ApplicationMembership
 from core.models.application_version import ApplicationVersion
 from core.models import Allocation, Credential
@@ -20,7 +25,10 @@ from service.monitoring import (
     _cleanup_missing_instances,
     _get_instance_owner_map,
     _get_identity_from_tenant_name)
-from service.monitoring import user_over_allocation_enforcement
+from service.concurrency import map_concurrently
+from service.monitoring import (
+    get_allocation_results_for,
+    user_over_allocation_enforcement)
 from service.driver import get_account_driver
 from service.cache import get_cached_driver
 from glanceclient.exc import HTTPNotFound
@@ -64,8 +72,7 @@ def tenant_id_to_name_map(account_driver):
     Get a list of projects
     OUTPUT: A dictionary with keys of ID and values of name
     """
-    all_projects = account_driver.list_projects()
-    return {tenant.id: tenant.name for tenant in all_projects}
+    return account_driver.get_tenant_directory().id_to_name_map()
 
 
 @task(name="monitor_machines")
@@ -114,6 +121,13 @@ def prune_machines_for(
         db_machines = ProviderMachine.objects.filter(
             only_current_source(), instance_source__provider=provider)
         cloud_machines = account_driver.list_all_images()
+        # The (cached) list may not hold the newest images yet.
+        # Confirm with the cloud before anything is end-dated.
+        cloud_machine_ids = set(mach.id for mach in cloud_machines)
+        if any(identifier not in cloud_machine_ids for identifier in
+               db_machines.values_list(
+                   'instance_source__identifier', flat=True)):
+            cloud_machines = account_driver.list_all_images(force=True)
     else:
         db_machines = ProviderMachine.objects.filter(
                 source_in_range(),  # like 'only_current..' w/o active_provider
@@ -124,28 +138,34 @@ def prune_machines_for(
     if not cloud_machines and not forced_removal:
         return
 
-    # Loop 1 - End-date All machines in the DB that
-    # can NOT be found in the cloud.
-    mach_count = _end_date_missing_database_machines(
-        db_machines, cloud_machines, now=now, dry_run=dry_run)
-
-    # Loop 2 and 3 - Capture all (still-active) versions without machines,
-    # and all applications without versions.
-    # These are 'outliers' and mainly here for safety-check purposes.
-    ver_count = _remove_versions_without_machines(now=now)
-    app_count = _remove_applications_without_versions(now=now)
-
-    # Loop 4 - All 'Application' DB objects require
-    # >=1 Version with >=1 ProviderMachine (ACTIVE!)
-    # Apps that don't meet this criteria should be end-dated.
-    app_count += _update_improperly_enddated_applications(now)
+    cloud_machine_ids = set(mach.id for mach in cloud_machines)
+    prune_plan = _plan_machine_prune(db_machines, cloud_machine_ids, now=now)
+    summary = {
+        'machines': len(prune_plan['machines']),
+        'versions': len(prune_plan['versions']),
+        'applications': len(prune_plan['applications']) +
+        len(prune_plan['improper_applications']),
+    }
+    celery_logger.info(
+        "%sEnd dating machines: %s" % (
+            "DRY RUN - " if dry_run else "", prune_plan['identifiers']))
+    celery_logger.info(
+        "%sEnd dating versions: %s, applications: %s" % (
+            "DRY RUN - " if dry_run else "",
+            sorted(prune_plan['versions']),
+            sorted(prune_plan['applications'] |
+                   prune_plan['improper_applications'])))
+    if not dry_run:
+        _apply_machine_prune(prune_plan, now=now)
 
     celery_logger.info(
         "prune_machines completed for Provider %s : "
         "%s Applications, %s versions and %s machines pruned."
-        % (provider, app_count, ver_count, mach_count))
+        % (provider, summary['applications'], summary['versions'],
+           summary['machines']))
     if print_logs:
         celery_logger.removeHandler(consolehandler)
+    return summary
 
 @task(name="monitor_machines_for")
 def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
@@ -172,7 +192,8 @@ def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
         celery_logger.addHandler(consolehandler)
 
     #STEP 1: get the apps
-    new_public_apps, private_apps = get_public_and_private_apps(provider)
+    new_public_apps, private_apps, incomplete_app_ids = \
+        get_public_and_private_apps(provider)
 
     #STEP 2: Find conflicts and report them.
     intersection = set(private_apps.keys()) & set(new_public_apps)
@@ -182,7 +203,7 @@ def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
     #STEP 3: Apply the changes at app-level
     #Memoization at this high of a level will help save time
     account_drivers = {} # Provider -> accountDriver
-    provider_tenant_mapping = {}  # Provider -> [{TenantId : TenantName},...]
+    provider_tenant_mapping = {}  # Provider -> TenantDirectory
     image_maps = {}
     for app in new_public_apps:
         make_machines_public(app, account_drivers, dry_run=dry_run)
@@ -190,6 +211,11 @@ def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
     for app, membership in private_apps.items():
         make_machines_private(app, membership, account_drivers, provider_tenant_mapping, image_maps, dry_run=dry_run)
 
+    #STEP 4: Sync the membership of the private apps, all at once.
+    sync_application_memberships(
+        private_apps, provider, dry_run=dry_run,
+        incomplete_app_ids=incomplete_app_ids)
+
     if print_logs:
         celery_logger.removeHandler(consolehandler)
     return
@@ -197,17 +223,18 @@ def monitor_machines_for(provider_id, print_logs=False, dry_run=False):
 def get_public_and_private_apps(provider):
     """
     INPUT: Provider provider
-    OUTPUT: 2-tuple (
+    OUTPUT: 3-tuple (
             new_public_apps [],
-            private_apps(key) + super-set-membership(value) {})
+            private_apps(key) + super-set-membership(value) {},
+            ids of the private apps whose membership could not be listed
+            (for one or more images) set())
     """
     account_driver = get_account_driver(provider)
-    all_projects_map = tenant_id_to_name_map(account_driver)
+    tenant_directory = account_driver.get_tenant_directory()
     cloud_machines = account_driver.list_all_images()
 
-    db_machines = ProviderMachine.objects.filter(only_current_source(), instance_source__provider=provider)
     new_public_apps = []
-    private_apps = {}
+    private_images = {}  # Application -> [cloud_machine, ...]
     # ASSERT: All non-end-dated machines in the DB can be found in the cloud
     # if you do not believe this is the case, you should call 'prune_machines_for'
     for cloud_machine in cloud_machines:
@@ -226,54 +253,30 @@ def get_public_and_private_apps(provider):
             #Else the db app is public and no changes are necessary.
         else:
             # cloud machine is private
-            membership = get_shared_identities(account_driver, cloud_machine, all_projects_map)
-            all_members = private_apps.get(db_application, [])
-            all_members.extend(membership)
-            #Distinct list..
-            private_apps[db_application] = all_members
-    return new_public_apps, private_apps
-
-
-def remove_machine(db_machine, now_time=None, dry_run=False):
-    """
-    End date the DB ProviderMachine
-    If all PMs are end-dated, End date the ApplicationVersion
-    if all Versions are end-dated, End date the Application
-    """
-    if not now_time:
-        now_time = timezone.now()
-
-    db_machine.end_date = now_time
-    celery_logger.info("End dating machine: %s" % db_machine)
-    if not dry_run:
-        db_machine.save()
-
-    db_version = db_machine.application_version
-    if db_version.machines.filter(
-            # Look and see if all machines are end-dated.
-            Q(instance_source__end_date__isnull=True) |
-            Q(instance_source__end_date__gt=now_time)
-            ).count() != 0:
-        # Other machines exist.. No cascade necessary.
-        return True
-    # Version also completely end-dated. End date this version.
-    db_version.end_date = now_time
-    celery_logger.info("End dating version: %s" % db_version)
-    if not dry_run:
-        db_version.save()
-
-    db_application = db_version.application
-    if db_application.versions.filter(
-            # If all versions are end-dated
-            only_current(now_time)
-            ).count() != 0:
-        # Other versions exist.. No cascade necessary..
-        return True
-    db_application.end_date = now_time
-    celery_logger.info("End dating application: %s" % db_application)
-    if not dry_run:
-        db_application.save()
-    return True
+            private_images.setdefault(db_application, []).append(cloud_machine)
+
+    # Membership of every private image, then every identity, at once.
+    image_tenants = get_shared_tenant_names(
+        account_driver,
+        [cloud_machine.id for images in private_images.values()
+         for cloud_machine in images],
+        tenant_directory)
+    tenant_identities = get_identities_by_tenant_name(
+        set(tenant_name for tenant_names in image_tenants.values()
+            for tenant_name in tenant_names))
+    private_apps = {}
+    incomplete_app_ids = set()
+    for db_application, images in private_images.items():
+        all_members = set()
+        for cloud_machine in images:
+            if cloud_machine.id not in image_tenants:
+                incomplete_app_ids.add(db_application.id)
+                continue
+            for tenant_name in image_tenants[cloud_machine.id]:
+                all_members.update(tenant_identities.get(tenant_name, []))
+        private_apps[db_application] = sorted(
+            all_members, key=lambda identity: identity.id)
+    return new_public_apps, private_apps, incomplete_app_ids
 
 
 def make_machines_private(application, identities, account_drivers={}, provider_tenant_mapping={}, image_maps={}, dry_run=False):
@@ -287,15 +290,14 @@ def make_machines_private(application, identities, account_drivers={}, provider_
             # For each *active* machine in app/version..
             # Loop over each identity and check the list of 'current tenants' as viewed by keystone.
             account_driver = memoized_driver(machine, account_drivers)
-            tenant_name_mapping = memoized_tenant_name_map(account_driver, provider_tenant_mapping)
+            tenant_directory = memoized_tenant_directory(account_driver, provider_tenant_mapping)
             current_tenants = get_current_members(
-                    account_driver, machine, tenant_name_mapping)
+                    account_driver, machine, tenant_directory)
             provider = machine.instance_source.provider
             cloud_machine = memoized_image(account_driver, machine, image_maps)
             for identity in identities:
                 if identity.provider == provider:
                     _share_image(account_driver, cloud_machine, identity, current_tenants, dry_run=dry_run)
-                    add_application_membership(application, identity, dry_run=dry_run)
     # All the cloud work has been completed, so "lock down" the application.
     if application.private == False:
         application.private = True
@@ -325,69 +327,141 @@ def memoized_driver(machine, account_drivers={}):
         account_drivers[provider] = account_driver
     return account_driver
 
-def memoized_tenant_name_map(account_driver, tenant_list_maps={}):
-    tenant_id_name_map = tenant_list_maps.get(account_driver.core_provider)
-    if not tenant_id_name_map:
-        tenant_id_name_map = tenant_id_to_name_map(account_driver)
-        tenant_list_maps[account_driver.core_provider] = tenant_id_name_map
+def memoized_tenant_directory(account_driver, tenant_directories={}):
+    tenant_directory = tenant_directories.get(account_driver.core_provider)
+    if not tenant_directory:
+        tenant_directory = account_driver.get_tenant_directory()
+        tenant_directories[account_driver.core_provider] = tenant_directory
 
-    return tenant_id_name_map
+    return tenant_directory
 
-def get_current_members(account_driver, machine, tenant_id_name_map):
-    current_membership = account_driver.image_manager.shared_images_for(
-            image_id=machine.identifier)
+def get_current_members(account_driver, machine, tenant_directory):
+    current_membership = account_driver.list_image_members(machine.identifier)
 
     current_tenants = []
     for membership in current_membership:
         tenant_id = membership.member_id
-        tenant_name = tenant_id_name_map.get(tenant_id)
+        tenant_name = tenant_directory.get_name(tenant_id)
         if tenant_name:
             current_tenants.append(tenant_name)
     return current_tenants
 
-def add_application_membership(application, identity, dry_run=False):
-    for membership_obj in identity.identity_memberships.all():
-        # For every 'member' of this identity:
-        group = membership_obj.member
-        # Add an application membership if not already there
-        if application.applicationmembership_set.filter(group=group).count() == 0:
-            celery_logger.info("Added ApplicationMembership %s for %s" % (group.name, application.name))
-            if not dry_run:
-                ApplicationMembership.objects.create(application=application, group=group)
-        else:
-            #celery_logger.debug("SKIPPED _ Group %s already ApplicationMember for %s" % (group.name, application.name))
-            pass
+def sync_application_memberships(private_apps, provider, dry_run=False,
+                                 incomplete_app_ids=()):
+    """
+    INPUT: private_apps(key) + super-set-membership(value) {}, Provider
+    Give every group holding one of the identities on 'provider' an
+    ApplicationMembership, and remove the ApplicationMembership of groups
+    on 'provider' that no longer hold one.
+    NOTE: Memberships that 'can_edit', the creator's, and those of apps
+          with machines on other providers are never removed.
+          Neither are those of 'incomplete_app_ids', whose membership
+          could not be listed.
+    """
+    from core.models import IdentityMembership
+    if not private_apps:
+        return
+    # Tenant names are only unique on a provider
+    private_apps = dict(
+        (application, [identity for identity in identities
+                       if identity.provider_id == provider.id])
+        for (application, identities) in private_apps.items())
+    identity_ids = set(identity.id for identities in private_apps.values()
+                       for identity in identities)
+    identity_groups = {}
+    for (identity_id, group_id) in IdentityMembership.objects.filter(
+            identity__id__in=identity_ids).values_list('identity', 'member'):
+        identity_groups.setdefault(identity_id, set()).add(group_id)
+    provider_group_ids = set(IdentityMembership.objects.filter(
+        identity__provider=provider).values_list('member', flat=True))
+    applications = dict((app.id, app) for app in private_apps.keys())
+    replicated_app_ids = set(ProviderMachine.objects.filter(
+        only_current_source(),
+        application_version__application__id__in=applications.keys()).exclude(
+        instance_source__provider=provider).values_list(
+        'application_version__application', flat=True))
+    current = {}
+    for (membership_id, app_id, group_id, can_edit, group_name, creator) in\
+            ApplicationMembership.objects.filter(
+                application__id__in=applications.keys()).values_list(
+                'id', 'application', 'group', 'can_edit', 'group__name',
+                'application__created_by__username'):
+        is_kept = can_edit or group_name == creator or app_id in replicated_app_ids\
+            or app_id in incomplete_app_ids
+        current[(app_id, group_id)] = (membership_id, is_kept)
+
+    new_memberships = []
+    for application, identities in private_apps.items():
+        desired_groups = set()
+        for identity in identities:
+            desired_groups.update(identity_groups.get(identity.id, []))
+        for group_id in desired_groups:
+            if (application.id, group_id) in current:
+                continue
+            celery_logger.info("Added ApplicationMembership %s for %s" % (group_id, application.name))
+            new_memberships.append(ApplicationMembership(application=application, group_id=group_id))
+    stale_ids = []
+    for (app_id, group_id), (membership_id, is_kept) in current.items():
+        if is_kept or group_id not in provider_group_ids:
+            continue
+        if any(group_id in identity_groups.get(identity.id, [])
+               for identity in private_apps[applications[app_id]]):
+            continue
+        celery_logger.info("Removed ApplicationMembership %s for %s" % (group_id, applications[app_id].name))
+        stale_ids.append(membership_id)
+    if dry_run:
+        return
+    if new_memberships:
+        ApplicationMembership.objects.bulk_create(new_memberships)
+        bump_model_versions(ApplicationMembership)
+    if stale_ids:
+        ApplicationMembership.objects.filter(id__in=stale_ids).delete()
+
+def get_shared_tenant_names(account_driver, image_ids, tenant_directory):
+    """
+    INPUT: AccountDriver, image ids (private), TenantDirectory of the provider
+    OUTPUT: image id(key) + tenant names the image is shared with(value) {}
+    NOTE: Image members are listed concurrently, images that fail are skipped.
+    """
+    calls = [(account_driver.list_image_members, image_id) for image_id in image_ids]
+    outcomes = map_concurrently(calls, settings.MONITOR_MACHINES_CONCURRENCY)
+    image_tenants = {}
+    for image_id, (cloud_membership, exc_info) in zip(image_ids, outcomes):
+        if exc_info:
+            celery_logger.error("Could not list members of image %s: %s" % (image_id, exc_info[1]))
+            continue
+        tenant_names = []
+        for cloud_machine_membership in cloud_membership:
+            tenant_id = cloud_machine_membership.member_id
+            tenant_name = tenant_directory.get_name(tenant_id)
+            if not tenant_name:
+                celery_logger.warn("TENANT ID: %s NOT FOUND - %s" % (tenant_id, cloud_machine_membership))
+                continue
+            tenant_names.append(tenant_name)
+        image_tenants[image_id] = tenant_names
+    return image_tenants
 
-def get_shared_identities(account_driver, cloud_machine, tenant_id_name_map):
+def get_identities_by_tenant_name(tenant_names):
     """
-    INPUT: Provider, Cloud Machine (private), mapping of tenant_id to tenant_name
-    OUTPUT: List of identities that *include* the 'tenant name' credential matched to 'a shared user' in openstack.
+    INPUT: tenant names
+    OUTPUT: tenant name(key) + identities that *include* the 'tenant name' credential(value) {}
     """
     from core.models import Identity
-    cloud_membership = account_driver.image_manager.shared_images_for(
-        image_id=cloud_machine.id)
-    # NOTE: the START type of 'all_identities' is list (in case no ValueListQuerySet is ever found)
-    all_identities = []
-    for cloud_machine_membership in cloud_membership:
-        tenant_id = cloud_machine_membership.member_id
-        tenant_name = tenant_id_name_map.get(tenant_id)
-        if not tenant_name:
-            celery_logger.warn("TENANT ID: %s NOT FOUND - %s" % (tenant_id, cloud_machine_membership))
-            continue
-        # Find matching 'tenantName' credential and add all matching identities w/ that tenantName.
-        matching_creds = Credential.objects.filter(
-                key='ex_tenant_name',  # TODO: ex_project_name on next OStack update.
-                value=tenant_name,
-                # NOTE: re-add this line when not replicating clouds!
-                #identity__provider=account_driver.core_provider)
-                )
-        identity_ids = matching_creds.values_list('identity', flat=True)
-        if not all_identities:
-            all_identities = identity_ids
-        else:
-            all_identities = all_identities | identity_ids
-    identity_list = Identity.objects.filter(id__in=all_identities)
-    return identity_list
+    # Find matching 'tenantName' credentials (For every tenant at once)
+    tenant_identity_ids = {}
+    for (tenant_name, identity_id) in Credential.objects.filter(
+            key='ex_tenant_name',  # TODO: ex_project_name on next OStack update.
+            value__in=tenant_names,
+            # NOTE: re-add this line when not replicating clouds!
+            #identity__provider=account_driver.core_provider)
+            ).values_list('value', 'identity'):
+        tenant_identity_ids.setdefault(tenant_name, []).append(identity_id)
+    identities = Identity.objects.select_related('provider').in_bulk(
+        [identity_id for identity_ids in tenant_identity_ids.values()
+         for identity_id in identity_ids])
+    return dict(
+        (tenant_name, [identities[identity_id] for identity_id in identity_ids])
+        for (tenant_name, identity_ids) in tenant_identity_ids.items())
 
 def update_membership(application, shared_identities):
     """
@@ -471,44 +545,116 @@ def monitor_instances_for(provider_id, users=None,
         consolehandler.setLevel(logging.DEBUG)
         celery_logger.addHandler(consolehandler)
 
-    # DEVNOTE: Potential slowdown running multiple functions
-    # Break this out when instance-caching is enabled
-    running_total = 0
-    for username in sorted(instance_map.keys()):
-        running_instances = instance_map[username]
-        running_total += len(running_instances)
-        identity = _get_identity_from_tenant_name(provider, username)
-        if identity and running_instances:
-            try:
-                driver = get_cached_driver(identity=identity)
-                core_running_instances = [
-                    convert_esh_instance(
-                        driver,
-                        inst,
-                        identity.provider.uuid,
-                        identity.uuid,
-                        identity.created_by) for inst in running_instances]
-            except Exception as exc:
-                celery_logger.exception(
-                    "Could not convert running instances for %s" %
-                    username)
-                continue
-        else:
-            # No running instances.
-            core_running_instances = []
-        # Using the 'known' list of running instances, cleanup the DB
-        core_instances = _cleanup_missing_instances(
-            identity,
-            core_running_instances)
-        if check_allocations:
-            allocation_result = user_over_allocation_enforcement(
-                provider, username,
-                print_logs, start_date, end_date)
+    running_total = sum(
+        len(running_instances) for running_instances in instance_map.values())
+    # One slow tenant should not stall the rest of the provider
+    monitored_usernames = _monitor_users_for(
+        provider, instance_map, settings.MONITOR_INSTANCES_CONCURRENCY)
+    if check_allocations:
+        # With the DB cleaned up, run every user through the engine at once
+        allocation_results = get_allocation_results_for(
+            provider, monitored_usernames,
+            print_logs, start_date, end_date)
+        # Each user is enforced on their own, so shard them like the sweep
+        _enforce_allocations_for(
+            provider, monitored_usernames, allocation_results,
+            settings.MONITOR_INSTANCES_CONCURRENCY,
+            print_logs, start_date, end_date)
     if print_logs:
         celery_logger.removeHandler(consolehandler)
     return running_total
 
 
+def _monitor_users_for(provider, instance_map, concurrency=1):
+    """
+    Run '_monitor_user_instances' for every username in 'instance_map',
+    using up to 'concurrency' threads.
+    A failure while monitoring one user is logged and does NOT stop the rest.
+    Returns a (sorted) list of the usernames that were monitored.
+    """
+    usernames = sorted(instance_map.keys())
+    outcomes = map_concurrently(
+        [(_monitor_user_instances, provider, username, instance_map[username])
+         for username in usernames],
+        concurrency)
+    monitored_usernames = []
+    for (username, (monitored, exc_info)) in zip(usernames, outcomes):
+        if exc_info:
+            celery_logger.error(
+                "Could not monitor instances for %s" % username,
+                exc_info=exc_info)
+        elif monitored:
+            monitored_usernames.append(username)
+    return monitored_usernames
+
+
+def _enforce_allocations_for(provider, usernames, allocation_results,
+                             concurrency=1, print_logs=False,
+                             start_date=None, end_date=None):
+    """
+    Run 'user_over_allocation_enforcement' for every username,
+    using up to 'concurrency' threads.
+    Every user shares one wait for their instances to settle,
+    so a sweep waits (at most) OVER_ALLOCATION_WAIT_TIMEOUT once.
+    The users split OVER_ALLOCATION_ACTION_CONCURRENCY between them
+    (at least one each), so a sweep acts on about that many instances
+    at once.
+    A failure while enforcing one user is logged and does NOT stop the rest.
+    """
+    wait_until = time.time() + settings.OVER_ALLOCATION_WAIT_TIMEOUT
+    concurrency = max(1, min(concurrency, len(usernames)))
+    action_concurrency = max(
+        1, settings.OVER_ALLOCATION_ACTION_CONCURRENCY // concurrency)
+    outcomes = map_concurrently(
+        [(user_over_allocation_enforcement, provider, username,
+          print_logs, start_date, end_date,
+          allocation_results.get(username), wait_until, action_concurrency)
+         for username in usernames],
+        concurrency)
+    for (username, (_, exc_info)) in zip(usernames, outcomes):
+        if exc_info:
+            celery_logger.error(
+                "Could not enforce allocation for %s" % username,
+                exc_info=exc_info)
+
+
+def _monitor_user_instances(provider, username, running_instances):
+    """
+    Using the 'known' list of running instances for 'username',
+    update and cleanup the DB.
+    Returns True if 'username' was monitored.
+    """
+    # Usage is recounted once, after the DB matches the cloud
+    with batch_quota_usage():
+        return _sync_user_instances(provider, username, running_instances)
+
+
+def _sync_user_instances(provider, username, running_instances):
+    identity = _get_identity_from_tenant_name(provider, username)
+    if identity and running_instances:
+        try:
+            driver = get_cached_driver(identity=identity)
+            core_running_instances = convert_esh_instances(
+                driver,
+                running_instances,
+                identity.provider.uuid,
+                identity.uuid,
+                identity.created_by)
+        except Exception as exc:
+            celery_logger.exception(
+                "Could not convert running instances for %s" %
+                username)
+            return False
+    else:
+        # No running instances.
+        core_running_instances = []
+    # Using the 'known' list of running instances, cleanup the DB
+    _cleanup_missing_instances(
+        identity,
+        core_running_instances)
+    return True
+
+
 @task(name="monitor_sizes")
 def monitor_sizes():
     """
@@ -537,20 +683,23 @@ def monitor_sizes_for(provider_id, print_logs=False):
 
     provider = Provider.objects.get(id=provider_id)
     admin_driver = get_admin_driver(provider)
-    # Non-End dated sizes on this provider
-    db_sizes = Size.objects.filter(only_current(), provider=provider)
     all_sizes = admin_driver.list_sizes()
-    seen_sizes = []
-    for cloud_size in all_sizes:
-        core_size = convert_esh_size(cloud_size, provider.uuid)
-        seen_sizes.append(core_size)
+    # Creates/Updates only the sizes that have changed on the cloud
+    seen_sizes = convert_esh_sizes(all_sizes, provider.uuid).values()
 
     now_time = timezone.now()
-    needs_end_date = [size for size in db_sizes if size not in seen_sizes]
+    # Non-End dated sizes on this provider
+    needs_end_date = list(
+        Size.objects.filter(only_current(), provider=provider).exclude(
+            id__in=[size.id for size in seen_sizes]))
     for size in needs_end_date:
         celery_logger.debug("End dating inactive size: %s" % size)
-        size.end_date = now_time
-        size.save()
+    if needs_end_date:
+        Size.objects.filter(
+            id__in=[size.id for size in needs_end_date]).update(
+            end_date=now_time)
+        bump_model_versions(Size)
+        _clear_synced_sizes(needs_end_date, provider.uuid)
 
     if print_logs:
         celery_logger.removeHandler(consolehandler)
@@ -594,60 +743,121 @@ def reset_provider_allocation(provider_id, default_allocation_id):
     return (users_reset, memberships_reset)
 
 
-def _end_date_missing_database_machines(db_machines, cloud_machines, now=None, dry_run=False):
-    if not now:
-        now = timezone.now()
-    mach_count = 0
-    cloud_machine_ids = [mach.id for mach in cloud_machines]
-    for machine in db_machines:
-        cloud_match = [mach for mach in cloud_machine_ids if mach == machine.identifier]
-        if not cloud_match:
-            remove_machine(machine, now, dry_run=dry_run)
-            mach_count += 1
-    return mach_count
-
-
-def _remove_versions_without_machines(now=None):
+def _plan_machine_prune(db_machines, cloud_machine_ids, now=None):
+    """
+    Compute everything that 'prune_machines_for' will end-date.
+    Returns a dict of sets of ids:
+    * machines (and their instance_sources) that can NOT be found in the cloud
+    * versions whose machines are all end-dated
+    * applications whose versions are all end-dated
+    Along with the 'outliers' found in the entire catalog:
+    * versions without machines, applications without versions
+    * end-dated applications that still hold an active version/machine
+    """
     if not now:
         now = timezone.now()
-    ver_count = 0
-    versions_without_machines = ApplicationVersion.objects.filter(
-        machines__isnull=True, end_date__isnull=True)
-    ver_count = _perform_end_date(versions_without_machines, now)
-    return ver_count
-
-
-def _remove_applications_without_versions(now=None):
+    machine_ids = set()
+    source_ids = set()
+    version_ids = set()
+    identifiers = []
+    # Machines missing from the cloud..
+    for (machine_id, source_id, identifier, version_id) in\
+            db_machines.values_list(
+                'id', 'instance_source', 'instance_source__identifier',
+                'application_version'):
+        if identifier in cloud_machine_ids:
+            continue
+        machine_ids.add(machine_id)
+        source_ids.add(source_id)
+        version_ids.add(version_id)
+        identifiers.append(identifier)
+    # ..their versions, unless another machine is still active..
+    version_ids -= set(ProviderMachine.objects.filter(
+        Q(instance_source__end_date__isnull=True) |
+        Q(instance_source__end_date__gt=now),
+        application_version__id__in=version_ids).exclude(
+        id__in=machine_ids).values_list('application_version', flat=True))
+    version_ids = set(ApplicationVersion.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=now),
+        id__in=version_ids).values_list('id', flat=True))
+    # ..and their applications, unless another version is still active.
+    app_ids = set(ApplicationVersion.objects.filter(
+        id__in=version_ids).values_list('application', flat=True))
+    app_ids -= set(ApplicationVersion.objects.filter(
+        only_current(now), application__id__in=app_ids).exclude(
+        id__in=version_ids).values_list('application', flat=True))
+    app_ids = set(Application.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=now),
+        id__in=app_ids).values_list('id', flat=True))
+
+    # Outliers: (Still-active) versions without machines,
+    # and applications without versions.
+    version_ids.update(ApplicationVersion.objects.filter(
+        machines__isnull=True, end_date__isnull=True).values_list(
+        'id', flat=True))
+    app_ids.update(Application.objects.filter(
+        versions__isnull=True, end_date__isnull=True).values_list(
+        'id', flat=True))
+
+    # All 'Application' DB objects require >=1 Version with
+    # >=1 ProviderMachine (ACTIVE!). End-date whatever is left active
+    # beneath an end-dated application.
+    improper_app_ids = set()
+    for (version_id, app_id) in ApplicationVersion.objects.filter(
+            Q(application__end_date__isnull=False) |
+            Q(application__id__in=app_ids),
+            end_date__isnull=True).exclude(
+            id__in=version_ids).values_list('id', 'application'):
+        version_ids.add(version_id)
+        improper_app_ids.add(app_id)
+    for (machine_id, source_id, identifier, app_id) in\
+            ProviderMachine.objects.filter(
+                Q(application_version__application__end_date__isnull=False) |
+                Q(application_version__application__id__in=app_ids),
+                instance_source__end_date__isnull=True).exclude(
+                id__in=machine_ids).values_list(
+                'id', 'instance_source', 'instance_source__identifier',
+                'application_version__application'):
+        machine_ids.add(machine_id)
+        source_ids.add(source_id)
+        identifiers.append(identifier)
+        improper_app_ids.add(app_id)
+    return {
+        'machines': machine_ids,
+        'sources': source_ids,
+        'identifiers': identifiers,
+        'versions': version_ids,
+        'applications': app_ids,
+        'improper_applications': improper_app_ids - app_ids,
+    }
+
+
+def _apply_machine_prune(prune_plan, now=None):
+    """
+    End-date everything in 'prune_plan' with one UPDATE per model.
+    """
+    from core.models import InstanceSource
+    from core.models.application_visibility import update_visibility
     if not now:
         now = timezone.now()
-    app_count = 0
-    apps_without_versions = Application.objects.filter(
-        versions__isnull=True, end_date__isnull=True)
-    app_count = _perform_end_date(apps_without_versions, now)
-    return app_count
+    with transaction.atomic():
+        InstanceSource.objects.filter(
+            id__in=prune_plan['sources']).update(end_date=now)
+        ApplicationVersion.objects.filter(
+            id__in=prune_plan['versions']).update(end_date=now)
+        Application.objects.filter(
+            id__in=prune_plan['applications']).update(end_date=now)
+    # Bulk updates skip the signals, catch-up on what they maintain.
+    machine_cache.invalidate(prune_plan['sources'])
+    update_visibility(
+        prune_plan['applications'] | prune_plan['improper_applications'] |
+        set(ApplicationVersion.objects.filter(
+            id__in=prune_plan['versions']).values_list(
+            'application', flat=True)))
+    bump_model_versions(
+        InstanceSource, ProviderMachine, ApplicationVersion, Application)
 
 
-def _update_improperly_enddated_applications(now=None):
-    if not now:
-        now = timezone.now()
-    improperly_enddated_apps = Application.objects.annotate(
-        num_versions=Count('versions'), num_machines=Count('versions__machines')
-    ).filter(
-        inactive_versions(),
-        # AND application has already been end-dated.
-        end_date__isnull=False
-    )
-    app_count = _perform_end_date(improperly_enddated_apps, now)
-    return app_count
-
-
-def _perform_end_date(queryset, end_dated_at):
-    count = 0
-    for model in queryset:
-        model.end_date_all(end_dated_at)
-        count += 1
-    return count
-
 def _share_image(account_driver, cloud_machine, identity, members, dry_run=False):
     """
     INPUT: use account_driver to share cloud_machine with identity (if not in 'members' list)
@@ -666,5 +876,5 @@ def _share_image(account_driver, cloud_machine, identity, members, dry_run=False
 
     celery_logger.info("Sharing image %s<%s>: %s with %s" % (cloud_machine.id, cloud_machine.name, identity.provider.location, tenant_name.value))
     if not dry_run:
-        account_driver.image_manager.share_image(cloud_machine, tenant_name.value)
+        account_driver.share_image(cloud_machine, tenant_name.value)
     return
@@ -0,0 +1,130 @@
+"""
+An in-memory stand-in for the few redis.StrictRedis calls made by service/*
+(There is no redis-server to test against)
+"""
+import threading
+import time
+
+import redis
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.blocking_timeouts = []
+        self.changed = threading.Condition()
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise redis.exceptions.TimeoutError("Timeout reading from socket")
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def mget(self, keys):
+        self._check()
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        self._check()
+        with self.changed:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            self.expires[key] = ex
+            return True
+
+    def delete(self, *keys):
+        self._check()
+        with self.changed:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def incr(self, key):
+        self._check()
+        with self.changed:
+            self.data[key] = str(int(self.data.get(key) or 0) + 1)
+            return int(self.data[key])
+
+    def expire(self, key, seconds):
+        self._check()
+        self.expires[key] = seconds
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete script is run by service/cache.py
+        self._check()
+        with self.changed:
+            if self.data.get(key) == token:
+                del self.data[key]
+                return 1
+            return 0
+
+    def hgetall(self, key):
+        self._check()
+        return dict(self.data.get(key, {}))
+
+    def hmset(self, key, mapping):
+        self._check()
+        with self.changed:
+            self.data.setdefault(key, {}).update(mapping)
+
+    def sadd(self, key, *values):
+        self._check()
+        with self.changed:
+            self.data.setdefault(key, set()).update(values)
+
+    def srem(self, key, *values):
+        self._check()
+        with self.changed:
+            self.data.get(key, set()).difference_update(values)
+
+    def smembers(self, key):
+        self._check()
+        return set(self.data.get(key, set()))
+
+    def lpush(self, key, *values):
+        self._check()
+        with self.changed:
+            for value in values:
+                self.data.setdefault(key, []).insert(0, value)
+            self.changed.notify_all()
+
+    def blpop(self, key, timeout=0):
+        self._check()
+        self.blocking_timeouts.append(timeout)
+        wait_until = time.time() + timeout
+        with self.changed:
+            while not self.data.get(key):
+                remaining = wait_until - time.time()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+            return (key, self.data[key].pop(0))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+
+    """
+    Queues up FakeRedis calls until 'execute'
+    """
+
+    def __init__(self, fake_redis):
+        self.fake_redis = fake_redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.fake_redis, name)
+        return lambda *args, **kwargs: self.commands.append(
+            (method, args, kwargs))
+
+    def execute(self):
+        self.fake_redis._check()
+        return [method(*args, **kwargs)
+                for (method, args, kwargs) in self.commands]
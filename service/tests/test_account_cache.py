@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.test import TestCase
+
+from service import cache
+from service.accounts.base import CacheDriver
+from service.tests.fake_redis import FakeRedis
+
+
+class FakeImage(object):
+
+    def __init__(self, identifier, name):
+        self.id = identifier
+        self.name = name
+
+
+class CountingRedis(FakeRedis):
+
+    def __init__(self):
+        super(CountingRedis, self).__init__()
+        self.reads = []
+
+    def get(self, key):
+        self.reads.append('get')
+        return super(CountingRedis, self).get(key)
+
+    def mget(self, keys):
+        self.reads.append('mget')
+        return super(CountingRedis, self).mget(keys)
+
+
+class CacheDriverTests(TestCase):
+
+    def setUp(self):
+        self.redis = CountingRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        self.cache_driver = CacheDriver('namespace')
+        self.images = [FakeImage('image-1', 'first'),
+                       FakeImage('image-2', 'second')]
+        self.cloud_calls = []
+
+    def tearDown(self):
+        cache.connection = self._connection
+
+    def _list_images(self):
+        self.cloud_calls.append('list')
+        return self.images
+
+    def _get_image(self, identifier):
+        self.cloud_calls.append(identifier)
+        return [image for image in self.images if image.id == identifier][0]
+
+    def _list(self, force=False):
+        return self.cache_driver.cache_resource_list(
+            'images', self._list_images,
+            to_cache=lambda image: (image.id, image.name),
+            from_cache=lambda data: FakeImage(*data), force=force)
+
+    def _get(self, identifier):
+        return self.cache_driver.cache_resource(
+            'images', identifier, self._get_image,
+            to_cache=lambda image: (image.id, image.name),
+            from_cache=lambda data: FakeImage(*data))
+
+    def test_list_is_read_with_one_mget(self):
+        self._list()
+        del self.redis.reads[:]
+        images = self._list()
+        self.assertEquals([(image.id, image.name) for image in images],
+                          [('image-1', 'first'), ('image-2', 'second')])
+        self.assertEquals(self.cloud_calls, ['list'])
+        self.assertEquals(self.redis.reads, ['get', 'mget'])
+        timeout = settings.ACCOUNT_CACHE_TIMEOUTS['images']
+        self.assertEquals(
+            self.redis.expires['account.namespace.images'], timeout)
+        self.assertEquals(
+            self.redis.expires['account.namespace.images.image-1'], timeout)
+
+    def test_listed_resources_are_cached(self):
+        self._list()
+        self.assertEquals(self._get('image-2').name, 'second')
+        self.assertEquals(self.cloud_calls, ['list'])
+
+    def test_expired_resource_is_a_list_miss(self):
+        self._list()
+        self.redis.delete('account.namespace.images.image-2')
+        self._list()
+        self.assertEquals(self.cloud_calls, ['list', 'list'])
+
+    def test_empty_list_is_cached(self):
+        self.images = []
+        self.assertEquals(self._list(), [])
+        self.assertEquals(self._list(), [])
+        self.assertEquals(self.cloud_calls, ['list'])
+
+    def test_invalidate_forgets_the_resource_and_list(self):
+        self._list()
+        self.cache_driver.invalidate('images', 'image-1')
+        self.assertEquals(self._get('image-1').name, 'first')
+        self.assertEquals(self._get('image-2').name, 'second')
+        self._list()
+        self.assertEquals(self.cloud_calls, ['list', 'image-1', 'list'])
+
+    def test_force_refreshes(self):
+        self._list()
+        self.images[0].name = 'renamed'
+        self.assertEquals(self._list(force=True)[0].name, 'renamed')
+        self.assertEquals(self._list()[0].name, 'renamed')
+        self.assertEquals(self.cloud_calls, ['list', 'list'])
+
+    def test_redis_errors_fall_back_to_the_cloud(self):
+        self.redis.down = True
+        self.assertEquals(len(self._list()), 2)
+        self.assertEquals(self._get('image-1').name, 'first')
+        self.cache_driver.invalidate('images')
+        self.assertEquals(len(self._list()), 2)
+        self.assertEquals(self.cloud_calls, ['list', 'image-1', 'list'])
@@ -0,0 +1,196 @@
+import threading
+
+from django.conf import settings
+from django.test import TestCase
+
+from service import cache
+from service.tests.fake_redis import FakeRedis
+
+
+class FakeIdentity(object):
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class CachedTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        self.refreshes = []
+
+    def tearDown(self):
+        cache.connection = self._connection
+
+    def _list(self):
+        self.refreshes.append(threading.current_thread().name)
+        return ['instance %s' % len(self.refreshes)]
+
+    def _get(self, force=False):
+        return cache._get_cached(
+            'instances.1', self._list, lambda data: None, force=force,
+            kind='instances')
+
+
+class CachedTimeoutTests(CachedTests):
+
+    def setUp(self):
+        super(CachedTimeoutTests, self).setUp()
+        self.fake_time = FakeTime()
+        self._time = cache.time
+        cache.time = self.fake_time
+
+    def tearDown(self):
+        cache.time = self._time
+        super(CachedTimeoutTests, self).tearDown()
+
+    def test_value_is_fresh_for_its_timeout(self):
+        timeout = settings.CLOUD_CACHE_TIMEOUTS['instances']
+        self.assertEquals(self._get(), ['instance 1'])
+        # Stale values are kept in redis, to be served while refreshed
+        self.assertEquals(self.redis.expires['instances.1'],
+                          timeout + settings.CLOUD_CACHE_STALE_TIMEOUT)
+        self.fake_time.now += timeout - 1
+        self.assertEquals(self._get(), ['instance 1'])
+        self.assertEquals(len(self.refreshes), 1)
+        self.fake_time.now += 2
+        self.assertEquals(self._get(), ['instance 2'])
+
+    def test_stale_value_is_served_while_it_is_refreshed(self):
+        self._get()
+        self.fake_time.now += settings.CLOUD_CACHE_TIMEOUTS['instances'] + 1
+        self.redis.set('instances.1.lock', 'another worker')
+        self.assertEquals(self._get(), ['instance 1'])
+        self.assertEquals(len(self.refreshes), 1)
+
+    def test_stale_instance_states_are_not_served(self):
+        def get_states():
+            return cache._get_cached(
+                'instance_states.1', self._list, lambda data: None,
+                kind='instance_states', allow_stale=False)
+
+        get_states()
+        self.fake_time.now += \
+            settings.CLOUD_CACHE_TIMEOUTS['instance_states'] + 1
+        self.redis.set('instance_states.1.lock', 'another worker')
+        self.assertEquals(get_states(), ['instance 2'])
+
+    def test_force_refreshes(self):
+        self._get()
+        self.assertEquals(self._get(force=True), ['instance 2'])
+
+    def test_unreadable_value_is_a_miss(self):
+        self.redis.set('instances.1', 'not a pickle')
+        self.assertEquals(self._get(), ['instance 1'])
+        self.assertEquals(self._get(), ['instance 1'])
+
+    def test_redis_errors_fall_back_to_the_cloud(self):
+        self.redis.down = True
+        self.assertEquals(self._get(), ['instance 1'])
+        self.assertEquals(self._get(), ['instance 2'])
+        self.assertTrue(cache.get_cache_stats()['instances.error'] >= 2)
+
+
+class CachedLockTests(CachedTests):
+
+    def test_only_one_worker_refreshes_a_missing_key(self):
+        refreshing = threading.Event()
+        finish = threading.Event()
+
+        def _slow_list():
+            refreshing.set()
+            finish.wait(5)
+            return self._list()
+
+        waiting = threading.Event()
+        real_time = cache.time
+
+        class WaitingTime(object):
+            time = staticmethod(real_time.time)
+
+            @staticmethod
+            def sleep(seconds):
+                # Called once the lock could NOT be acquired
+                waiting.set()
+                real_time.sleep(seconds)
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(
+            cache._get_cached('instances.1', _slow_list, lambda data: None,
+                              kind='instances')))
+        second = threading.Thread(target=lambda: results.append(self._get()))
+        cache.time = WaitingTime
+        try:
+            first.start()
+            refreshing.wait(5)
+            second.start()
+            self.assertTrue(waiting.wait(5))
+            finish.set()
+            first.join()
+            second.join()
+        finally:
+            cache.time = real_time
+        self.assertEquals(results, [['instance 1'], ['instance 1']])
+        self.assertEquals(len(self.refreshes), 1)
+        self.assertNotIn('instances.1.lock', self.redis.data)
+
+    def test_lock_taken_over_by_another_worker_is_kept(self):
+        token = cache._acquire_lock(self.redis, 'instances.1')
+        self.assertIsNone(cache._acquire_lock(self.redis, 'instances.1'))
+        # Our lock expired, and another worker acquired it.
+        self.redis.set('instances.1.lock', 'another token')
+        cache._release_lock(self.redis, 'instances.1', token)
+        self.assertEquals(self.redis.data['instances.1.lock'],
+                          'another token')
+        cache._release_lock(self.redis, 'instances.1', 'another token')
+        self.assertNotIn('instances.1.lock', self.redis.data)
+
+
+class ProvisionedStateTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        self.identity = FakeIdentity('identity-1')
+
+    def tearDown(self):
+        cache.connection = self._connection
+
+    def test_state_is_remembered_for_its_timeout(self):
+        self.assertEquals(cache.get_provisioned_state(self.identity), {})
+        cache.set_provisioned_state(self.identity, keypair=True)
+        cache.set_provisioned_state(self.identity, network=('net', 'subnet'))
+        self.assertEquals(cache.get_provisioned_state(self.identity),
+                          {'keypair': True, 'network': ('net', 'subnet')})
+        self.assertEquals(self.redis.expires['provisioned.identity-1'],
+                          settings.CLOUD_CACHE_TIMEOUTS['provisioned'])
+
+    def test_invalidate_forgets_every_identity(self):
+        other_identity = FakeIdentity('identity-2')
+        for identity in (self.identity, other_identity):
+            cache.set_provisioned_state(identity, keypair=True)
+        cache.invalidate_provisioned_state(self.identity, other_identity)
+        self.assertEquals(cache.get_provisioned_state(self.identity), {})
+        self.assertEquals(cache.get_provisioned_state(other_identity), {})
+
+    def test_redis_errors_forget_the_state(self):
+        cache.set_provisioned_state(self.identity, keypair=True)
+        self.redis.down = True
+        self.assertEquals(cache.get_provisioned_state(self.identity), {})
+        cache.set_provisioned_state(self.identity, keypair=True)
+        cache.invalidate_provisioned_state(self.identity)
@@ -0,0 +1,67 @@
+import threading
+
+from django.test import TestCase
+
+from service.concurrency import map_concurrently, run_concurrently
+
+
+class RunConcurrentlyTests(TestCase):
+
+    def setUp(self):
+        self.threads = []
+        self.all_started = threading.Event()
+
+    def _wait_for_others(self, expected, value):
+        """
+        Return 'value' once 'expected' calls have started,
+        so calls can only finish when they are run concurrently.
+        """
+        self.threads.append(threading.current_thread().ident)
+        if len(self.threads) == expected:
+            self.all_started.set()
+        self.assertTrue(self.all_started.wait(5))
+        return value
+
+    def _fail(self, message):
+        self._wait_for_others(3, None)
+        raise ValueError(message)
+
+    def test_results_are_in_order(self):
+        self.assertEquals(
+            run_concurrently(
+                (self._wait_for_others, 3, 'first'),
+                (self._wait_for_others, 3, 'second'),
+                (self._wait_for_others, 3, 'third')),
+            ['first', 'second', 'third'])
+        self.assertEquals(len(set(self.threads)), 3)
+
+    def test_first_failure_is_raised_after_every_call(self):
+        with self.assertRaisesRegexp(ValueError, 'first'):
+            run_concurrently(
+                (self._wait_for_others, 3, 'result'),
+                (self._fail, 'first'),
+                (self._fail, 'second'))
+        self.assertEquals(len(self.threads), 3)
+
+    def test_failures_are_returned_by_map(self):
+        outcomes = map_concurrently(
+            [(self._wait_for_others, 3, 'result'),
+             (self._fail, 'failed'),
+             (self._wait_for_others, 3, 'other result')], 3)
+        self.assertEquals(outcomes[0], ('result', None))
+        self.assertIsNone(outcomes[1][0])
+        self.assertIsInstance(outcomes[1][1][1], ValueError)
+        self.assertEquals(outcomes[2], ('other result', None))
+
+    def test_concurrency_limits_the_threads(self):
+        calls = [(self._wait_for_others, 2, index) for index in range(6)]
+        self.assertEquals(
+            [result for (result, _) in map_concurrently(calls, 2)],
+            range(6))
+        self.assertEquals(len(set(self.threads)), 2)
+
+    def test_single_call_runs_in_the_calling_thread(self):
+        self.assertEquals(
+            run_concurrently((self._wait_for_others, 1, 'result')),
+            ['result'])
+        self.assertEquals(self.threads, [threading.current_thread().ident])
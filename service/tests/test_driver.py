@@ -0,0 +1,141 @@
+import threading
+
+from django.test import TestCase
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models import Credential
+from service import driver as service_driver
+from service.driver import DriverPool, driver_pool, get_pooled_esh_driver,\
+    release_pooled_drivers
+
+
+class DriverPoolTests(TestCase):
+
+    def _release_in_thread(self, pool, key, driver):
+        thread = threading.Thread(target=lambda: (
+            pool.hold(key, driver), pool.release()))
+        thread.start()
+        thread.join()
+
+    def test_released_drivers_are_reused_by_other_threads(self):
+        pool = DriverPool(max_size=2, timeout=60)
+        self._release_in_thread(pool, (1, None, 'a'), 'driver 1')
+        self.assertEquals(pool.checkout((1, None, 'a')), 'driver 1')
+        # Checked out drivers are not handed to anyone else
+        checked_out = []
+        thread = threading.Thread(target=lambda: checked_out.append(
+            pool.checkout((1, None, 'a'))))
+        thread.start()
+        thread.join()
+        self.assertEquals(checked_out, [None])
+        # .. but the same thread keeps getting its driver
+        self.assertEquals(pool.checkout((1, None, 'a')), 'driver 1')
+
+    def test_least_recently_used_is_dropped(self):
+        pool = DriverPool(max_size=2, timeout=60)
+        for (identity_id, driver) in ((1, 'driver 1'), (2, 'driver 2'),
+                                      (3, 'driver 3')):
+            self._release_in_thread(pool, (identity_id, None, 'a'), driver)
+        self.assertIsNone(pool.checkout((1, None, 'a')))
+        self.assertEquals(pool.checkout((2, None, 'a')), 'driver 2')
+        self.assertEquals(pool.checkout((3, None, 'a')), 'driver 3')
+
+    def test_expired_drivers_are_dropped(self):
+        pool = DriverPool(max_size=2, timeout=-1)
+        pool.hold((1, None, 'a'), 'driver 1')
+        self.assertIsNone(pool.checkout((1, None, 'a')))
+        self._release_in_thread(pool, (1, None, 'a'), 'driver 1')
+        self.assertIsNone(pool.checkout((1, None, 'a')))
+
+    def test_new_credentials_replace_the_driver(self):
+        pool = DriverPool(max_size=2, timeout=60)
+        self._release_in_thread(pool, (1, None, 'old'), 'old driver')
+        # Another thread still holds a driver built with the old credentials
+        holding = threading.Event()
+        release = threading.Event()
+
+        def _hold_old_driver():
+            pool.hold((1, None, 'old'), 'held old driver')
+            holding.set()
+            release.wait(5)
+            pool.release()
+
+        thread = threading.Thread(target=_hold_old_driver)
+        thread.start()
+        holding.wait(5)
+        self._release_in_thread(pool, (1, None, 'new'), 'new driver')
+        release.set()
+        thread.join()
+        self.assertEquals(pool._idle.keys(), [(1, None, 'new')])
+        self.assertEquals(pool.checkout((1, None, 'new')), 'new driver')
+
+    def test_invalidate_drops_checked_out_drivers(self):
+        pool = DriverPool(max_size=2, timeout=60)
+        pool.hold((1, None, 'a'), 'driver 1')
+        pool.invalidate([1])
+        self.assertIsNone(pool.checkout((1, None, 'a')))
+        pool.release()
+        self.assertIsNone(pool.checkout((1, None, 'a')))
+
+
+class PooledDriverTests(TestCase):
+
+    def setUp(self):
+        self.identity = IdentityFactory.create(
+            provider=ProviderFactory.create(),
+            created_by=UserFactory.create())
+        self.built = []
+        self._get_esh_driver = service_driver.get_esh_driver
+        service_driver.get_esh_driver = self._fake_get_esh_driver
+        driver_pool.invalidate()
+
+    def tearDown(self):
+        service_driver.get_esh_driver = self._get_esh_driver
+        release_pooled_drivers()
+        driver_pool.invalidate()
+
+    def _fake_get_esh_driver(self, core_identity, username=None, **kwargs):
+        driver = object()
+        self.built.append(driver)
+        return driver
+
+    def test_driver_is_reused_by_the_same_thread(self):
+        driver = get_pooled_esh_driver(self.identity)
+        self.assertIs(get_pooled_esh_driver(self.identity), driver)
+        self.assertEquals(len(self.built), 1)
+
+    def test_threads_do_not_share_drivers(self):
+        # The test database can not be reached from other threads
+        fingerprint = service_driver._get_credentials_fingerprint
+        service_driver._get_credentials_fingerprint = lambda identity: 'a'
+        try:
+            driver = get_pooled_esh_driver(self.identity)
+            thread_drivers = []
+
+            def _get_and_release():
+                thread_drivers.append(get_pooled_esh_driver(self.identity))
+                release_pooled_drivers()
+
+            thread = threading.Thread(target=_get_and_release)
+            thread.start()
+            thread.join()
+            self.assertIsNot(thread_drivers[0], driver)
+            self.assertIs(get_pooled_esh_driver(self.identity), driver)
+            # Once this thread is done, its driver is re-used too.
+            release_pooled_drivers()
+            thread_drivers = []
+            thread = threading.Thread(target=_get_and_release)
+            thread.start()
+            thread.join()
+            self.assertIn(thread_drivers[0], self.built)
+            self.assertEquals(len(self.built), 2)
+        finally:
+            service_driver._get_credentials_fingerprint = fingerprint
+
+    def test_changed_credentials_drop_the_driver(self):
+        driver = get_pooled_esh_driver(self.identity)
+        Credential.objects.create(
+            key='key', value='value', identity=self.identity)
+        self.assertEquals(len(driver_pool._idle), 0)
+        self.assertIsNot(get_pooled_esh_driver(self.identity), driver)
@@ -0,0 +1,51 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from libcloud.common.exceptions import RateLimitReachedError
+
+from service.tasks import driver as driver_tasks
+
+
+@override_settings(INSTANCE_POLL_MIN_DELAY=5, INSTANCE_POLL_MAX_DELAY=60)
+class PollCountdownTests(TestCase):
+
+    def _assertJittered(self, countdown, delay):
+        self.assertTrue(delay <= countdown <= delay * 1.2,
+                        "%s is not within 20%% of %s" % (countdown, delay))
+
+    def test_delay_doubles_up_to_the_max(self):
+        for (retries, delay) in [(0, 5), (1, 10), (2, 20), (3, 40),
+                                 (4, 60), (30, 60)]:
+            self._assertJittered(
+                driver_tasks._get_poll_countdown(retries), delay)
+
+    def test_not_ready_is_not_rate_limited(self):
+        self._assertJittered(
+            driver_tasks._get_poll_countdown(
+                0, Exception("Instance: 1: Status: (build) - Not Ready")),
+            5)
+
+    def test_rate_limited_jumps_to_the_max(self):
+        self._assertJittered(
+            driver_tasks._get_poll_countdown(
+                0, Exception("413 overLimit: Too many requests")),
+            60)
+
+    def test_rate_limited_waits_for_retry_after(self):
+        self._assertJittered(
+            driver_tasks._get_poll_countdown(
+                0, RateLimitReachedError(retry_after=90)),
+            90)
+
+
+class IsRateLimitedTests(TestCase):
+
+    def test_rate_limited_errors(self):
+        self.assertTrue(driver_tasks._is_rate_limited(
+            RateLimitReachedError()))
+        self.assertTrue(driver_tasks._is_rate_limited(
+            Exception("413 OverLimit: This request was rate-limited.")))
+
+    def test_other_errors(self):
+        self.assertFalse(driver_tasks._is_rate_limited(
+            Exception("Instance: 1 - Not Ready")))
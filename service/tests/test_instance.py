@@ -0,0 +1,212 @@
+import tempfile
+import threading
+
+from django.test import TestCase
+
+from service import cache
+from service import instance as instance_service
+from service.cache import invalidate_provisioned_state
+from service.exceptions import InstanceDoesNotExist
+from service.tests.fake_redis import FakeRedis
+
+
+class FakeProvider(object):
+
+    def get_credentials(self):
+        return {'router_name': 'router'}
+
+
+class FakeIdentity(object):
+    # Threads can not see the test database
+
+    def __init__(self):
+        self.uuid = 'identity-1'
+        self.provider = FakeProvider()
+
+    def get_credentials(self):
+        return {'key': 'user', 'secret': 'password',
+                'ex_tenant_name': 'project'}
+
+
+class FakeAccountDriver(object):
+    MASTER_RULES_LIST = []
+    admin_driver = 'admin driver'
+
+    def __init__(self, calls, provider):
+        self.calls = calls
+
+    def _call(self, name):
+        self.calls.append((name, self, threading.current_thread().ident))
+
+    def init_security_group(self, *args):
+        self._call('security_group')
+        return 'security group'
+
+    def get_or_create_keypair(self, *args):
+        self._call('keypair')
+        return ('keypair', True)
+
+    def create_network(self, core_identity):
+        self._call('network')
+        return ({'id': 'network-1', 'name': 'project-net'},
+                {'cidr': '10.0.0.0/24'})
+
+
+class ProvisionOpenstackInstanceTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.calls = []
+        self.identity = FakeIdentity()
+        self.keypair_file = tempfile.NamedTemporaryFile()
+        self._patched = {
+            'OSAccountDriver': instance_service.OSAccountDriver,
+            'get_cached_driver': instance_service.get_cached_driver,
+        }
+        self._connection = cache.connection
+        self._keypair_file = instance_service.settings.ATMOSPHERE_KEYPAIR_FILE
+        cache.connection = self.redis
+        instance_service.OSAccountDriver = \
+            lambda provider: FakeAccountDriver(self.calls, provider)
+        instance_service.get_cached_driver = \
+            lambda provider=None, identity=None: 'admin driver'
+        instance_service.settings.ATMOSPHERE_KEYPAIR_FILE = \
+            self.keypair_file.name
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(instance_service, name, method)
+        cache.connection = self._connection
+        instance_service.settings.ATMOSPHERE_KEYPAIR_FILE = self._keypair_file
+        self.keypair_file.close()
+
+    def _provision(self, admin_user=False):
+        return instance_service._provision_openstack_instance(
+            self.identity, admin_user=admin_user)
+
+    def test_steps_share_one_account_driver(self):
+        network = self._provision()
+        self.assertEquals(network.id, 'network-1')
+        self.assertEquals(network.driver, 'admin driver')
+        self.assertEquals(
+            [name for (name, _, _) in self.calls],
+            ['security_group', 'network', 'keypair'])
+        self.assertEquals(len(set(driver for (_, driver, _) in self.calls)),
+                          1)
+
+    def test_provisioned_steps_are_skipped(self):
+        self._provision()
+        del self.calls[:]
+        network = self._provision()
+        self.assertEquals(self.calls, [])
+        self.assertEquals(network.id, 'network-1')
+
+    def test_admin_users_have_no_security_group(self):
+        self._provision(admin_user=True)
+        self.assertEquals(
+            sorted(name for (name, _, _) in self.calls),
+            ['keypair', 'network'])
+
+    def test_invalidated_state_is_provisioned_again(self):
+        self._provision()
+        invalidate_provisioned_state(self.identity)
+        del self.calls[:]
+        self._provision()
+        self.assertEquals(len(self.calls), 3)
+
+    def test_redis_errors_provision_every_step(self):
+        self.redis.down = True
+        self._provision()
+        self._provision()
+        self.assertEquals(len(self.calls), 6)
+
+
+class FakeInstance(object):
+
+    def __init__(self, alias):
+        self.id = alias
+
+
+class FakeDriver(object):
+
+    def __init__(self, identity, instance_ids):
+        self.identity = identity
+        self.thread = threading.current_thread().ident
+        self.instance_ids = instance_ids
+        self.list_count = 0
+
+    def list_instances(self):
+        if not self.instance_ids:
+            raise Exception("Cloud is down")
+        self.list_count += 1
+        return [FakeInstance(alias) for alias in self.instance_ids]
+
+
+class RunInstanceActionsTests(TestCase):
+
+    def setUp(self):
+        self.identities = [FakeIdentity() for _ in range(2)]
+        for (index, identity) in enumerate(self.identities):
+            identity.id = index
+        self.instance_ids = {0: ['instance-1', 'instance-2'],
+                             1: ['instance-3']}
+        self.drivers = []
+        self.actions = []
+        self._patched = {
+            'get_cached_driver': instance_service.get_cached_driver,
+            '_run_instance_action': instance_service._run_instance_action,
+            'destroy_instance': instance_service.destroy_instance,
+        }
+        instance_service.get_cached_driver = self._get_driver
+        instance_service._run_instance_action = self._run_action
+        instance_service.destroy_instance = self._destroy
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(instance_service, name, method)
+
+    def _get_driver(self, identity):
+        driver = FakeDriver(identity, self.instance_ids[identity.id])
+        self.drivers.append(driver)
+        return driver
+
+    def _run_action(self, user, identity, esh_driver, esh_instance,
+                    action_type, action_params):
+        self.actions.append((esh_driver, esh_instance.id,
+                             threading.current_thread().ident))
+        return action_type
+
+    def _destroy(self, user, identity_uuid, instance_id, esh_driver=None,
+                 esh_instance=None):
+        self.actions.append((esh_driver, instance_id,
+                             threading.current_thread().ident))
+
+    def _run(self, instance_actions):
+        return instance_service.run_instance_actions(
+            'user', instance_actions, concurrency=2)
+
+    def test_each_identity_runs_its_actions_with_its_driver(self):
+        outcomes = self._run([
+            (self.identities[0], 'instance-1', 'suspend', {}),
+            (self.identities[1], 'instance-3', 'reboot', {}),
+            (self.identities[0], 'instance-2', 'terminate', {})])
+        self.assertEquals(outcomes, [('suspend', None), ('reboot', None),
+                                     (None, None)])
+        self.assertEquals(len(self.drivers), 2)
+        for driver in self.drivers:
+            self.assertEquals(driver.list_count, 1)
+        driver_actions = [(driver.identity.id, instance_id)
+                          for (driver, instance_id, thread) in self.actions
+                          if driver.thread == thread]
+        self.assertEquals(sorted(driver_actions), [
+            (0, 'instance-1'), (0, 'instance-2'), (1, 'instance-3')])
+
+    def test_failures_are_returned_in_order(self):
+        self.instance_ids[1] = []
+        outcomes = self._run([
+            (self.identities[1], 'instance-3', 'reboot', {}),
+            (self.identities[0], 'instance-9', 'suspend', {}),
+            (self.identities[0], 'instance-1', 'suspend', {})])
+        self.assertEquals(str(outcomes[0][1][1]), "Cloud is down")
+        self.assertIsInstance(outcomes[1][1][1], InstanceDoesNotExist)
+        self.assertEquals(outcomes[2], ('suspend', None))
@@ -0,0 +1,309 @@
+import threading
+import uuid
+from datetime import timedelta
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory,\
+    IdentityFactory
+from core.models import Instance, InstanceAction, InstanceSource,\
+    InstanceStatus, InstanceStatusHistory, Size
+from core.models.size import _size_sync_map
+from service import monitoring
+
+
+class FakeInstance(object):
+
+    def __init__(self, instance_id, status='active', task=None):
+        self.id = instance_id
+        self.extra = {'status': status, 'task': task}
+
+
+class FakeDriver(object):
+
+    def __init__(self, *listings):
+        self.listings = list(listings)
+        self.list_count = 0
+
+    def list_instances(self):
+        self.list_count += 1
+        if len(self.listings) > 1:
+            return self.listings.pop(0)
+        return self.listings[0]
+
+    def _is_active_instance(self, instance):
+        return instance.extra['status'] == 'active'
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class WaitForSettledInstancesTests(TestCase):
+
+    def setUp(self):
+        self.fake_time = FakeTime()
+        self._time = monitoring.time
+        monitoring.time = self.fake_time
+
+    def tearDown(self):
+        monitoring.time = self._time
+
+    def test_waits_until_every_instance_settles(self):
+        driver = FakeDriver(
+            [FakeInstance('1', 'suspended'), FakeInstance('2')],
+            [FakeInstance('1', 'suspended'),
+             FakeInstance('2', 'suspended', 'suspending')],
+            [FakeInstance('1', 'suspended'), FakeInstance('2', 'suspended'),
+             FakeInstance('other')])
+        instances = monitoring._wait_for_settled_instances(driver, ['1', '2'])
+        self.assertEquals([instance.id for instance in instances], ['1', '2'])
+        self.assertEquals(driver.list_count, 3)
+        self.assertEquals(self.fake_time.sleeps, [1, 2])
+
+    def test_gives_up_at_the_deadline(self):
+        driver = FakeDriver([FakeInstance('1')])
+        instances = monitoring._wait_for_settled_instances(
+            driver, ['1'], wait_until=self.fake_time.now + 30)
+        self.assertEquals([instance.id for instance in instances], ['1'])
+        self.assertEquals(self.fake_time.now, 1030.0)
+        self.assertTrue(all(
+            seconds <= monitoring.OVER_ALLOCATION_MAX_POLL_DELAY
+            for seconds in self.fake_time.sleeps))
+
+
+@override_settings(USE_ALLOCATION_LEDGER=False)
+class GetAllocationResultsForTests(TestCase):
+
+    def setUp(self):
+        self._patched = {
+            '_get_identity_from_tenant_name':
+                monitoring._get_identity_from_tenant_name,
+            '_get_allocation_input': monitoring._get_allocation_input,
+            'calculate_allocations': monitoring.calculate_allocations,
+        }
+        monitoring._get_identity_from_tenant_name = \
+            lambda provider, username: username
+        monitoring._get_allocation_input = self._get_allocation_input
+        monitoring.calculate_allocations = \
+            lambda inputs, print_logs=False: [
+                '%s result' % username for username in inputs]
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(monitoring, name, method)
+
+    def _get_allocation_input(self, identity):
+        if identity == 'broken':
+            raise Exception("Cloud is down")
+        return identity
+
+    def test_failing_usernames_are_left_out(self):
+        self.assertEquals(
+            monitoring.get_allocation_results_for(
+                'provider', ['user', 'broken', 'other']),
+            {'user': 'user result', 'other': 'other result'})
+
+
+class ProviderOverAllocationEnforcementTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.provider.over_allocation_action = \
+            InstanceAction.objects.get_or_create(name='Suspend')[0]
+        self.provider.save()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.driver = FakeDriver(
+            [FakeInstance('1'), FakeInstance('2'), FakeInstance('3'),
+             FakeInstance('shutoff', 'shutoff')],
+            [FakeInstance('1', 'suspended'), FakeInstance('2', 'suspended'),
+             FakeInstance('3', 'suspended')])
+        self.actions = []
+        self.converted = []
+        self.failing = {}
+        self.all_started = threading.Event()
+        self._patched = {
+            'get_cached_driver': monitoring.get_cached_driver,
+            '_execute_provider_action': monitoring._execute_provider_action,
+            'convert_esh_instance': monitoring.convert_esh_instance,
+        }
+        monitoring.get_cached_driver = lambda **kwargs: self.driver
+        monitoring._execute_provider_action = self._fake_action
+        monitoring.convert_esh_instance = \
+            lambda driver, esh, *args: self.converted.append(esh.id)
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(monitoring, name, method)
+
+    def _fake_action(self, identity, user, instance, action_name):
+        self.actions.append(
+            (instance.id, action_name, threading.current_thread().name))
+        if len(self.actions) == 3:
+            self.all_started.set()
+        # Only returns early when the actions are NOT run concurrently
+        self.all_started.wait(5)
+        if instance.id in self.failing:
+            raise Exception(self.failing[instance.id])
+
+    def test_active_instances_are_acted_on_concurrently(self):
+        self.assertTrue(monitoring.provider_over_allocation_enforcement(
+            self.identity, self.user))
+        self.assertEquals(sorted(action[:2] for action in self.actions),
+                          [('1', 'Suspend'), ('2', 'Suspend'),
+                           ('3', 'Suspend')])
+        self.assertEquals(len(set(action[2] for action in self.actions)), 3)
+        # The settled state of each instance is recorded
+        self.assertEquals(sorted(self.converted), ['1', '2', '3'])
+
+    def test_single_thread_acts_on_the_calling_thread(self):
+        self.all_started.set()
+        self.assertTrue(monitoring.provider_over_allocation_enforcement(
+            self.identity, self.user, concurrency=1))
+        self.assertEquals(
+            set(action[2] for action in self.actions),
+            set([threading.current_thread().name]))
+        self.assertEquals(sorted(self.converted), ['1', '2', '3'])
+
+    def test_instances_already_in_state_are_ignored(self):
+        self.failing = {'2': "Cannot 'suspend' instance while it is "
+                             "in vm_state suspended"}
+        self.assertTrue(monitoring.provider_over_allocation_enforcement(
+            self.identity, self.user))
+        self.assertEquals(sorted(self.converted), ['1', '3'])
+
+    def test_failures_are_raised_after_the_rest_are_recorded(self):
+        self.failing = {'2': "Cloud is down"}
+        with self.assertRaises(Exception):
+            monitoring.provider_over_allocation_enforcement(
+                self.identity, self.user)
+        self.assertEquals(sorted(self.converted), ['1', '3'])
+
+
+class FakeSize(object):
+
+    def __init__(self, alias, cpu=1):
+        self.id = alias
+        self.name = 'size %s' % alias
+        self.disk = 10
+        self.ephemeral = 0
+        self.cpu = cpu
+        self.ram = 1024
+
+
+class FakeSizeDriver(object):
+
+    def __init__(self):
+        self.sizes_looked_up = []
+
+    def get_size(self, alias):
+        self.sizes_looked_up.append(alias)
+        return FakeSize(alias, cpu=int(alias))
+
+
+class EshInstance(object):
+
+    def __init__(self, instance_id, size_alias, status='active'):
+        self.id = instance_id
+        self.size = FakeSize(size_alias, cpu=int(size_alias))
+        self.extra = {'status': status}
+
+
+class InstanceSyncTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.identity = IdentityFactory.create(
+            provider=self.provider, created_by=self.user)
+        self.size = Size.objects.create(
+            alias='1', name='size 1', provider=self.provider,
+            cpu=1, mem=1024, disk=10, root=0)
+        self.driver = FakeSizeDriver()
+        self._get_cached_driver = monitoring.get_cached_driver
+        monitoring.get_cached_driver = lambda **kwargs: self.driver
+        _size_sync_map.clear()
+
+    def tearDown(self):
+        monitoring.get_cached_driver = self._get_cached_driver
+        _size_sync_map.clear()
+
+    def _create_instance(self, *statuses):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()))
+        instance = Instance.objects.create(
+            name='instance', source=source,
+            provider_alias=str(uuid.uuid4()), created_by=self.user,
+            created_by_identity=self.identity,
+            start_date=timezone.now() - timedelta(days=1))
+        for status in statuses or ['active']:
+            InstanceStatusHistory.objects.create(
+                instance=instance, size=self.size,
+                status=InstanceStatus.objects.get_or_create(
+                    name=status)[0],
+                start_date=instance.start_date)
+        return instance
+
+    def _open_histories(self, instance):
+        return [history.status.name for history in
+                instance.instancestatushistory_set.filter(end_date=None)]
+
+    def test_update_instances(self):
+        missing = self._create_instance()
+        resized = self._create_instance()
+        suspended = self._create_instance()
+        monitoring.update_instances(
+            self.driver, self.identity,
+            [EshInstance(resized.provider_alias, '2'),
+             EshInstance(suspended.provider_alias, '2', 'suspended')],
+            [missing, resized, suspended])
+        # Each size is looked up once
+        self.assertEquals(self.driver.sizes_looked_up, ['2'])
+        self.assertIsNotNone(Instance.objects.get(id=missing.id).end_date)
+        self.assertEquals(self._open_histories(missing), [])
+        self.assertEquals(
+            resized.get_last_history().size.alias, '2')
+        self.assertEquals(self._open_histories(suspended), ['suspended'])
+
+    def test_cleanup_missing_instances(self):
+        missing = self._create_instance()
+        running = self._create_instance()
+        running.esh = EshInstance(running.provider_alias, '1')
+        instances = monitoring._cleanup_missing_instances(
+            self.identity, [running])
+        self.assertEquals(instances, [running])
+        self.assertIsNotNone(Instance.objects.get(id=missing.id).end_date)
+        self.assertEquals(self._open_histories(missing), [])
+        self.assertEquals(self._open_histories(running), ['active'])
+
+    def test_conflicting_histories_are_resolved(self):
+        conflicted = self._create_instance('active', 'suspended')
+        conflicted.esh = EshInstance(
+            conflicted.provider_alias, '1', 'suspended')
+        monitoring._cleanup_missing_instances(self.identity, [conflicted])
+        self.assertEquals(self._open_histories(conflicted), ['suspended'])
+        self.assertEquals(
+            conflicted.instancestatushistory_set.exclude(
+                end_date=None).count(), 2)
+
+    def test_conflicts_need_the_esh_instance(self):
+        conflicted = self._create_instance('active', 'suspended')
+        with self.assertRaises(ValueError):
+            monitoring._resolve_history_conflicts(
+                self.identity,
+                [(conflicted,
+                  list(conflicted.instancestatushistory_set.all()))])
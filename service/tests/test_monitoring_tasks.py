@@ -0,0 +1,385 @@
+import threading
+import uuid
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.tests.factories import ProviderFactory, UserFactory,\
+    GroupFactory, IdentityFactory, IdentityMembershipFactory,\
+    QuotaFactory, ImageFactory
+from core.models import Application, ApplicationMembership,\
+    ApplicationVersion, Credential, InstanceSource, ProviderMachine
+from service import cache
+from service.tasks import monitoring as monitoring_tasks
+from service.tests.fake_redis import FakeRedis
+
+
+class ConcurrentCalls(object):
+    """
+    Record each call, and block until 'expected' calls have started,
+    so the calls can only finish when they are run concurrently.
+    """
+
+    def __init__(self, expected, failing=()):
+        self.expected = expected
+        self.failing = failing
+        self.calls = []
+        self.all_started = threading.Event()
+
+    def __call__(self, *args):
+        username = args[1]
+        self.calls.append((args, threading.current_thread().name))
+        if len(self.calls) == self.expected:
+            self.all_started.set()
+        self.all_started.wait(5)
+        if username in self.failing:
+            raise Exception("Cloud is down")
+        return username != 'idle'
+
+    def thread_count(self):
+        return len(set(thread for (_, thread) in self.calls))
+
+
+class MonitorUsersForTests(TestCase):
+
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+        self._monitor_user_instances = \
+            monitoring_tasks._monitor_user_instances
+
+    def tearDown(self):
+        monitoring_tasks._monitor_user_instances = \
+            self._monitor_user_instances
+
+    def test_users_are_monitored_concurrently(self):
+        monitor = ConcurrentCalls(3, failing=['broken'])
+        monitoring_tasks._monitor_user_instances = monitor
+        instance_map = {'user': ['instance'], 'idle': [], 'broken': []}
+        self.assertEquals(
+            monitoring_tasks._monitor_users_for(
+                self.provider, instance_map, concurrency=3),
+            ['user'])
+        self.assertEquals(monitor.thread_count(), 3)
+
+
+class EnforceAllocationsForTests(TestCase):
+
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+        self._user_over_allocation_enforcement = \
+            monitoring_tasks.user_over_allocation_enforcement
+
+    def tearDown(self):
+        monitoring_tasks.user_over_allocation_enforcement = \
+            self._user_over_allocation_enforcement
+
+    def test_users_are_enforced_concurrently_with_one_wait(self):
+        enforce = ConcurrentCalls(3, failing=['broken'])
+        monitoring_tasks.user_over_allocation_enforcement = enforce
+        monitoring_tasks._enforce_allocations_for(
+            self.provider, ['user', 'other', 'broken'],
+            {'user': 'user result'}, concurrency=3)
+        self.assertEquals(enforce.thread_count(), 3)
+        calls = dict((args[1], args) for (args, _) in enforce.calls)
+        self.assertEquals(sorted(calls.keys()), ['broken', 'other', 'user'])
+        self.assertEquals(calls['user'][5], 'user result')
+        self.assertIsNone(calls['other'][5])
+        # Every user shares the same deadline
+        self.assertEquals(
+            len(set(args[6] for args in calls.values())), 1)
+        # Instance actions share what is left of the thread budget
+        self.assertEquals(
+            set(args[7] for args in calls.values()),
+            set([max(1, monitoring_tasks.settings
+                     .OVER_ALLOCATION_ACTION_CONCURRENCY // 3)]))
+
+
+class ApplicationMembershipTestCase(TestCase):
+
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+        self.quota = QuotaFactory.create()
+        self.creator = UserFactory.create()
+        self.creator_group = GroupFactory.create(name=self.creator.username)
+        self.application = ImageFactory.create(
+            created_by=self.creator, private=True)
+        (self.member, self.member_group) = self._create_identity('member')
+        (self.former, self.former_group) = self._create_identity('former')
+        self.editor_group = self._create_identity('editor')[1]
+        for (group, can_edit) in ((self.creator_group, False),
+                                  (self.former_group, False),
+                                  (self.editor_group, True)):
+            ApplicationMembership.objects.create(
+                application=self.application, group=group,
+                can_edit=can_edit)
+
+    def _create_identity(self, name, provider=None):
+        user = UserFactory.create(username=name)
+        group = GroupFactory.create(name=name)
+        identity = IdentityFactory.create(
+            provider=provider or self.provider, created_by=user)
+        IdentityMembershipFactory.create(
+            member=group, identity=identity, quota=self.quota)
+        Credential.objects.create(
+            identity=identity, key='ex_tenant_name', value=name)
+        return (identity, group)
+
+    def _member_groups(self):
+        return sorted(ApplicationMembership.objects.filter(
+            application=self.application).values_list(
+            'group__name', flat=True))
+
+
+class SyncApplicationMembershipsTests(ApplicationMembershipTestCase):
+
+    def test_memberships_follow_the_cloud(self):
+        monitoring_tasks.sync_application_memberships(
+            {self.application: [self.member]}, self.provider)
+        self.assertEquals(
+            self._member_groups(),
+            sorted([self.creator.username, 'editor', 'member']))
+
+    def test_identities_on_other_providers_are_ignored(self):
+        other_provider = ProviderFactory.create()
+        # Same tenant name, different project
+        (elsewhere, _) = self._create_identity('elsewhere', other_provider)
+        elsewhere.credential_set.filter(key='ex_tenant_name').update(
+            value='member')
+        # Still a member of the image, but only on the other provider
+        former_elsewhere = IdentityFactory.create(
+            provider=other_provider, created_by=self.former.created_by)
+        IdentityMembershipFactory.create(
+            member=self.former_group, identity=former_elsewhere,
+            quota=self.quota)
+        monitoring_tasks.sync_application_memberships(
+            {self.application: [self.member, elsewhere, former_elsewhere]},
+            self.provider)
+        self.assertEquals(
+            self._member_groups(),
+            sorted([self.creator.username, 'editor', 'member']))
+
+    def test_incomplete_apps_only_gain_members(self):
+        monitoring_tasks.sync_application_memberships(
+            {self.application: [self.member]}, self.provider,
+            incomplete_app_ids=set([self.application.id]))
+        self.assertEquals(
+            self._member_groups(),
+            sorted([self.creator.username, 'editor', 'former', 'member']))
+
+    def test_dry_run_changes_nothing(self):
+        monitoring_tasks.sync_application_memberships(
+            {self.application: [self.member]}, self.provider, dry_run=True)
+        self.assertEquals(
+            self._member_groups(),
+            sorted([self.creator.username, 'editor', 'former']))
+
+
+class FakeCloudMachine(dict):
+
+    def __init__(self, image_id, visibility='private'):
+        super(FakeCloudMachine, self).__init__(visibility=visibility)
+        self.id = image_id
+        self.name = image_id
+
+
+class FakeTenantDirectory(object):
+
+    def get_name(self, tenant_id):
+        return tenant_id
+
+
+class FakeMembership(object):
+
+    def __init__(self, member_id):
+        self.member_id = member_id
+
+
+class FakeAccountDriver(object):
+
+    def __init__(self, image_members):
+        self.image_members = image_members
+
+    def get_tenant_directory(self):
+        return FakeTenantDirectory()
+
+    def list_all_images(self):
+        return [FakeCloudMachine(image_id) for image_id in
+                sorted(self.image_members)]
+
+    def list_image_members(self, image_id):
+        tenant_names = self.image_members[image_id]
+        if tenant_names is None:
+            raise Exception("Glance is down")
+        return [FakeMembership(tenant_name) for tenant_name in tenant_names]
+
+
+class FakeProviderMachine(object):
+
+    def __init__(self, application):
+        self.application_version = type(
+            'FakeVersion', (object,), {'application': application})
+
+
+class PublicAndPrivateAppsTests(ApplicationMembershipTestCase):
+
+    def setUp(self):
+        super(PublicAndPrivateAppsTests, self).setUp()
+        self.other_application = ImageFactory.create(
+            created_by=self.creator, private=True)
+        self.image_apps = {'image-1': self.application,
+                           'image-2': self.application,
+                           'image-3': self.other_application}
+        self._patched = {
+            'get_account_driver': monitoring_tasks.get_account_driver,
+            'get_or_create_provider_machine':
+                monitoring_tasks.get_or_create_provider_machine,
+        }
+        monitoring_tasks.get_or_create_provider_machine = \
+            lambda image_id, name, provider_uuid: FakeProviderMachine(
+                self.image_apps[image_id])
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(monitoring_tasks, name, method)
+
+    def _get_apps(self, image_members):
+        monitoring_tasks.get_account_driver = \
+            lambda provider: FakeAccountDriver(image_members)
+        return monitoring_tasks.get_public_and_private_apps(self.provider)
+
+    def test_members_of_every_image_are_found(self):
+        (public_apps, private_apps, incomplete_app_ids) = self._get_apps(
+            {'image-1': ['member'], 'image-2': ['former'], 'image-3': []})
+        self.assertEquals(public_apps, [])
+        self.assertEquals(
+            private_apps,
+            {self.application: sorted([self.member, self.former],
+                                      key=lambda identity: identity.id),
+             self.other_application: []})
+        self.assertEquals(incomplete_app_ids, set())
+
+    def test_failed_image_keeps_the_app_memberships(self):
+        (public_apps, private_apps, incomplete_app_ids) = self._get_apps(
+            {'image-1': ['member'], 'image-2': None, 'image-3': []})
+        self.assertEquals(private_apps[self.application], [self.member])
+        self.assertEquals(incomplete_app_ids, set([self.application.id]))
+        monitoring_tasks.sync_application_memberships(
+            private_apps, self.provider,
+            incomplete_app_ids=incomplete_app_ids)
+        self.assertEquals(
+            self._member_groups(),
+            sorted([self.creator.username, 'editor', 'former', 'member']))
+
+
+class FakeImageAccountDriver(object):
+
+    def __init__(self, image_ids):
+        self.image_ids = image_ids
+
+    def list_all_images(self, force=False):
+        return [FakeCloudMachine(image_id) for image_id in self.image_ids]
+
+
+class PruneMachinesForTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.start_date = timezone.now() - timedelta(days=1)
+        # An app keeping one of its two machines
+        self.kept_app = self._create_app()
+        self.kept_version = self._create_version(self.kept_app)
+        self.missing_machine = self._create_machine(self.kept_version)
+        self.kept_machine = self._create_machine(self.kept_version)
+        # An app losing its only machine
+        self.pruned_app = self._create_app()
+        self.pruned_version = self._create_version(self.pruned_app)
+        self.pruned_machine = self._create_machine(self.pruned_version)
+        # Outliers: A version without machines, an app without versions
+        self.empty_version = self._create_version(self._create_app())
+        self.empty_app = self._create_app()
+        # An end-dated app, with an active version and machine
+        self.improper_app = self._create_app(end_date=self.start_date)
+        self.improper_version = self._create_version(self.improper_app)
+        self.improper_machine = self._create_machine(self.improper_version)
+        self._get_account_driver = monitoring_tasks.get_account_driver
+        cloud_ids = [self.kept_machine.identifier,
+                     self.improper_machine.identifier]
+        monitoring_tasks.get_account_driver = \
+            lambda provider: FakeImageAccountDriver(cloud_ids)
+
+    def tearDown(self):
+        monitoring_tasks.get_account_driver = self._get_account_driver
+        cache.connection = self._connection
+
+    def _create_app(self, end_date=None):
+        return ImageFactory.create(
+            created_by=self.user, start_date=self.start_date,
+            end_date=end_date)
+
+    def _create_version(self, application):
+        return ApplicationVersion.objects.create(
+            application=application, name='1.0', created_by=self.user,
+            start_date=self.start_date)
+
+    def _create_machine(self, version):
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()),
+            start_date=self.start_date)
+        return ProviderMachine.objects.create(
+            instance_source=source, application_version=version)
+
+    def _end_dated(self, model, objects):
+        return [model.objects.get(id=obj.id).end_date is not None
+                for obj in objects]
+
+    def _source_end_dated(self, machines):
+        return [InstanceSource.objects.get(
+            id=machine.instance_source.id).end_date is not None
+            for machine in machines]
+
+    def test_missing_machines_cascade(self):
+        summary = monitoring_tasks.prune_machines_for(self.provider.id)
+        self.assertEquals(
+            summary, {'machines': 3, 'versions': 3, 'applications': 3})
+        self.assertEquals(
+            self._source_end_dated([
+                self.missing_machine, self.kept_machine,
+                self.pruned_machine, self.improper_machine]),
+            [True, False, True, True])
+        self.assertEquals(
+            self._end_dated(ApplicationVersion, [
+                self.kept_version, self.pruned_version,
+                self.empty_version, self.improper_version]),
+            [False, True, True, True])
+        self.assertEquals(
+            self._end_dated(Application, [
+                self.kept_app, self.pruned_app, self.empty_app]),
+            [False, True, True])
+
+    def test_dry_run_writes_nothing(self):
+        self.redis.data.clear()
+        with CaptureQueriesContext(connection) as context:
+            summary = monitoring_tasks.prune_machines_for(
+                self.provider.id, dry_run=True)
+        self.assertEquals(
+            summary, {'machines': 3, 'versions': 3, 'applications': 3})
+        self.assertEquals(
+            [query['sql'] for query in context.captured_queries
+             if any(write in query['sql'] for write in
+                    ('INSERT INTO', 'UPDATE "', 'DELETE FROM'))], [])
+        self.assertEquals(
+            self._source_end_dated([
+                self.missing_machine, self.pruned_machine,
+                self.improper_machine]),
+            [False, False, False])
+        self.assertEquals(
+            self._end_dated(Application, [self.pruned_app, self.empty_app]),
+            [False, False])
+        self.assertEquals(self.redis.data, {})
@@ -0,0 +1,41 @@
+import uuid
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import UserFactory, ProviderFactory, ImageFactory
+from core.models import ApplicationVersion, InstanceSource, ProviderMachine
+from service.search import IndexedApplicationSearch
+
+
+class IndexedApplicationSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.provider = ProviderFactory.create()
+        self.current = self._create_image('Ubuntu current')
+        self.retired = self._create_image('Ubuntu retired')
+
+    def _create_image(self, name):
+        start_date = timezone.now() - timedelta(days=1)
+        image = ImageFactory.create(
+            name=name, created_by=self.user, private=False,
+            start_date=start_date)
+        version = ApplicationVersion.objects.create(
+            application=image, name='1.0', created_by=self.user,
+            start_date=start_date)
+        source = InstanceSource.objects.create(
+            provider=self.provider, identifier=str(uuid.uuid4()),
+            start_date=start_date)
+        ProviderMachine.objects.create(
+            instance_source=source, application_version=version)
+        return image
+
+    def test_only_current_applications_are_found(self):
+        machine = ProviderMachine.objects.get(
+            application_version__application=self.retired)
+        machine.instance_source.end_date = timezone.now()
+        machine.instance_source.save()
+        self.assertEquals(
+            list(IndexedApplicationSearch.search('ubuntu')), [self.current])
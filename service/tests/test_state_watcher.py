@@ -0,0 +1,128 @@
+import threading
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from service import cache
+from service import state_watcher
+from service.state_watcher import InstanceEvent, InstanceStateWatcher,\
+    LocalEventSource, INSTANCE_WAITERS_KEY
+from service.tasks import driver as driver_tasks
+from service.tests.fake_redis import FakeRedis
+
+
+class StateWatcherTests(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self._connection = cache.connection
+        cache.connection = self.redis
+        self.source = LocalEventSource()
+        self.watcher = InstanceStateWatcher(self.source)
+
+    def tearDown(self):
+        cache.connection = self._connection
+
+    def _is_active(self, state):
+        return state and state['status'] == 'active'
+
+    def _wait_in_thread(self, timeout):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            state_watcher.wait_for_instance_state(
+                'instance-1', self._is_active, timeout=timeout)))
+        thread.start()
+        return (thread, results)
+
+    def _wait_for_waiter(self):
+        waiters_key = INSTANCE_WAITERS_KEY.format('instance-1')
+        for _ in range(500):
+            if self.redis.smembers(waiters_key):
+                return
+            threading.Event().wait(0.01)
+        self.fail("The task never started waiting")
+
+    def test_event_wakes_the_waiting_task(self):
+        (thread, results) = self._wait_in_thread(timeout=30)
+        self._wait_for_waiter()
+        self.source.put(InstanceEvent('instance-1', 'ACTIVE'))
+        self.source.stop()
+        self.watcher.run()
+        thread.join(10)
+        self.assertEquals(results, [True])
+        self.assertEquals(len(self.redis.blocking_timeouts), 1)
+        self.assertEquals(
+            self.redis.smembers(INSTANCE_WAITERS_KEY.format('instance-1')),
+            set())
+
+    def test_recorded_state_returns_right_away(self):
+        self.source.put(InstanceEvent('instance-1', 'active'))
+        self.source.stop()
+        self.watcher.run()
+        self.assertTrue(state_watcher.wait_for_instance_state(
+            'instance-1', self._is_active, timeout=30))
+        self.assertEquals(self.redis.blocking_timeouts, [])
+
+    def test_not_ready_at_the_timeout(self):
+        self.source.put(InstanceEvent('instance-1', 'build', 'spawning'))
+        self.source.stop()
+        self.watcher.run()
+        self.assertFalse(state_watcher.wait_for_instance_state(
+            'instance-1', self._is_active, timeout=1))
+
+    def test_blocking_reads_end_before_the_socket_times_out(self):
+        with override_settings(CLOUD_CACHE_SOCKET_TIMEOUT=2):
+            self.assertFalse(state_watcher.wait_for_instance_state(
+                'instance-1', self._is_active, timeout=2))
+        self.assertTrue(all(
+            timeout < 2 for timeout in self.redis.blocking_timeouts))
+        self.assertLess(state_watcher._get_wake_interval(),
+                        settings.CLOUD_CACHE_SOCKET_TIMEOUT)
+
+    def test_redis_errors_fall_back_to_the_cloud(self):
+        self.redis.down = True
+        self.assertTrue(state_watcher.wait_for_instance_state(
+            'instance-1', self._is_active, timeout=30))
+
+
+@override_settings(
+    INSTANCE_STATE_WATCHER='service.state_watcher.LocalEventSource')
+class WaitForInstanceTests(TestCase):
+
+    def setUp(self):
+        self._patched = {
+            'wait_for_instance_state': driver_tasks.wait_for_instance_state,
+            '_is_instance_ready': driver_tasks._is_instance_ready,
+        }
+        self.watched = []
+        driver_tasks.wait_for_instance_state = \
+            lambda instance_alias, is_ready: self.watched.append(
+                instance_alias)
+        driver_tasks._is_instance_ready = \
+            lambda *args: 'instance-1'
+
+    def tearDown(self):
+        for (name, method) in self._patched.items():
+            setattr(driver_tasks, name, method)
+
+    def test_cloud_is_asked_when_the_watcher_times_out(self):
+        self.assertEquals(
+            driver_tasks.wait_for_instance(
+                'instance-1', 'driverCls', 'provider', 'identity', 'active',
+                return_id=True),
+            'instance-1')
+        self.assertEquals(self.watched, ['instance-1'])
+
+    def test_retries_do_not_wait_on_the_watcher(self):
+        # Calling the task would push a new (first attempt) request
+        driver_tasks.wait_for_instance.push_request(retries=1)
+        try:
+            self.assertEquals(
+                driver_tasks.wait_for_instance.run(
+                    'instance-1', 'driverCls', 'provider', 'identity',
+                    'active', return_id=True),
+                'instance-1')
+        finally:
+            driver_tasks.wait_for_instance.pop_request()
+        self.assertEquals(self.watched, [])
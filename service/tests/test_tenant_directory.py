@@ -0,0 +1,63 @@
+from django.test import TestCase
+
+from service.accounts.openstack_manager import TenantDirectory
+from service.monitoring import _convert_tenant_id_to_names
+
+
+class FakeProject(object):
+
+    def __init__(self, project_id, name):
+        self.id = project_id
+        self.name = name
+
+
+class FakeInstance(object):
+
+    def __init__(self, owner):
+        self.owner = owner
+
+
+class FakeAccountDriver(object):
+
+    def __init__(self, projects):
+        self.projects = projects
+        self.list_calls = []
+
+    def list_projects(self, force=False):
+        self.list_calls.append(force)
+        return list(self.projects)
+
+
+class TenantDirectoryTests(TestCase):
+
+    def setUp(self):
+        self.account_driver = FakeAccountDriver([
+            FakeProject('tenant-1', 'first'),
+            FakeProject('tenant-2', 'second')])
+        self.directory = TenantDirectory(self.account_driver)
+
+    def test_projects_are_indexed_by_id_and_name(self):
+        self.assertEquals(self.directory.get_by_id('tenant-2').name,
+                          'second')
+        self.assertEquals(self.directory.get_by_name('first').id, 'tenant-1')
+        self.assertEquals(self.directory.get_name('tenant-1'), 'first')
+        self.assertEquals(self.directory.id_to_name_map(),
+                          {'tenant-1': 'first', 'tenant-2': 'second'})
+        self.assertEquals(self.account_driver.list_calls, [False])
+
+    def test_unknown_tenant_refreshes_once(self):
+        self.account_driver.projects.append(FakeProject('tenant-3', 'third'))
+        self.assertEquals(self.directory.get_name('tenant-3'), 'third')
+        self.assertEquals(self.account_driver.list_calls, [False, True])
+        self.assertIsNone(self.directory.get_name('tenant-4'))
+        self.assertIsNone(self.directory.get_by_name('fourth'))
+        self.assertEquals(self.account_driver.list_calls, [False, True])
+        self.assertEquals(len(self.directory.all()), 3)
+
+    def test_instance_owners_are_converted_to_names(self):
+        instances = _convert_tenant_id_to_names(
+            [FakeInstance('tenant-1'), FakeInstance('tenant-9')],
+            self.directory)
+        self.assertEquals([instance.owner for instance in instances],
+                          ['first', 'tenant-9'])
+        self.assertEquals(self.account_driver.list_calls, [False, True])